@@ -1,26 +1,70 @@
 #!/usr/bin/env -S uv run
 # /// script
-# requires-python = ">=3.10"
+# requires-python = ">=3.11"
 # dependencies = [
 #   "fastapi==0.115.0",
 #   "uvicorn[standard]==0.30.6",
 #   "python-multipart==0.0.9",
 #   "python-dotenv==1.0.1",
+#   "prometheus-client==0.21.0",
+#   "pypdf==5.1.0",
+#   "pillow==11.0.0",
 # ]
 # ///
 
 import os
+import re
+import sys
+import ssl
+import json
+import base64
+import signal
+import shlex
+import socket
+import time
+import heapq
+import queue
+import random
+import select
+import sqlite3
+import uuid
+import shutil
+import io
+import html
+import hashlib
+import hmac
+import math
+import secrets
+import zipfile
+import posixpath
+import collections
+import threading
+import asyncio
 import tempfile
 import subprocess
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass, field
 from pathlib import Path
+from functools import lru_cache
+from datetime import datetime, timezone
 from typing import Optional
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape, quoteattr
 
-from fastapi import FastAPI, UploadFile, File, Header, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Header, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, Response
+from multipart.exceptions import MultipartParseError
+from multipart.multipart import MultipartParser, parse_options_header
 
 import smtplib
 from email.message import EmailMessage
+from email.policy import SMTP as SMTP_POLICY
+
+from PIL import Image
+from pypdf import PdfReader, PdfWriter
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
 
 from dotenv import load_dotenv
 load_dotenv()
@@ -29,6 +73,12 @@ logger = logging.getLogger("pdf2epub")
 
 BEARER_TOKEN = os.environ.get("BEARER_TOKEN", "change-me")
 KINDLE_EMAIL = os.environ.get("KINDLE_EMAIL", "change-me")
+# token registry: hashed tokens with owner, Kindle address(es) and quotas; JSON, or SQLite for .db/.sqlite/.sqlite3.
+# Empty: BEARER_TOKEN is the only token and delivers to KINDLE_EMAIL
+TOKENS_FILE = os.environ.get("TOKENS_FILE", "")
+TOKENS_RELOAD_SECONDS = float(os.environ.get("TOKENS_RELOAD_SECONDS", "2"))  # how often to check it for changes
+# HMAC key for BEARER_TOKEN's client id (logged and shown in /stats); random per start when empty
+TOKEN_ID_KEY = os.environ.get("TOKEN_ID_KEY", "") or secrets.token_hex(32)
 
 SMTP_HOST = os.environ.get("SMTP_HOST", "")
 SMTP_PORT = int(os.environ.get("SMTP_PORT", "587"))
@@ -36,15 +86,254 @@ SMTP_USER = os.environ.get("SMTP_USER", "")
 SMTP_PASS = os.environ.get("SMTP_PASS", "")
 SMTP_FROM = os.environ.get("SMTP_FROM", SMTP_USER or "noreply@example.com")
 SMTP_TLS = os.environ.get("SMTP_TLS", "true").lower() in ("1", "true", "yes")
+SMTP_ASYNC = os.environ.get("SMTP_ASYNC", "true").lower() in ("1", "true", "yes")  # false: smtplib in a thread
+SMTP_POOL_SIZE = int(os.environ.get("SMTP_POOL_SIZE", "2"))  # max concurrent SMTP sessions
+SMTP_POOL_IDLE_SECONDS = int(os.environ.get("SMTP_POOL_IDLE_SECONDS", "60"))  # drop warm sessions idle longer than this
+# the lower of the provider's and Send to Kindle's message size caps, measured on the wire (after base64)
+SMTP_MAX_MESSAGE_BYTES = int(os.environ.get("SMTP_MAX_MESSAGE_BYTES", str(25 * 1024 * 1024)))
+OVERSIZE_MAX_VOLUMES = int(os.environ.get("OVERSIZE_MAX_VOLUMES", "8"))  # split a too-large book into at most this many; 0 never splits
 
 EBOOK_CONVERT_BIN = os.environ.get("EBOOK_CONVERT_BIN", "ebook-convert")
 MAX_PDF_BYTES = int(os.environ.get("MAX_PDF_BYTES", str(25 * 1024 * 1024)))  # 25MB
+MAX_BATCH_FILES = int(os.environ.get("MAX_BATCH_FILES", "30"))  # PDFs per /convert/batch request
+MAX_BATCH_BYTES = int(os.environ.get("MAX_BATCH_BYTES", str(200 * 1024 * 1024)))  # whole /convert/batch upload
+CALIBRE_WARM_WORKERS = int(os.environ.get("CALIBRE_WARM_WORKERS", "0"))  # long-lived calibre-debug workers; 0 disables
+CALIBRE_DEBUG_BIN = os.environ.get("CALIBRE_DEBUG_BIN", "calibre-debug")
+CALIBRE_WORKER_MAX_JOBS = int(os.environ.get("CALIBRE_WORKER_MAX_JOBS", "50"))  # recycle a worker after this many conversions
+OUTPUT_PROFILE = os.environ.get("OUTPUT_PROFILE", "paperwhite")  # default for /convert; see OUTPUT_PROFILES
+CONVERT_ENGINE = os.environ.get("CONVERT_ENGINE", "auto")  # auto: native engine (child process) for plain-text PDFs, else calibre
+NATIVE_MAX_PAGES = int(os.environ.get("NATIVE_MAX_PAGES", "300"))
+NATIVE_MIN_CHARS_PER_PAGE = int(os.environ.get("NATIVE_MIN_CHARS_PER_PAGE", "40"))
+SHARD_MIN_PAGES = int(os.environ.get("SHARD_MIN_PAGES", "0"))  # split PDFs with at least this many pages; 0 disables
+SHARD_PAGES = int(os.environ.get("SHARD_PAGES", "100"))  # pages per shard
+SHARD_WORKERS = int(os.environ.get("SHARD_WORKERS", str(os.cpu_count() or 2)))  # shards converted at once per PDF
+# Post-conversion image pass tuned for e-ink: downsample to the device, grayscale, recompress
+IMAGE_OPTIMIZE = os.environ.get("IMAGE_OPTIMIZE", "true").lower() in ("1", "true", "yes")
+IMAGE_MAX_WIDTH = int(os.environ.get("IMAGE_MAX_WIDTH", "0"))  # 0: the output profile's screen size
+IMAGE_MAX_HEIGHT = int(os.environ.get("IMAGE_MAX_HEIGHT", "0"))
+IMAGE_GRAYSCALE = os.environ.get("IMAGE_GRAYSCALE", "true").lower() in ("1", "true", "yes")
+IMAGE_JPEG_QUALITY = int(os.environ.get("IMAGE_JPEG_QUALITY", "70"))
+IMAGE_PNG_COLORS = int(os.environ.get("IMAGE_PNG_COLORS", "16"))  # e-ink shows 16 grey levels
+IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", str(os.cpu_count() or 2)))
+CONVERT_TIMEOUT_SECONDS = float(os.environ.get("CONVERT_TIMEOUT_SECONDS", "300"))  # 0 disables the deadline
+# Per-conversion resource limits for calibre; 0/empty leaves a limit unset
+CONVERT_MAX_MEMORY_BYTES = int(os.environ.get("CONVERT_MAX_MEMORY_BYTES", "0"))  # RLIMIT_AS
+CONVERT_MAX_CPU_SECONDS = int(os.environ.get("CONVERT_MAX_CPU_SECONDS", "0"))  # RLIMIT_CPU
+CONVERT_MAX_OPEN_FILES = int(os.environ.get("CONVERT_MAX_OPEN_FILES", "0"))  # RLIMIT_NOFILE
+CONVERT_CGROUP = os.environ.get("CONVERT_CGROUP", "")  # writable cgroup v2 dir, e.g. /sys/fs/cgroup/pdf2epub.slice
+CONVERT_CGROUP_MEMORY_MAX = os.environ.get("CONVERT_CGROUP_MEMORY_MAX", "")  # memory.max for each conversion, e.g. 1G
+# Scratch space for uploads and calibre; point at tmpfs (e.g. /dev/shm/pdf2epub) to keep conversions off slow disks
+WORKSPACE_ROOT = os.environ.get("WORKSPACE_ROOT", "")  # empty: the system temp dir
+WORKSPACE_MIN_FREE_BYTES = int(os.environ.get("WORKSPACE_MIN_FREE_BYTES", str(64 * 1024 * 1024)))  # headroom left on WORKSPACE_ROOT
+WORKSPACE_SIZE_FACTOR = float(os.environ.get("WORKSPACE_SIZE_FACTOR", "4"))  # scratch bytes expected per input byte
+# State that has to survive a restart; relative paths are under the working directory
+DATA_DIR = os.environ.get("DATA_DIR") or "data"
+QUARANTINE_FILE = os.environ.get("QUARANTINE_FILE") or os.path.join(DATA_DIR, "quarantine.txt")
+CONVERT_WORKERS = int(os.environ.get("CONVERT_WORKERS", str(os.cpu_count() or 2)))
+CONVERT_SECONDS_PER_MB = float(os.environ.get("CONVERT_SECONDS_PER_MB", "4"))  # starting guess for wait estimates
+CONVERT_SECONDS_PER_JOB = float(os.environ.get("CONVERT_SECONDS_PER_JOB", "5"))  # ditto, fixed cost of any conversion
+CACHE_DIR = os.environ.get("CACHE_DIR") or os.path.join(DATA_DIR, "cache")
+CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_BYTES", str(500 * 1024 * 1024)))  # 0 disables the cache
+OUTBOX_ENABLED = os.environ.get("OUTBOX_ENABLED", "true").lower() in ("1", "true", "yes")
+OUTBOX_DIR = os.environ.get("OUTBOX_DIR") or os.path.join(DATA_DIR, "outbox")
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", "10"))
+OUTBOX_RETRY_BASE_SECONDS = float(os.environ.get("OUTBOX_RETRY_BASE_SECONDS", "15"))
+OUTBOX_RETRY_MAX_SECONDS = float(os.environ.get("OUTBOX_RETRY_MAX_SECONDS", "3600"))
+OUTBOX_RETENTION_SECONDS = float(os.environ.get("OUTBOX_RETENTION_SECONDS", str(7 * 24 * 3600)))  # keep sent/dead rows
+JOB_TTL_SECONDS = int(os.environ.get("JOB_TTL_SECONDS", "3600"))  # how long finished jobs stay queryable
+# per-client limits in front of /convert and /convert/batch; a token's own quotas override these
+RATE_LIMIT_PER_MINUTE = float(os.environ.get("RATE_LIMIT_PER_MINUTE", "0"))  # PDFs per minute; 0 disables
+RATE_LIMIT_BURST = int(os.environ.get("RATE_LIMIT_BURST", "10"))  # bucket size: PDFs allowed back to back
+MAX_CONCURRENT_PER_CLIENT = int(os.environ.get("MAX_CONCURRENT_PER_CLIENT", "0"))  # PDFs converting at once; 0 disables
+CONCURRENCY_RETRY_AFTER_SECONDS = int(os.environ.get("CONCURRENCY_RETRY_AFTER_SECONDS", "15"))
+
+
+STAGE_SECONDS = Histogram(
+    "pdf2epub_stage_seconds", "Time spent per pipeline stage", ["stage"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80, 160, 320),
+)
+BYTES_IN = Counter("pdf2epub_bytes_in_total", "PDF bytes received")
+BYTES_OUT = Counter("pdf2epub_bytes_out_total", "Converted bytes delivered by email")
+HTTP_ERRORS = Counter("pdf2epub_http_errors_total", "Error responses by status code", ["status"])
+JOB_FAILURES = Counter("pdf2epub_job_failures_total", "Failed jobs by the stage they failed in", ["stage"])
+CACHE_REQUESTS = Counter("pdf2epub_cache_requests_total", "Conversion cache lookups", ["result"])
+CONVERSIONS_QUEUED = Gauge("pdf2epub_conversions_queued", "Conversions waiting for a worker")
+CONVERSIONS_BY_ENGINE = Counter("pdf2epub_conversions_total", "Conversions by engine", ["engine"])
+CONVERSIONS_IN_FLIGHT = Gauge("pdf2epub_conversions_in_flight", "Conversions currently running")
+WORKSPACES = Counter("pdf2epub_workspaces_total", "Scratch workspaces created by backing store", ["backing"])
+OUTBOX_DEPTH = Gauge("pdf2epub_outbox_depth", "Deliveries waiting in the outbox")
+QUOTA_REJECTIONS = Counter("pdf2epub_quota_rejections_total", "Requests refused with 429 by the limit hit", ["limit"])
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    sender = None
+    await asyncio.to_thread(QUARANTINE.load)
+    await asyncio.to_thread(WARM_CALIBRE.start)
+    if OUTBOX_ENABLED:
+        await asyncio.to_thread(OUTBOX.open)
+        OUTBOX.wakeup = asyncio.Event()
+        sender = asyncio.create_task(outbox_sender())
+
+    yield
+
+    if sender is not None:
+        sender.cancel()
+    SMTP_POOL.close()
+    await ASYNC_SMTP_POOL.close()
+    await asyncio.to_thread(WARM_CALIBRE.close)
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.middleware("http")
+async def count_errors(request: Request, call_next):
+    response = await call_next(request)
+    if response.status_code >= 400:
+        HTTP_ERRORS.labels(str(response.status_code)).inc()
+    return response
+
+# calibre runs and SMTP deliveries block, so they run here instead of on the event loop.
+# Conversions get their own bounded pool so a burst of uploads can't starve email sends.
+CONVERT_EXECUTOR = ThreadPoolExecutor(max_workers=max(1, CONVERT_WORKERS), thread_name_prefix="convert")
+
+
+@dataclass(frozen=True)
+class Caller:
+    client_id: str  # the token's key id: stable and not secret
+    owner: str
+    recipients: tuple[str, ...]  # Kindle addresses this token delivers to
+    # quotas; None means the server-wide default
+    rate_per_minute: Optional[float] = None
+    burst: Optional[int] = None
+    max_concurrent: Optional[int] = None
+    admin: bool = False  # may see every client's entries in /stats
+
+
+def plain_token_id(token: str) -> str:
+    """Key id for a token that wasn't minted by new_token (BEARER_TOKEN).
 
+    Keyed with TOKEN_ID_KEY so the id, which is logged and shown in /stats, can't
+    be used to brute-force the token offline.
+    """
+    return hmac.new(TOKEN_ID_KEY.encode(), token.encode(), hashlib.sha256).hexdigest()[:16]
 
-app = FastAPI()
 
+def new_token(owner: str, recipients: list[str]) -> tuple[str, str, dict]:
+    """Mint an "<id>.<secret>" token. Returns the token, its key id and the registry entry,
+    which holds only the token's hash."""
+    key_id = secrets.token_hex(6)
+    token = f"{key_id}.{secrets.token_urlsafe(32)}"
+    entry = {"sha256": hashlib.sha256(token.encode()).hexdigest(), "owner": owner, "recipients": recipients}
+    return token, key_id, entry
 
-def require_bearer(authorization: Optional[str]) -> None:
+
+class TokenRegistry:
+    """Bearer tokens, stored only as SHA-256 hashes, keyed by key id: the part before
+    "." of an "<id>.<secret>" token from new_token, or plain_token_id for BEARER_TOKEN.
+
+    verify() is a dict lookup by key id plus one hmac.compare_digest against the
+    precomputed hash, so it costs the same for any number of tokens and leaks nothing
+    through timing. Unknown ids are compared against a dummy hash for the same reason.
+
+    Read from TOKENS_FILE and re-read when it changes, checked at most every
+    TOKENS_RELOAD_SECONDS, so clients can be added or revoked without a restart.
+    A JSON file is an object of key id -> {"sha256", "owner", "recipients",
+    optional "rate_per_minute", "burst", "max_concurrent", "admin"}; a SQLite file
+    (.db/.sqlite/.sqlite3) has a tokens table with those columns, recipients
+    comma-separated. A file that fails to load leaves the previous tokens in place.
+    With no file, BEARER_TOKEN is the only token and delivers to KINDLE_EMAIL.
+    """
+
+    SQLITE_SUFFIXES = (".db", ".sqlite", ".sqlite3")
+    _DUMMY_DIGEST = hashlib.sha256(b"").digest()
+
+    def __init__(self, path: Optional[Path]):
+        self.path = path
+        self._tokens: dict[str, tuple[bytes, Caller]] = {}
+        if path is None:
+            key_id = plain_token_id(BEARER_TOKEN)
+            self._tokens[key_id] = (hashlib.sha256(BEARER_TOKEN.encode()).digest(),
+                                    Caller(client_id=key_id, owner="default", recipients=(KINDLE_EMAIL,), admin=True))
+        self._version = None
+        self._checked_at = float("-inf")
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _current_version(self):
+        if self.path.suffix in self.SQLITE_SUFFIXES:
+            if self._db is None:
+                self._db = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+                self._db.row_factory = sqlite3.Row
+            # changes whenever another connection commits, WAL or not
+            return self._db.execute("PRAGMA data_version").fetchone()[0]
+        st = self.path.stat()
+        return st.st_mtime_ns, st.st_size
+
+    def _read(self) -> dict[str, tuple[bytes, Caller]]:
+        if self.path.suffix in self.SQLITE_SUFFIXES:
+            entries = {}
+            for row in self._db.execute("SELECT * FROM tokens"):
+                entry = dict(row)
+                entry["recipients"] = [a.strip() for a in (entry.get("recipients") or "").split(",") if a.strip()]
+                entries[entry.pop("id")] = entry
+        else:
+            entries = json.loads(self.path.read_text())
+            if not isinstance(entries, dict):
+                raise ValueError("expected a JSON object of key id -> token entry")
+
+        result = {}
+        for key_id, entry in entries.items():
+            recipients = entry.get("recipients")
+            recipients = (recipients,) if isinstance(recipients, str) else tuple(recipients or ())
+            digest = bytes.fromhex(entry.get("sha256") or "")
+            if len(digest) != 32 or not recipients or not all(isinstance(a, str) and "@" in a for a in recipients):
+                raise ValueError(f"bad entry for key id {key_id}")
+            result[key_id] = (digest, Caller(
+                client_id=key_id,
+                owner=entry.get("owner") or key_id,
+                recipients=recipients,
+                rate_per_minute=None if entry.get("rate_per_minute") is None else float(entry["rate_per_minute"]),
+                burst=None if entry.get("burst") is None else int(entry["burst"]),
+                max_concurrent=None if entry.get("max_concurrent") is None else int(entry["max_concurrent"]),
+                admin=bool(entry.get("admin")),
+            ))
+        return result
+
+    def _maybe_reload(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if self.path is None or now - self._checked_at < TOKENS_RELOAD_SECONDS:
+                return
+            self._checked_at = now
+            try:
+                version = self._current_version()
+                if version == self._version:
+                    return
+                self._version = version  # a broken file is retried once it changes again
+                self._tokens = self._read()
+                logger.info("tokens: loaded %d token(s) from %s", len(self._tokens), self.path)
+            except (OSError, ValueError, TypeError, AttributeError, sqlite3.Error):
+                logger.exception("tokens: could not load %s, keeping %d known token(s)", self.path, len(self._tokens))
+
+    def verify(self, token: str) -> Optional[Caller]:
+        self._maybe_reload()
+        key_id, dot, _ = token.partition(".")
+        # only minted tokens are split; a plain token may contain "." too, and its prefix is secret
+        if not (dot and key_id in self._tokens):
+            key_id = plain_token_id(token)
+        digest, caller = self._tokens.get(key_id, (self._DUMMY_DIGEST, None))
+        if hmac.compare_digest(hashlib.sha256(token.encode()).digest(), digest) and caller is not None:
+            return caller
+        return None
+
+
+TOKENS = TokenRegistry(Path(TOKENS_FILE) if TOKENS_FILE else None)
+
+
+def require_bearer(authorization: Optional[str]) -> Caller:
+    """Validate the Authorization header and return who the caller is and where their books go."""
     logger.info("auth: checking Authorization header")
 
     if not authorization:
@@ -60,202 +349,3134 @@ def require_bearer(authorization: Optional[str]) -> None:
         logger.warning("auth: Bearer token empty")
         raise HTTPException(status_code=401, detail="Missing bearer token")
 
-    if token != BEARER_TOKEN:
+    caller = TOKENS.verify(token)
+    if caller is None:
         logger.warning("auth: invalid bearer token")
         raise HTTPException(status_code=403, detail="Invalid bearer token")
 
-    logger.info("auth: ok")
+    logger.info("auth: ok client=%s owner=%s recipients=%d", caller.client_id, caller.owner, len(caller.recipients))
+    return caller
+
+
+class QuotaLease:
+    """A client's concurrency slots, one per PDF; release() is safe to call more than once."""
+
+    def __init__(self, quotas: "ClientQuotas", client_id: str):
+        self._quotas = quotas
+        self.client_id = client_id
+        self.slots = 1
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._quotas._release(self.client_id, self.slots)
+
+
+class ClientQuotas:
+    """Per-client token-bucket rate limit and concurrent-conversion cap.
+
+    admit() runs before any of the upload is read and refuses with 429 and
+    Retry-After when the client's bucket is empty or it already has
+    max_concurrent PDFs converting. Each PDF costs one token and one slot; a
+    batch pays for one up front and the rest once its size is known: take()
+    claims the extra slots or refuses the batch, and charge() the extra tokens,
+    which may leave the bucket in debt so the client waits that much longer
+    next time. Limits
+    come from the caller's token, falling back to RATE_LIMIT_PER_MINUTE,
+    RATE_LIMIT_BURST and MAX_CONCURRENT_PER_CLIENT. Event-loop only.
+    """
+
+    MAX_BUCKETS = 1024
+
+    def __init__(self):
+        self._buckets: dict[str, tuple[float, float]] = {}  # client -> (tokens, at)
+        self._active: dict[str, int] = {}
+
+    @staticmethod
+    def _limits(caller: Caller) -> tuple[float, int, int]:
+        rate = caller.rate_per_minute if caller.rate_per_minute is not None else RATE_LIMIT_PER_MINUTE
+        burst = caller.burst if caller.burst is not None else RATE_LIMIT_BURST
+        concurrent = caller.max_concurrent if caller.max_concurrent is not None else MAX_CONCURRENT_PER_CLIENT
+        return rate / 60, max(1, burst), concurrent
+
+    def _tokens(self, caller: Caller, now: float) -> float:
+        per_second, burst, _ = self._limits(caller)
+        tokens, at = self._buckets.get(caller.client_id, (burst, now))
+        return min(burst, tokens + (now - at) * per_second)
+
+    def admit(self, caller: Caller) -> QuotaLease:
+        per_second, _, concurrent = self._limits(caller)
+        if concurrent and self._active.get(caller.client_id, 0) >= concurrent:
+            QUOTA_REJECTIONS.labels("concurrency").inc()
+            logger.warning("quota: client=%s already has %d conversion(s) running", caller.client_id, concurrent)
+            raise HTTPException(status_code=429, detail=f"Too many conversions in progress (max {concurrent})",
+                                headers={"Retry-After": str(CONCURRENCY_RETRY_AFTER_SECONDS)})
+
+        if per_second > 0:
+            now = time.monotonic()
+            tokens = self._tokens(caller, now)
+            if tokens < 1:
+                QUOTA_REJECTIONS.labels("rate").inc()
+                retry_after = math.ceil((1 - tokens) / per_second)
+                logger.warning("quota: client=%s rate limited, retry in %ds", caller.client_id, retry_after)
+                raise HTTPException(status_code=429, detail="Rate limit exceeded",
+                                    headers={"Retry-After": str(retry_after)})
+            self._buckets[caller.client_id] = (tokens - 1, now)
+            if len(self._buckets) > self.MAX_BUCKETS:
+                # a day-old bucket has long since refilled, so it's the same as a new one
+                self._buckets = {k: v for k, v in self._buckets.items() if now - v[1] < 24 * 3600}
+
+        self._active[caller.client_id] = self._active.get(caller.client_id, 0) + 1
+        return QuotaLease(self, caller.client_id)
+
+    def take(self, caller: Caller, lease: QuotaLease, count: int) -> None:
+        """Add count more slots to an admitted client's lease, or refuse with 429 (or 422 if it can never fit)."""
+        _, _, concurrent = self._limits(caller)
+        if count <= 0:
+            return
+        if concurrent and lease.slots + count > concurrent:
+            QUOTA_REJECTIONS.labels("concurrency").inc()
+            raise HTTPException(status_code=422, detail=f"Batch has {lease.slots + count} PDFs but at most "
+                                                        f"{concurrent} may convert at once")
+        if concurrent and self._active.get(caller.client_id, 0) + count > concurrent:
+            QUOTA_REJECTIONS.labels("concurrency").inc()
+            logger.warning("quota: client=%s has no room for %d more conversion(s)", caller.client_id, count)
+            raise HTTPException(status_code=429, detail=f"Too many conversions in progress (max {concurrent})",
+                                headers={"Retry-After": str(CONCURRENCY_RETRY_AFTER_SECONDS)})
+        self._active[caller.client_id] = self._active.get(caller.client_id, 0) + count
+        lease.slots += count
+
+    def charge(self, caller: Caller, cost: int) -> None:
+        """Take cost more tokens from an admitted client, going into debt if need be."""
+        per_second, _, _ = self._limits(caller)
+        if per_second > 0 and cost > 0:
+            now = time.monotonic()
+            self._buckets[caller.client_id] = (self._tokens(caller, now) - cost, now)
+
+    def _release(self, client_id: str, slots: int) -> None:
+        remaining = self._active.get(client_id, 0) - slots
+        if remaining > 0:
+            self._active[client_id] = remaining
+        else:
+            self._active.pop(client_id, None)
+
+    def stats(self) -> dict:
+        return {"active": dict(self._active), "rate_limited_clients": len(self._buckets)}
+
+
+QUOTAS = ClientQuotas()
+
+
+def choose_recipients(caller: Caller, requested: Optional[str]) -> tuple[str, ...]:
+    """The caller's addresses named in a comma-separated "to" field, or all of them if it's empty."""
+    if not requested or not requested.strip():
+        return caller.recipients
+    chosen = tuple(dict.fromkeys(a.strip() for a in requested.split(",") if a.strip()))
+    allowed = {a.lower() for a in caller.recipients}
+    if not chosen or any(a.lower() not in allowed for a in chosen):
+        raise HTTPException(status_code=403, detail="Recipient not registered for this token")
+    return chosen
+
+
+class ConversionTimeout(RuntimeError):
+    error_class = "timeout"
+
+
+class ResourceExceeded(RuntimeError):
+    error_class = "resource_exceeded"
+
+
+class DeliveryTooLarge(RuntimeError):
+    error_class = "too_large"
+
+
+def _limited_command(cmd: list[str], cgroup: Optional[Path], cpu_limit: bool = True) -> list[str]:
+    """cmd wrapped in a /bin/sh that joins cgroup and sets the calibre rlimits, then execs it.
+
+    The limits have to be in place before calibre starts, but preexec_fn isn't safe
+    in this heavily threaded process (the forked child can deadlock before exec), so
+    a real exec'd shell does the work instead. It keeps its pid across the exec.
+    """
+    steps = []
+    if cgroup is not None:
+        steps.append(f"echo $$ > {shlex.quote(str(cgroup / 'cgroup.procs'))}")
+    if CONVERT_MAX_MEMORY_BYTES:
+        steps.append(f"ulimit -v {max(1, CONVERT_MAX_MEMORY_BYTES // 1024)}")  # RLIMIT_AS, in KiB
+    if cpu_limit and CONVERT_MAX_CPU_SECONDS:
+        # SIGXCPU at the soft limit, SIGKILL shortly after if it's ignored
+        steps += [f"ulimit -S -t {CONVERT_MAX_CPU_SECONDS}", f"ulimit -H -t {CONVERT_MAX_CPU_SECONDS + 5}"]
+    if CONVERT_MAX_OPEN_FILES:
+        steps.append(f"ulimit -n {CONVERT_MAX_OPEN_FILES}")
+    if not steps:
+        return cmd
+
+    # resolve here so a missing binary still surfaces as FileNotFoundError, not exit 127
+    exe = shutil.which(cmd[0])
+    if exe is None:
+        raise FileNotFoundError(cmd[0])
+    return ["/bin/sh", "-c", " && ".join(steps + ['exec "$@"']), "sh", exe, *cmd[1:]]
+
+
+def _cgroup_create() -> Optional[Path]:
+    """Create a child cgroup for one conversion, or None if cgroups aren't configured/usable."""
+    if not CONVERT_CGROUP:
+        return None
 
+    cgroup = Path(CONVERT_CGROUP) / f"convert-{uuid.uuid4().hex[:12]}"
+    try:
+        cgroup.mkdir()
+        if CONVERT_CGROUP_MEMORY_MAX:
+            (cgroup / "memory.max").write_text(CONVERT_CGROUP_MEMORY_MAX)
+            (cgroup / "memory.swap.max").write_text("0")
+    except OSError:
+        logger.warning("convert: could not set up cgroup under %s, running without it", CONVERT_CGROUP, exc_info=True)
+        _cgroup_remove(cgroup)
+        return None
+    return cgroup
+
+
+def _cgroup_oom_kills(cgroup: Path) -> int:
+    try:
+        for line in (cgroup / "memory.events").read_text().splitlines():
+            name, _, value = line.partition(" ")
+            if name == "oom_kill":
+                return int(value)
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+def _cgroup_remove(cgroup: Path) -> None:
+    try:
+        cgroup.rmdir()
+    except OSError:
+        logger.warning("convert: could not remove cgroup %s", cgroup)
+
+
+def _resource_overrun(returncode: int, stderr: str, cgroup: Optional[Path]) -> Optional[str]:
+    """Name the limit a failed calibre run ran into, if any."""
+    if cgroup is not None and _cgroup_oom_kills(cgroup) > 0:
+        return f"memory (cgroup memory.max={CONVERT_CGROUP_MEMORY_MAX})"
+    if CONVERT_MAX_CPU_SECONDS and returncode in (-signal.SIGXCPU, -signal.SIGKILL):
+        return f"CPU time ({CONVERT_MAX_CPU_SECONDS}s)"
+    if CONVERT_MAX_MEMORY_BYTES and ("MemoryError" in stderr or "bad_alloc" in stderr or "Cannot allocate memory" in stderr):
+        return f"memory ({CONVERT_MAX_MEMORY_BYTES} bytes address space)"
+    if CONVERT_MAX_OPEN_FILES and "Too many open files" in stderr:
+        return f"open files ({CONVERT_MAX_OPEN_FILES})"
+    return None
+
+
+class Quarantine:
+    """SHA-256s of PDFs that blew the conversion deadline, kept in a plain text
+    file (one hash per line) so they are refused instead of retried.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._hashes: set[str] = set()
+        self._lock = threading.Lock()
+
+    def load(self) -> None:
+        try:
+            self._hashes = {line.strip() for line in self.path.read_text().splitlines() if line.strip()}
+        except FileNotFoundError:
+            self._hashes = set()
+        logger.info("quarantine: loaded %d hashes from %s", len(self._hashes), self.path)
+
+    def add(self, sha256: str) -> None:
+        with self._lock:
+            if sha256 in self._hashes:
+                return
+            self._hashes.add(sha256)
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(sha256 + "\n")
+        logger.warning("quarantine: added %s", sha256)
+
+    def __contains__(self, sha256: str) -> bool:
+        return sha256 in self._hashes
+
+
+QUARANTINE = Quarantine(Path(QUARANTINE_FILE))
+
+
+def make_workspace(prefix: str, size_hint: int) -> Path:
+    """Scratch dir under WORKSPACE_ROOT if it has room for a job of size_hint input bytes,
+    otherwise in the system temp dir.
+    """
+    if WORKSPACE_ROOT:
+        needed = int(size_hint * WORKSPACE_SIZE_FACTOR) + WORKSPACE_MIN_FREE_BYTES
+        try:
+            os.makedirs(WORKSPACE_ROOT, exist_ok=True)
+            free = shutil.disk_usage(WORKSPACE_ROOT).free
+        except OSError:
+            logger.warning("workspace: cannot use WORKSPACE_ROOT=%s", WORKSPACE_ROOT, exc_info=True)
+            free = 0
+        if free >= needed:
+            WORKSPACES.labels("workspace_root").inc()
+            return Path(tempfile.mkdtemp(prefix=prefix, dir=WORKSPACE_ROOT))
+        logger.info("workspace: %s has %d bytes free, job needs %d; falling back to disk", WORKSPACE_ROOT, free, needed)
+    WORKSPACES.labels("tmpdir").inc()
+    return Path(tempfile.mkdtemp(prefix=prefix))
+
+
+def _kill_process_group(p: subprocess.Popen) -> None:
+    try:
+        os.killpg(p.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def _run_limited(cmd: list[str], tmpdir: Path, what: str) -> tuple[int, str, str]:
+    """Run cmd in its own process group under the conversion limits (_limited_command,
+    CONVERT_TIMEOUT_SECONDS) and return (returncode, stdout, stderr).
+
+    Raises ConversionTimeout or ResourceExceeded when a limit is hit; a missing
+    binary raises FileNotFoundError.
+    """
+    cgroup = _cgroup_create()
+    try:
+        # own session/process group, so helpers the converter spawns can be killed with it
+        p = subprocess.Popen(
+            _limited_command(cmd, cgroup),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            start_new_session=True,
+            # scratch files land next to the job, on the same backing store
+            env={**os.environ, "TMPDIR": str(tmpdir)},
+        )
+
+        try:
+            stdout, stderr = p.communicate(timeout=CONVERT_TIMEOUT_SECONDS or None)
+        except subprocess.TimeoutExpired:
+            logger.error("convert: %s exceeded %ss, killing process group pgid=%d", what, CONVERT_TIMEOUT_SECONDS, p.pid)
+            _kill_process_group(p)
+            p.communicate()
+            raise ConversionTimeout(f"Conversion timed out after {CONVERT_TIMEOUT_SECONDS:g}s") from None
+        except BaseException:
+            _kill_process_group(p)
+            p.wait()
+            raise
+        finally:
+            # reap anything left running in its group
+            _kill_process_group(p)
+
+        out = (stdout or b"").decode(errors="replace").strip()
+        err = (stderr or b"").decode(errors="replace").strip()
+        overrun = _resource_overrun(p.returncode, err, cgroup) if p.returncode != 0 else None
+    finally:
+        if cgroup is not None:
+            _cgroup_remove(cgroup)
+    if overrun:
+        logger.error("convert: %s exceeded its %s limit (rc=%s)", what, overrun, p.returncode)
+        raise ResourceExceeded(f"Conversion failed: resource limit exceeded: {overrun}")
+    return p.returncode, out, err
 
-def pdf_to_epub(pdf_path: Path, epub_path: Path) -> None:
-    logger.info("convert: starting pdf->epub via calibre")
-    logger.info("convert: input=%s output=%s bin=%s", pdf_path, epub_path, EBOOK_CONVERT_BIN)
 
-    cmd = [EBOOK_CONVERT_BIN, str(pdf_path), str(epub_path)]
-    logger.info("convert: running: %s", " ".join(cmd))
+def _convert_native(pdf_path: Path, epub_path: Path) -> bool:
+    """Try the native text engine (probe_text_pdf + write_text_epub). Returns False if
+    the PDF needs calibre after all.
+
+    pypdf parses the untrusted PDF, so this runs as `main.py native` in a child
+    process under the same deadline and limits as calibre rather than in the server.
+    """
+    cmd = [sys.executable, str(Path(__file__).resolve()), "native", str(pdf_path), str(epub_path)]
+    returncode, _, err = _run_limited(cmd, epub_path.parent, "native engine")
+    if returncode == NATIVE_NOT_TEXT_EXIT:
+        return False
+    if returncode != 0:
+        logger.warning("convert: native engine failed (rc=%s), using calibre: %s", returncode, err[-2000:])
+        return False
+    logger.info("convert: plain-text pdf, converted with the native engine")
+    return True
+
+
+def _convert_cold(pdf_path: Path, epub_path: Path, args: tuple[str, ...] = ()) -> None:
+    """One-shot ebook-convert run, paying calibre's full startup cost."""
+    cmd = [EBOOK_CONVERT_BIN, str(pdf_path), str(epub_path), *args]
+    logger.info("convert: running: %s timeout=%ss", " ".join(cmd), CONVERT_TIMEOUT_SECONDS or "none")
 
     try:
-        p = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        out = (p.stdout or b"").decode(errors="replace").strip()
-        err = (p.stderr or b"").decode(errors="replace").strip()
-        if out:
-            logger.info("convert: calibre stdout (tail): %s", out[-1000:])
-        if err:
-            logger.info("convert: calibre stderr (tail): %s", err[-1000:])
+        returncode, out, err = _run_limited(cmd, epub_path.parent, "calibre")
     except FileNotFoundError as e:
         logger.exception("convert: ebook-convert not found (is calibre installed?)")
         raise RuntimeError("Conversion failed: ebook-convert not found (install calibre)") from e
-    except subprocess.CalledProcessError as e:
-        stderr = (e.stderr or b"").decode(errors="replace")
-        logger.error("convert: calibre failed (rc=%s) stderr (tail): %s", e.returncode, stderr[-2000:])
-        raise RuntimeError(f"Conversion failed: {stderr[-2000:]}") from e
 
-    if not epub_path.exists() or epub_path.stat().st_size == 0:
-        logger.error("convert: output epub missing/empty at %s", epub_path)
-        raise RuntimeError("Conversion failed: output EPUB was not created")
+    if returncode != 0:
+        logger.error("convert: calibre failed (rc=%s) stderr (tail): %s", returncode, err[-2000:])
+        raise RuntimeError(f"Conversion failed: {err[-2000:]}")
+    if out:
+        logger.info("convert: calibre stdout (tail): %s", out[-1000:])
+    if err:
+        logger.info("convert: calibre stderr (tail): %s", err[-1000:])
 
-    logger.info("convert: success (bytes=%d)", epub_path.stat().st_size)
 
+# Runs inside `calibre-debug -e`, so calibre's modules are already importable.
+# Protocol: one JSON request per line on stdin, one JSON reply per line on the
+# original stdout; calibre's own output goes to the per-job log file instead.
+CALIBRE_WORKER_SCRIPT = """
+import json, os, resource, sys, traceback
 
-def send_email_with_attachment(
-    subject: str,
-    body: str,
-    to_addr: str,
-    attachment_path: Path,
-) -> None:
-    logger.info("email: preparing message to=%s from=%s", to_addr, SMTP_FROM)
+proto = os.fdopen(os.dup(1), "w", buffering=1)
+devnull = os.open(os.devnull, os.O_WRONLY)
+os.dup2(devnull, 1)
 
-    if not SMTP_HOST:
-        logger.error("email: SMTP_HOST is not set")
-        raise RuntimeError("SMTP_HOST is not set")
+from calibre.ebooks.conversion.cli import main as ebook_convert
+from calibre.customize.ui import plugin_for_input_format, plugin_for_output_format
+plugin_for_input_format("pdf")
+plugin_for_output_format("epub")
 
-    if not attachment_path.exists():
-        logger.error("email: attachment missing at %s", attachment_path)
-        raise RuntimeError("Attachment not found")
-
-    data = attachment_path.read_bytes()
-    logger.info("email: attachment=%s bytes=%d", attachment_path.name, len(data))
-
-    msg = EmailMessage()
-    msg["From"] = SMTP_FROM
-    msg["To"] = to_addr
-    msg["Subject"] = subject
-    msg.set_content(body)
-    msg.add_attachment(
-        data,
-        maintype="application",
-        subtype="epub+zip",
-        filename=attachment_path.name,
-    )
+proto.write(json.dumps({"ready": True}) + "\\n")
+
+for line in sys.stdin:
+    req = json.loads(line)
+    log_fd = os.open(req["log"], os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    os.dup2(log_fd, 1)
+    os.dup2(log_fd, 2)
+    os.close(log_fd)
 
-    logger.info("email: connecting host=%s port=%d tls=%s user_set=%s",
-                SMTP_HOST, SMTP_PORT, SMTP_TLS, bool(SMTP_USER))
+    if req.get("cpu_seconds"):
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        used = int(usage.ru_utime + usage.ru_stime) + 1
+        resource.setrlimit(resource.RLIMIT_CPU, (used + req["cpu_seconds"], resource.RLIM_INFINITY))
 
     try:
-        with smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=30) as s:
-            if SMTP_TLS:
-                logger.info("email: starting TLS")
-                s.starttls()
+        rc = ebook_convert(["ebook-convert", req["input"], req["output"]] + req.get("args", []))
+    except SystemExit as e:
+        rc = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except BaseException:
+        traceback.print_exc()
+        rc = 1
 
-            if SMTP_USER:
-                logger.info("email: logging in as %s", SMTP_USER)
-                s.login(SMTP_USER, SMTP_PASS)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.dup2(devnull, 1)
+    os.dup2(devnull, 2)
+    proto.write(json.dumps({"rc": rc or 0}) + "\\n")
+"""
 
-            logger.info("email: sending")
-            s.send_message(msg)
 
-    except smtplib.SMTPAuthenticationError:
-        logger.exception("email: authentication failed")
-        raise RuntimeError("Email failed: SMTP authentication failed (check SMTP_USER/SMTP_PASS)") from None
-    except Exception as e:
-        logger.exception("email: send failed")
-        raise RuntimeError(f"Email failed: {e}") from e
+class WarmCalibreWorker:
+    """A calibre-debug process that has already paid interpreter + plugin startup."""
 
-    logger.info("email: sent ok")
+    STARTUP_TIMEOUT = 120
 
+    def __init__(self, script_path: Path):
+        self.jobs = 0
+        self.cgroup = _cgroup_create()
 
-@app.post("/convert")
-async def convert_pdf_to_epub_endpoint(
-    authorization: Optional[str] = Header(default=None),
-    file: UploadFile = File(...),
-):
-    logger.info("request: /convert received filename=%s content_type=%s", file.filename, file.content_type)
+        env = dict(os.environ)
+        if WORKSPACE_ROOT:
+            os.makedirs(WORKSPACE_ROOT, exist_ok=True)
+            env["TMPDIR"] = WORKSPACE_ROOT
+        self.proc = subprocess.Popen(
+            # CPU time is limited per job by the worker itself
+            _limited_command([CALIBRE_DEBUG_BIN, "-e", str(script_path)], self.cgroup, cpu_limit=False),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+            env=env,
+        )
+        try:
+            reply = self._read_reply(self.STARTUP_TIMEOUT)
+        except (TimeoutError, ValueError):
+            reply = None
+        if not isinstance(reply, dict) or not reply.get("ready"):
+            self.kill()
+            raise RuntimeError("calibre worker failed to start")
+        logger.info("convert: warm calibre worker ready pid=%d", self.proc.pid)
 
-    require_bearer(authorization)
+    def _read_reply(self, timeout: Optional[float]) -> Optional[dict]:
+        """Next protocol line, or None if the worker exited. Raises TimeoutError, or
+        ValueError for a line that isn't JSON."""
+        ready, _, _ = select.select([self.proc.stdout], [], [], timeout)
+        if not ready:
+            raise TimeoutError()
+        line = self.proc.stdout.readline()
+        return json.loads(line) if line else None
 
-    if file.content_type not in ("application/pdf", "application/octet-stream"):
-        logger.warning("request: invalid content_type=%s", file.content_type)
-        raise HTTPException(status_code=400, detail=f"Expected PDF, got {file.content_type}")
+    def convert(self, pdf_path: Path, epub_path: Path, args: tuple[str, ...] = ()) -> None:
+        log_path = epub_path.with_name(epub_path.name + ".log")
+        request = {"input": str(pdf_path), "output": str(epub_path), "log": str(log_path),
+                   "args": list(args), "cpu_seconds": CONVERT_MAX_CPU_SECONDS}
+        self.jobs += 1
+        oom_before = _cgroup_oom_kills(self.cgroup) if self.cgroup is not None else 0
+        logger.info("convert: handing job to warm worker pid=%d (job %d)", self.proc.pid, self.jobs)
 
-    logger.info("request: reading upload into memory")
-    raw = await file.read()
-    logger.info("request: read bytes=%d (max=%d)", len(raw), MAX_PDF_BYTES)
+        try:
+            self.proc.stdin.write((json.dumps(request) + "\n").encode())
+            self.proc.stdin.flush()
+            reply = self._read_reply(CONVERT_TIMEOUT_SECONDS or None)
+        except TimeoutError:
+            logger.error("convert: warm worker exceeded %ss, killing pid=%d", CONVERT_TIMEOUT_SECONDS, self.proc.pid)
+            self.kill()
+            raise ConversionTimeout(f"Conversion timed out after {CONVERT_TIMEOUT_SECONDS:g}s") from None
+        except (BrokenPipeError, OSError):
+            reply = None
+        except ValueError:
+            reply = {}  # not JSON: killed below as a malformed reply
+        except BaseException:
+            # a reply we never got to read would be taken as the next job's
+            self.kill()
+            raise
 
-    if len(raw) > MAX_PDF_BYTES:
-        logger.warning("request: too large bytes=%d", len(raw))
-        raise HTTPException(status_code=413, detail="PDF too large")
+        try:
+            log = log_path.read_text(errors="replace").strip()
+        except FileNotFoundError:
+            log = ""
 
-    logger.info("request: starting temp workspace")
-    with tempfile.TemporaryDirectory() as td:
-        td_path = Path(td)
-        pdf_path = td_path / "input.pdf"
-        epub_path = td_path / "output.epub"
+        if reply is None:
+            oom = self.cgroup is not None and _cgroup_oom_kills(self.cgroup) > oom_before
+            self.kill()
+            overrun = _resource_overrun(self.proc.returncode, log, None)
+            if oom:
+                overrun = f"memory (cgroup memory.max={CONVERT_CGROUP_MEMORY_MAX})"
+            if overrun:
+                logger.error("convert: warm worker exceeded its %s limit (rc=%s)", overrun, self.proc.returncode)
+                raise ResourceExceeded(f"Conversion failed: resource limit exceeded: {overrun}")
+            logger.error("convert: warm worker died (rc=%s) log (tail): %s", self.proc.returncode, log[-2000:])
+            raise RuntimeError(f"Conversion failed: calibre worker died: {log[-2000:]}")
+
+        if not isinstance(reply, dict) or not isinstance(reply.get("rc"), int):
+            logger.error("convert: warm worker pid=%d sent a malformed reply, killing it", self.proc.pid)
+            self.kill()
+            raise RuntimeError("Conversion failed: calibre worker sent a malformed reply")
+
+        if reply.get("rc") != 0:
+            overrun = _resource_overrun(reply.get("rc"), log, None)
+            if overrun:
+                raise ResourceExceeded(f"Conversion failed: resource limit exceeded: {overrun}")
+            logger.error("convert: calibre failed (rc=%s) log (tail): %s", reply.get("rc"), log[-2000:])
+            raise RuntimeError(f"Conversion failed: {log[-2000:]}")
+
+        if log:
+            logger.info("convert: calibre log (tail): %s", log[-1000:])
+
+    @property
+    def alive(self) -> bool:
+        return self.proc.poll() is None
+
+    def kill(self) -> None:
+        _kill_process_group(self.proc)
+        self.proc.wait()
+        if self.cgroup is not None:
+            _cgroup_remove(self.cgroup)
+            self.cgroup = None
+
+
+class WarmCalibrePool:
+    """Pre-started calibre workers. Callers that find none idle fall back to a cold run."""
 
-        logger.info("request: writing input pdf to %s", pdf_path)
-        pdf_path.write_bytes(raw)
+    def __init__(self, size: int):
+        self.size = size
+        self._idle: "queue.Queue[WarmCalibreWorker]" = queue.Queue()
+        self._script_path: Optional[Path] = None
+        self._closed = False
 
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0
+
+    def start(self) -> None:
+        if not self.enabled:
+            return
+        fd, path = tempfile.mkstemp(prefix="pdf2epub-calibre-worker-", suffix=".py")
+        with os.fdopen(fd, "w") as f:
+            f.write(CALIBRE_WORKER_SCRIPT)
+        self._script_path = Path(path)
+        for _ in range(self.size):
+            self._spawn_in_background()
+
+    def _spawn_in_background(self) -> None:
+        threading.Thread(target=self._spawn, name="calibre-worker-spawn", daemon=True).start()
+
+    def _spawn(self) -> None:
+        if self._closed:
+            return
         try:
-            pdf_to_epub(pdf_path, epub_path)
-        except Exception as e:
-            logger.exception("request: conversion failed")
-            raise HTTPException(status_code=500, detail=str(e))
+            worker = WarmCalibreWorker(self._script_path)
+        except Exception:
+            logger.exception("convert: could not start warm calibre worker; using cold runs")
+            return
+        if self._closed:  # shut down while it was starting
+            worker.kill()
+            return
+        self._idle.put(worker)
+
+    def checkout(self) -> Optional[WarmCalibreWorker]:
+        if not self.enabled:
+            return None
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                return None
+            if worker.alive:
+                return worker
+            worker.kill()
+            self._spawn_in_background()
+
+    def checkin(self, worker: WarmCalibreWorker) -> None:
+        if self._closed or not worker.alive or worker.jobs >= CALIBRE_WORKER_MAX_JOBS:
+            if worker.alive:
+                logger.info("convert: recycling warm worker pid=%d after %d jobs", worker.proc.pid, worker.jobs)
+            worker.kill()
+            self._spawn_in_background()
+        else:
+            self._idle.put(worker)
+
+    def close(self) -> None:
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().kill()
+            except queue.Empty:
+                break
+        if self._script_path is not None:
+            self._script_path.unlink(missing_ok=True)
+
 
+WARM_CALIBRE = WarmCalibrePool(CALIBRE_WARM_WORKERS)
+
+
+def _convert_one(pdf_path: Path, epub_path: Path, args: tuple[str, ...] = ()) -> None:
+    worker = WARM_CALIBRE.checkout()
+    if worker is not None:
         try:
-            logger.info("request: emailing epub to KINDLE_EMAIL=%s", KINDLE_EMAIL)
-            send_email_with_attachment(
-                subject="Your converted EPUB",
-                body="Attached is the EPUB converted from your PDF.",
-                to_addr=KINDLE_EMAIL,
-                attachment_path=epub_path,
-            )
-        except Exception as e:
-            logger.exception("request: email failed")
-            raise HTTPException(status_code=502, detail=str(e))
+            worker.convert(pdf_path, epub_path, args)
+        finally:
+            WARM_CALIBRE.checkin(worker)
+    else:
+        _convert_cold(pdf_path, epub_path, args)
 
-    logger.info("request: /convert done ok")
-    return JSONResponse({"ok": True, "sent_to": KINDLE_EMAIL})
 
-@app.post("/test-email")
-async def test_email(authorization: Optional[str] = Header(default=None)):
-    logger.info("request: /test-email received")
-    require_bearer(authorization)
+SHARD_EXECUTOR = ThreadPoolExecutor(max_workers=max(1, SHARD_WORKERS), thread_name_prefix="shard")
+
+EPUB_NS = {
+    "container": "urn:oasis:names:tc:opendocument:xmlns:container",
+    "opf": "http://www.idpf.org/2007/opf",
+    "dc": "http://purl.org/dc/elements/1.1/",
+    "ncx": "http://www.daisy.org/z3986/2005/ncx/",
+}
 
+
+def split_pdf(pdf_path: Path, out_dir: Path, pages_per_shard: int) -> list[Path]:
+    reader = PdfReader(pdf_path)
+    shards = []
+    for i, start in enumerate(range(0, len(reader.pages), pages_per_shard)):
+        writer = PdfWriter()
+        for page in reader.pages[start:start + pages_per_shard]:
+            writer.add_page(page)
+        # calibre titles each shard from its metadata, and merge_epubs keeps the first shard's title
+        if reader.metadata:
+            writer.add_metadata(reader.metadata)
+        shard = out_dir / f"shard-{i:03d}.pdf"
+        with open(shard, "wb") as f:
+            writer.write(f)
+        shards.append(shard)
+    return shards
+
+
+def _nav_points(parent: ElementTree.Element, prefix: str) -> list[dict]:
+    points = []
+    for np in parent.findall("ncx:navPoint", EPUB_NS):
+        label = np.findtext("ncx:navLabel/ncx:text", default="", namespaces=EPUB_NS)
+        content = np.find("ncx:content", EPUB_NS)
+        src = content.get("src", "") if content is not None else ""
+        points.append({"label": label, "src": prefix + src, "children": _nav_points(np, prefix)})
+    return points
+
+
+def _read_shard_epub(zf: zipfile.ZipFile, prefix: str) -> dict:
+    """Manifest, spine and TOC of one shard, with every path rebased under prefix."""
+    container = ElementTree.fromstring(zf.read("META-INF/container.xml"))
+    opf_path = container.find(".//container:rootfile", EPUB_NS).get("full-path")
+    opf_dir = posixpath.dirname(opf_path)
+    opf = ElementTree.fromstring(zf.read(opf_path))
+
+    def rebase(href: str) -> str:
+        return prefix + posixpath.normpath(posixpath.join(opf_dir, href))
+
+    manifest = {}
+    ncx_href = None
+    toc_id = opf.find("opf:spine", EPUB_NS).get("toc")
+    for item in opf.findall("opf:manifest/opf:item", EPUB_NS):
+        if item.get("id") == toc_id or item.get("media-type") == "application/x-dtbncx+xml":
+            ncx_href = posixpath.normpath(posixpath.join(opf_dir, item.get("href")))
+            continue
+        if "nav" in (item.get("properties") or "").split():
+            continue
+        manifest[item.get("id")] = {"href": rebase(item.get("href")), "media-type": item.get("media-type")}
+
+    spine = [ref.get("idref") for ref in opf.findall("opf:spine/opf:itemref", EPUB_NS) if ref.get("idref") in manifest]
+
+    toc = []
+    if ncx_href:
+        ncx = ElementTree.fromstring(zf.read(ncx_href))
+        nav_map = ncx.find("ncx:navMap", EPUB_NS)
+        if nav_map is not None:
+            toc = _nav_points(nav_map, prefix + (posixpath.dirname(ncx_href) + "/" if posixpath.dirname(ncx_href) else ""))
+
+    metadata = opf.find("opf:metadata", EPUB_NS)
+    cover = None
+    for meta in metadata.findall("opf:meta", EPUB_NS):
+        if meta.get("name") == "cover":
+            cover = meta.get("content")
+    return {
+        "manifest": manifest,
+        "spine": spine,
+        "toc": toc,
+        "skip": {opf_path, ncx_href, "mimetype", "META-INF/container.xml"} | {
+            posixpath.normpath(posixpath.join(opf_dir, i.get("href")))
+            for i in opf.findall("opf:manifest/opf:item", EPUB_NS)
+            if "nav" in (i.get("properties") or "").split()
+        },
+        "title": metadata.findtext("dc:title", default="", namespaces=EPUB_NS),
+        "creator": metadata.findtext("dc:creator", default="", namespaces=EPUB_NS),
+        "language": metadata.findtext("dc:language", default="en", namespaces=EPUB_NS),
+        "cover": cover,
+    }
+
+
+def merge_epubs(parts: list[Path], out_path: Path) -> None:
+    """Stitch shard EPUBs into one book: each shard's files move under sNNN/,
+    manifest ids get the same prefix, spines are concatenated and the NCX TOCs
+    are merged in order.
+    """
+    book_id = f"urn:uuid:{uuid.uuid4()}"
+    manifest_xml, spine_xml, nav_xml = [], [], []
+    play_order = 0
+    first = None
+
+    def nav_point(point: dict, depth: int) -> str:
+        nonlocal play_order
+        play_order += 1
+        children = "".join(nav_point(c, depth + 1) for c in point["children"])
+        return (f'<navPoint id="np-{play_order}" playOrder="{play_order}">'
+                f'<navLabel><text>{escape(point["label"])}</text></navLabel>'
+                f'<content src={quoteattr(point["src"])}/>{children}</navPoint>')
+
+    with zipfile.ZipFile(out_path, "w", zipfile.ZIP_DEFLATED) as out:
+        out.writestr(zipfile.ZipInfo("mimetype"), "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+        out.writestr("META-INF/container.xml",
+                     '<?xml version="1.0"?>\n<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">'
+                     '<rootfiles><rootfile full-path="content.opf" media-type="application/oebps-package+xml"/></rootfiles></container>')
+
+        for i, part in enumerate(parts):
+            prefix = f"s{i:03d}/"
+            with zipfile.ZipFile(part) as zf:
+                shard = _read_shard_epub(zf, prefix)
+                if first is None:
+                    first = shard
+                for info in zf.infolist():
+                    if info.filename in shard["skip"] or info.is_dir():
+                        continue
+                    with zf.open(info) as src, out.open(prefix + info.filename, "w") as dst:
+                        shutil.copyfileobj(src, dst, 1024 * 1024)
+
+            for item_id, item in shard["manifest"].items():
+                manifest_xml.append(f'<item id="{prefix[:-1]}-{escape(item_id)}" href={quoteattr(item["href"])} '
+                                    f'media-type={quoteattr(item["media-type"])}/>')
+            spine_xml.extend(f'<itemref idref="{prefix[:-1]}-{escape(idref)}"/>' for idref in shard["spine"])
+
+            toc = shard["toc"]
+            if not toc and shard["spine"]:
+                toc = [{"label": f"Part {i + 1}", "src": shard["manifest"][shard["spine"][0]]["href"], "children": []}]
+            nav_xml.extend(nav_point(p, 1) for p in toc)
+
+        cover_meta = f'<meta name="cover" content="s000-{escape(first["cover"])}"/>' if first and first["cover"] else ""
+        title = escape(first["title"] if first else "")
+        creator = f'<dc:creator>{escape(first["creator"])}</dc:creator>' if first and first["creator"] else ""
+        out.writestr("content.opf", (
+            '<?xml version="1.0" encoding="utf-8"?>\n'
+            '<package xmlns="http://www.idpf.org/2007/opf" version="2.0" unique-identifier="bookid">'
+            '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:opf="http://www.idpf.org/2007/opf">'
+            f'<dc:title>{title}</dc:title>{creator}'
+            f'<dc:language>{escape(first["language"] if first else "en")}</dc:language>'
+            f'<dc:identifier id="bookid">{book_id}</dc:identifier>{cover_meta}</metadata>'
+            f'<manifest><item id="ncx" href="toc.ncx" media-type="application/x-dtbncx+xml"/>{"".join(manifest_xml)}</manifest>'
+            f'<spine toc="ncx">{"".join(spine_xml)}</spine></package>'
+        ))
+        out.writestr("toc.ncx", (
+            '<?xml version="1.0" encoding="utf-8"?>\n'
+            '<ncx xmlns="http://www.daisy.org/z3986/2005/ncx/" version="2005-1">'
+            f'<head><meta name="dtb:uid" content="{book_id}"/></head>'
+            f'<docTitle><text>{title}</text></docTitle>'
+            f'<navMap>{"".join(nav_xml)}</navMap></ncx>'
+        ))
+
+
+def _convert_sharded(pdf_path: Path, epub_path: Path, page_count: int, args: tuple[str, ...] = ()) -> None:
+    shard_dir = Path(tempfile.mkdtemp(prefix="shards-", dir=epub_path.parent))
     try:
-        logger.info("test-email: sending to KINDLE_EMAIL=%s", KINDLE_EMAIL)
-        send_email_with_attachment(
-            subject="SMTP test (no attachment)",
-            body="If you received this, SMTP is working.",
-            to_addr=KINDLE_EMAIL,
-            attachment_path=Path("/dev/null"),  # not used
-        )
+        shards = split_pdf(pdf_path, shard_dir, SHARD_PAGES)
+        logger.info("convert: %d pages split into %d shards of <=%d pages", page_count, len(shards), SHARD_PAGES)
+
+        outputs = [shard.with_suffix(".epub") for shard in shards]
+        futures = [SHARD_EXECUTOR.submit(_convert_one, shard, out, args) for shard, out in zip(shards, outputs)]
+        try:
+            for future in futures:
+                future.result()
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+        merge_epubs(outputs, epub_path)
+        logger.info("convert: merged %d shard epubs", len(outputs))
+    finally:
+        shutil.rmtree(shard_dir, ignore_errors=True)
+
+
+def _page_count(pdf_path: Path) -> int:
+    try:
+        return len(PdfReader(pdf_path).pages)
+    except Exception:
+        logger.warning("convert: could not read page count, converting unsharded", exc_info=True)
+        return 0
+
+
+NATIVE_ENGINE_VERSION = "2"  # bump when write_text_epub output changes, to invalidate cached books
+NATIVE_DOC_MAX_CHARS = 100_000  # start a new XHTML document after this much text without a heading
+NATIVE_NOT_TEXT_EXIT = 3  # `main.py native` exit status for a PDF that needs calibre
+# a section number or Chapter/Section/Part label, then a title that doesn't start lowercase:
+# "2.1 Methods", "IV. Results", "Chapter 3", "Part Two: Home" but not "Part of the reason"
+# or "25 percent of respondents"
+HEADING_RE = re.compile(
+    r"^(?:(?:\d+(?:\.\d+)*\.?|[IVXLC]+\.)\s+(?![a-z])\S"
+    r"|(?:Chapter|Section|Part)\s+(?:\d+|[IVXLC]+|[A-Z][a-z]+)\b[.:]?(?:\s+(?![a-z])\S|$))"
+)
+SENTENCE_END = (".", "!", "?", ":", '"', "\u201d")
+
+
+def _page_has_graphics(page) -> bool:
+    resources = page.get("/Resources")
+    xobjects = resources.get_object().get("/XObject") if resources is not None else None
+    if not xobjects:
+        return False
+    for xobject in xobjects.get_object().values():
+        # images are obvious; form XObjects usually wrap figures or vector art, so leave those to calibre too
+        if xobject.get_object().get("/Subtype") in ("/Image", "/Form"):
+            return True
+    return False
+
+
+def probe_text_pdf(pdf_path: Path) -> Optional[tuple[str, list[str]]]:
+    """(title, per-page text) if the PDF is plain born-digital text the native
+    engine can handle, otherwise None.
+    """
+    try:
+        reader = PdfReader(pdf_path)
+        if reader.is_encrypted or len(reader.pages) > NATIVE_MAX_PAGES:
+            return None
+
+        pages = []
+        for page in reader.pages:
+            if _page_has_graphics(page):
+                return None
+            text = page.extract_text() or ""
+            if len(text.strip()) < NATIVE_MIN_CHARS_PER_PAGE:
+                return None
+            pages.append(text)
+
+        title = (reader.metadata.title if reader.metadata else None) or ""
+    except Exception:
+        logger.info("convert: native probe could not read pdf, using calibre", exc_info=True)
+        return None
+
+    return title.strip(), pages
+
+
+def _join_lines(lines: list[str]) -> str:
+    text = ""
+    for line in lines:
+        if text.endswith("-") and line[:1].islower():
+            text = text[:-1] + line
+        else:
+            text = f"{text} {line}" if text else line
+    return text
+
+
+def _text_blocks(text: str) -> list[tuple[str, str]]:
+    """Split one page of extracted text into ("h2" | "p", text) blocks.
+
+    A paragraph ends at a blank line, or at a line that ends a sentence and is
+    noticeably shorter than a full line of body text. A heading is a short line
+    matching HEADING_RE that stands on its own: it starts a block (after a blank
+    line or a finished sentence) and is followed by a blank line, the end of the
+    page or a capitalised line.
+    """
+    lines = [line.strip() for line in text.splitlines()]
+    lengths = sorted(len(line) for line in lines if line)
+    full_line = lengths[len(lengths) * 3 // 4] if lengths else 0
+
+    blocks: list[tuple[str, str]] = []
+    para: list[str] = []
+
+    def flush() -> None:
+        if para:
+            blocks.append(("p", _join_lines(para)))
+            para.clear()
+
+    def is_heading(i: int) -> bool:
+        line = lines[i]
+        if len(line) >= 80 or line.endswith((".", ",", ";")) or not HEADING_RE.match(line):
+            return False
+        if para and not para[-1].endswith(SENTENCE_END):
+            return False
+        following = lines[i + 1] if i + 1 < len(lines) else ""
+        return not following or following[:1].isupper()
+
+    for i, line in enumerate(lines):
+        if not line:
+            flush()
+        elif is_heading(i):
+            flush()
+            blocks.append(("h2", line))
+        else:
+            para.append(line)
+            if line.endswith(SENTENCE_END) and len(line) < 0.8 * full_line:
+                flush()
+    flush()
+    return blocks
+
+
+def _book_blocks(pages: list[str]) -> list[tuple[str, str]]:
+    """_text_blocks for the whole book, joining a paragraph that runs across a page break."""
+    blocks: list[tuple[str, str]] = []
+    for text in pages:
+        page_blocks = _text_blocks(text)
+        if (blocks and page_blocks and blocks[-1][0] == "p" and page_blocks[0][0] == "p"
+                and not blocks[-1][1].endswith(SENTENCE_END)):
+            blocks[-1] = ("p", _join_lines([blocks[-1][1], page_blocks.pop(0)[1]]))
+        blocks.extend(page_blocks)
+    return blocks
+
+
+def write_text_epub(title: str, pages: list[str], epub_path: Path) -> None:
+    """Write a minimal EPUB 3 from per-page PDF text.
+
+    The text flows on across PDF pages; a new XHTML document starts only at a
+    heading or, in a long stretch without one, at a paragraph once the current
+    document passes NATIVE_DOC_MAX_CHARS, so the reader only breaks pages there.
+    """
+    book_id = f"urn:uuid:{uuid.uuid4()}"
+    modified = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    if not title:
+        first_line = next((line.strip() for line in pages[0].splitlines() if line.strip()), "") if pages else ""
+        title = first_line[:120] or "Document"
+
+    sections: list[list[tuple[str, str]]] = [[]]
+    chars = 0
+    for kind, content in _book_blocks(pages):
+        if sections[-1] and (kind == "h2" or chars > NATIVE_DOC_MAX_CHARS):
+            sections.append([])
+            chars = 0
+        sections[-1].append((kind, content))
+        chars += len(content)
+
+    docs = []
+    toc = []
+    for n, blocks in enumerate(sections, start=1):
+        name = f"text-{n:04d}.xhtml"
+        body = []
+        for i, (kind, content) in enumerate(blocks):
+            if kind == "h2":
+                anchor = f"h{n}-{i}"
+                toc.append((f"{name}#{anchor}", content))
+                body.append(f'<h2 id="{anchor}">{html.escape(content)}</h2>')
+            else:
+                body.append(f"<p>{html.escape(content)}</p>")
+        docs.append((name, (
+            '<?xml version="1.0" encoding="utf-8"?>\n<!DOCTYPE html>\n'
+            '<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops">'
+            f'<head><title>{html.escape(title)}</title></head><body>{"".join(body)}</body></html>'
+        )))
+
+    if not toc:
+        toc = [(docs[0][0], title)]
+    nav_items = "".join(f'<li><a href={quoteattr(href)}>{html.escape(label)}</a></li>' for href, label in toc)
+
+    with zipfile.ZipFile(epub_path, "w", zipfile.ZIP_DEFLATED) as out:
+        out.writestr(zipfile.ZipInfo("mimetype"), "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+        out.writestr("META-INF/container.xml",
+                     '<?xml version="1.0"?>\n<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">'
+                     '<rootfiles><rootfile full-path="content.opf" media-type="application/oebps-package+xml"/></rootfiles></container>')
+        out.writestr("nav.xhtml", (
+            '<?xml version="1.0" encoding="utf-8"?>\n<!DOCTYPE html>\n'
+            '<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops">'
+            f'<head><title>{html.escape(title)}</title></head><body>'
+            f'<nav epub:type="toc" id="toc"><h1>Contents</h1><ol>{nav_items}</ol></nav></body></html>'
+        ))
+        for name, content in docs:
+            out.writestr(name, content)
+
+        manifest = "".join(f'<item id="p{i}" href="{name}" media-type="application/xhtml+xml"/>' for i, (name, _) in enumerate(docs))
+        spine = "".join(f'<itemref idref="p{i}"/>' for i in range(len(docs)))
+        out.writestr("content.opf", (
+            '<?xml version="1.0" encoding="utf-8"?>\n'
+            '<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="bookid">'
+            '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">'
+            f'<dc:identifier id="bookid">{book_id}</dc:identifier><dc:title>{html.escape(title)}</dc:title>'
+            f'<dc:language>en</dc:language><meta property="dcterms:modified">{modified}</meta></metadata>'
+            f'<manifest><item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>{manifest}</manifest>'
+            f'<spine>{spine}</spine></package>'
+        ))
+
+
+@dataclass(frozen=True)
+class OutputProfile:
+    """Device-tuned calibre output, so the Kindle service doesn't have to reprocess the book."""
+
+    name: str
+    calibre_args: tuple[str, ...]
+    screen: tuple[int, int]  # panel size in pixels, used to size images
+
+
+OUTPUT_PROFILES = {
+    p.name: p
+    for p in (
+        OutputProfile("paperwhite", ("--output-profile", "kindle_pw3", "--epub-version", "3",
+                                     "--no-default-epub-cover"), (1236, 1648)),
+        OutputProfile("scribe", ("--output-profile", "kindle_scribe", "--epub-version", "3",
+                                 "--no-default-epub-cover"), (1860, 2480)),
+        OutputProfile("epub3", ("--epub-version", "3"), (1600, 2400)),
+        # every book is delivered by email to Send to Kindle, which only accepts EPUB,
+        # so there is no AZW3/KF8 profile until there's another way to deliver one
+    )
+}
+if OUTPUT_PROFILE not in OUTPUT_PROFILES:
+    raise RuntimeError(f"OUTPUT_PROFILE must be one of {', '.join(OUTPUT_PROFILES)}")
+
+@CONVERSIONS_IN_FLIGHT.track_inprogress()
+@STAGE_SECONDS.labels("convert").time()
+def pdf_to_epub(pdf_path: Path, epub_path: Path, profile: OutputProfile = OUTPUT_PROFILES[OUTPUT_PROFILE]) -> None:
+    """Convert pdf_path to an EPUB at epub_path, tuned for profile."""
+    if CONVERT_ENGINE == "auto" and _convert_native(pdf_path, epub_path):
+        CONVERSIONS_BY_ENGINE.labels("native").inc()
+    else:
+        logger.info("convert: starting pdf->epub via calibre profile=%s", profile.name)
+        logger.info("convert: input=%s output=%s bin=%s", pdf_path, epub_path, EBOOK_CONVERT_BIN)
+
+        page_count = _page_count(pdf_path) if SHARD_MIN_PAGES else 0
+        if SHARD_MIN_PAGES and page_count >= SHARD_MIN_PAGES:
+            _convert_sharded(pdf_path, epub_path, page_count, profile.calibre_args)
+            CONVERSIONS_BY_ENGINE.labels("calibre_sharded").inc()
+        else:
+            _convert_one(pdf_path, epub_path, profile.calibre_args)
+            CONVERSIONS_BY_ENGINE.labels("calibre").inc()
+
+    if not epub_path.exists() or epub_path.stat().st_size == 0:
+        logger.error("convert: output epub missing/empty at %s", epub_path)
+        raise RuntimeError("Conversion failed: output EPUB was not created")
+
+    logger.info("convert: success (bytes=%d)", epub_path.stat().st_size)
+
+
+@lru_cache(maxsize=1)
+def converter_version() -> str:
+    """Version string of the calibre install, so upgrading calibre invalidates cached output."""
+    try:
+        p = subprocess.run([EBOOK_CONVERT_BIN, "--version"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=30)
+        version = (p.stdout or b"").decode(errors="replace").strip().splitlines()
+        return version[0] if version else "unknown"
     except Exception:
-        # send_email_with_attachment expects an attachment; so do a plain send here instead
+        logger.warning("cache: could not determine converter version", exc_info=True)
+        return "unknown"
+
+
+def conversion_options_key(profile: OutputProfile) -> str:
+    """Everything besides the input bytes that changes what pdf_to_epub produces."""
+    key = f"bin={EBOOK_CONVERT_BIN};version={converter_version()};engine={CONVERT_ENGINE}"
+    key += f";profile={profile.name}/{' '.join(profile.calibre_args)}"
+    if CONVERT_ENGINE == "auto":
+        key += f";native={NATIVE_ENGINE_VERSION}/{NATIVE_MAX_PAGES}/{NATIVE_MIN_CHARS_PER_PAGE}"
+    if SHARD_MIN_PAGES:
+        key += f";shard={SHARD_MIN_PAGES}/{SHARD_PAGES}"
+    if IMAGE_OPTIMIZE:
+        key += (f";images={'x'.join(map(str, image_max_size(profile)))}/{IMAGE_GRAYSCALE}"
+                f"/q{IMAGE_JPEG_QUALITY}/c{IMAGE_PNG_COLORS}")
+    return key
+
+
+class ConversionCache:
+    """On-disk cache of converted EPUBs keyed by input hash + converter options.
+
+    Entries are plain files; mtime is bumped on every hit and the least recently
+    used entries are evicted once the directory grows past max_bytes.
+    """
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def key(self, pdf_sha256: str, options: str) -> str:
+        return hashlib.sha256(f"{pdf_sha256}\0{options}".encode()).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.epub"
+
+    def get(self, key: str, dest: Path) -> bool:
+        """Copy the cached entry for key to dest. Returns False on a miss."""
+        if not self.enabled:
+            return False
+
+        path = self._path(key)
         try:
-            if not SMTP_HOST:
-                raise RuntimeError("SMTP_HOST is not set")
-
-            msg = EmailMessage()
-            msg["From"] = SMTP_FROM
-            msg["To"] = "ozzy.dave@gmail.com"
-            msg["Subject"] = "SMTP test (no attachment)"
-            msg.set_content("If you received this, SMTP is working.")
-
-            logger.info("test-email: connecting host=%s port=%d tls=%s user_set=%s",
-                        SMTP_HOST, SMTP_PORT, SMTP_TLS, bool(SMTP_USER))
-
-            with smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=30) as s:
-                if SMTP_TLS:
-                    logger.info("test-email: starting TLS")
-                    s.starttls()
-                if SMTP_USER:
-                    logger.info("test-email: logging in as %s", SMTP_USER)
-                    s.login(SMTP_USER, SMTP_PASS)
-
-                logger.info("test-email: sending")
-                s.send_message(msg)
-
-            logger.info("test-email: sent ok")
-        except Exception as e:
-            logger.exception("test-email: failed")
-            raise HTTPException(status_code=502, detail=str(e))
+            shutil.copyfile(path, dest)
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            CACHE_REQUESTS.labels("miss").inc()
+            logger.info("cache: miss key=%s", key[:12])
+            return False
 
-    return JSONResponse({"ok": True, "sent_to": KINDLE_EMAIL})
+        with self._lock:
+            self.hits += 1
+        CACHE_REQUESTS.labels("hit").inc()
+        logger.info("cache: hit key=%s bytes=%d", key[:12], dest.stat().st_size)
+        return True
 
-@app.get("/")
-def root():
-    return "ok"
+    def put(self, key: str, src: Path) -> None:
+        if not self.enabled:
+            return
+
+        path = self._path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+            shutil.copyfile(src, tmp)
+            os.replace(tmp, path)
+        except OSError:
+            logger.warning("cache: failed to store key=%s", key[:12], exc_info=True)
+            return
+
+        logger.info("cache: stored key=%s bytes=%d", key[:12], path.stat().st_size)
+        self._evict()
+
+    def _evict(self) -> None:
+        with self._lock:
+            entries = []
+            total = 0
+            for p in self.root.glob("*/*.epub"):
+                try:
+                    st = p.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, p))
+                total += st.st_size
+
+            entries.sort()
+            while total > self.max_bytes and entries:
+                _, size, p = entries.pop(0)
+                p.unlink(missing_ok=True)
+                total -= size
+                logger.info("cache: evicted %s bytes=%d", p.name, size)
+
+    def stats(self) -> dict:
+        return {"enabled": self.enabled, "hits": self.hits, "misses": self.misses, "max_bytes": self.max_bytes}
+
+
+CACHE = ConversionCache(Path(CACHE_DIR), CACHE_MAX_BYTES)
+
+
+class SMTPPool:
+    """Keeps authenticated SMTP sessions open between deliveries.
+
+    Idle sessions are checked with NOOP before reuse and dropped once they've
+    been idle for idle_timeout seconds. A send that hits a dropped connection
+    or a 421 is retried once on a fresh session.
+    """
+
+    def __init__(self, size: int, idle_timeout: float):
+        self.idle_timeout = idle_timeout
+        self._idle: list[tuple[smtplib.SMTP, float]] = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max(1, size))
+
+    def _connect(self) -> smtplib.SMTP:
+        logger.info("email: connecting host=%s port=%d tls=%s user_set=%s",
+                    SMTP_HOST, SMTP_PORT, SMTP_TLS, bool(SMTP_USER))
+        s = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=30)
+        try:
+            if SMTP_TLS:
+                logger.info("email: starting TLS")
+                s.starttls()
+
+            if SMTP_USER:
+                logger.info("email: logging in as %s", SMTP_USER)
+                s.login(SMTP_USER, SMTP_PASS)
+        except Exception:
+            self._discard(s)
+            raise
+        return s
+
+    @staticmethod
+    def _discard(s: smtplib.SMTP) -> None:
+        try:
+            s.quit()
+        except Exception:
+            s.close()
+
+    def _checkout(self) -> smtplib.SMTP:
+        now = time.monotonic()
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                s, last_used = self._idle.pop()
+
+            if now - last_used > self.idle_timeout:
+                logger.info("email: closing session idle for %.0fs", now - last_used)
+                self._discard(s)
+                continue
+
+            try:
+                if s.noop()[0] == 250:
+                    logger.info("email: reusing warm session")
+                    return s
+            except (smtplib.SMTPException, OSError):
+                pass
+            logger.info("email: warm session failed NOOP, dropping it")
+            s.close()
+
+        return self._connect()
+
+    @contextmanager
+    def connection(self):
+        with self._slots:
+            s = self._checkout()
+            try:
+                yield s
+            except BaseException:
+                self._discard(s)
+                raise
+            with self._lock:
+                self._idle.append((s, time.monotonic()))
+
+    @staticmethod
+    def _sendmail(s: smtplib.SMTP, msg: "StreamingMessage") -> None:
+        s.ehlo_or_helo_if_needed()
+        code, text = s.mail(msg.from_addr)
+        if code != 250:
+            raise smtplib.SMTPSenderRefused(code, text, msg.from_addr)
+        code, text = s.rcpt(msg.to_addr)
+        if code not in (250, 251):
+            raise smtplib.SMTPResponseException(code, text)
+        s.putcmd("data")
+        code, text = s.getreply()
+        if code != 354:
+            raise smtplib.SMTPDataError(code, text)
+
+        for chunk in msg.chunks():
+            s.send(chunk)
+        s.send(b".\r\n")
+        code, text = s.getreply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, text)
+
+    def send(self, msg: "StreamingMessage") -> None:
+        for attempt in (1, 2):
+            try:
+                with self.connection() as s:
+                    logger.info("email: sending")
+                    self._sendmail(s, msg)
+                return
+            except (smtplib.SMTPServerDisconnected, smtplib.SMTPResponseException) as e:
+                if attempt == 2 or getattr(e, "smtp_code", 421) != 421:
+                    raise
+                logger.warning("email: session dropped (%s), retrying on a fresh connection", e)
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for s, _ in idle:
+            self._discard(s)
+
+
+SMTP_POOL = SMTPPool(SMTP_POOL_SIZE, SMTP_POOL_IDLE_SECONDS)
+
+
+class AsyncSMTPConnection:
+    """Minimal asyncio SMTP client: EHLO, STARTTLS, AUTH PLAIN/LOGIN, MAIL/RCPT/DATA.
+
+    Failures are raised as the matching smtplib exceptions so callers can treat
+    both delivery paths the same way.
+    """
+
+    def __init__(self, host: str, port: int, timeout: float = 30):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.extensions: dict[str, str] = {}
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+
+    async def _read_reply(self) -> tuple[int, str]:
+        lines = []
+        while True:
+            try:
+                line = await asyncio.wait_for(self._reader.readline(), self.timeout)
+            except (asyncio.TimeoutError, OSError) as e:
+                self.close()
+                raise smtplib.SMTPServerDisconnected(f"Connection lost: {e!r}") from e
+            if not line:
+                self.close()
+                raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+            line = line.decode(errors="replace").rstrip("\r\n")
+            lines.append(line[4:])
+            if len(line) < 4 or line[3] != "-":
+                try:
+                    return int(line[:3]), "\n".join(lines)
+                except ValueError:
+                    raise smtplib.SMTPResponseException(-1, f"Malformed reply: {line!r}") from None
+
+    async def command(self, line: str, expect: tuple = (250,)) -> tuple[int, str]:
+        if self._writer is None:
+            raise smtplib.SMTPServerDisconnected("Not connected")
+        self._writer.write(line.encode() + b"\r\n")
+        await self._writer.drain()
+        code, text = await self._read_reply()
+        if code not in expect:
+            raise smtplib.SMTPResponseException(code, text)
+        return code, text
+
+    async def connect(self) -> None:
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), self.timeout)
+        code, text = await self._read_reply()
+        if code != 220:
+            raise smtplib.SMTPConnectError(code, text)
+        await self.ehlo()
+
+    async def ehlo(self) -> None:
+        _, text = await self.command(f"EHLO {socket.getfqdn()}")
+        self.extensions = {}
+        for line in text.splitlines()[1:]:
+            name, _, params = line.partition(" ")
+            self.extensions[name.upper()] = params
+
+    async def starttls(self) -> None:
+        await self.command("STARTTLS", expect=(220,))
+        await self._writer.start_tls(ssl.create_default_context(), server_hostname=self.host)
+        await self.ehlo()
+
+    async def login(self, user: str, password: str) -> None:
+        mechanisms = self.extensions.get("AUTH", "").upper().split()
+        try:
+            if "PLAIN" in mechanisms or not mechanisms:
+                token = base64.b64encode(f"\0{user}\0{password}".encode()).decode()
+                await self.command(f"AUTH PLAIN {token}", expect=(235,))
+            else:
+                await self.command("AUTH LOGIN", expect=(334,))
+                await self.command(base64.b64encode(user.encode()).decode(), expect=(334,))
+                await self.command(base64.b64encode(password.encode()).decode(), expect=(235,))
+        except smtplib.SMTPResponseException as e:
+            raise smtplib.SMTPAuthenticationError(e.smtp_code, e.smtp_error) from None
+
+    async def noop(self) -> int:
+        code, _ = await self.command("NOOP", expect=range(200, 600))
+        return code
+
+    async def sendmail(self, msg: "StreamingMessage") -> None:
+        await self.command(f"MAIL FROM:<{msg.from_addr}>")
+        await self.command(f"RCPT TO:<{msg.to_addr}>", expect=(250, 251))
+        await self.command("DATA", expect=(354,))
+
+        # chunks() reads the attachment from disk, so pull each one in a worker thread
+        chunks = msg.chunks()
+        while (chunk := await asyncio.to_thread(next, chunks, None)) is not None:
+            self._writer.write(chunk)
+            await self._writer.drain()
+        self._writer.write(b".\r\n")
+        await self._writer.drain()
+        code, text = await self._read_reply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, text)
+
+    async def quit(self) -> None:
+        try:
+            await self.command("QUIT", expect=(221,))
+        except (smtplib.SMTPException, OSError):
+            pass
+        self.close()
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+class AsyncSMTPPool:
+    """Event-loop counterpart of SMTPPool: same NOOP check, idle timeout and
+    single retry on 421 / dropped connections, without a thread per delivery.
+    """
+
+    def __init__(self, size: int, idle_timeout: float):
+        self.size = max(1, size)
+        self.idle_timeout = idle_timeout
+        self._idle: list[tuple[AsyncSMTPConnection, float]] = []
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    async def _connect(self) -> AsyncSMTPConnection:
+        logger.info("email: connecting (async) host=%s port=%d tls=%s user_set=%s",
+                    SMTP_HOST, SMTP_PORT, SMTP_TLS, bool(SMTP_USER))
+        conn = AsyncSMTPConnection(SMTP_HOST, SMTP_PORT)
+        try:
+            await conn.connect()
+            if SMTP_TLS:
+                logger.info("email: starting TLS")
+                await conn.starttls()
+
+            if SMTP_USER:
+                logger.info("email: logging in as %s", SMTP_USER)
+                await conn.login(SMTP_USER, SMTP_PASS)
+        except BaseException:
+            conn.close()
+            raise
+        return conn
+
+    async def _checkout(self) -> AsyncSMTPConnection:
+        now = time.monotonic()
+        while self._idle:
+            conn, last_used = self._idle.pop()
+            if now - last_used > self.idle_timeout:
+                logger.info("email: closing session idle for %.0fs", now - last_used)
+                await conn.quit()
+                continue
+
+            try:
+                if await conn.noop() == 250:
+                    logger.info("email: reusing warm session")
+                    return conn
+            except (smtplib.SMTPException, OSError):
+                pass
+            logger.info("email: warm session failed NOOP, dropping it")
+            conn.close()
+
+        return await self._connect()
+
+    async def send(self, msg: "StreamingMessage") -> None:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.size)
+
+        for attempt in (1, 2):
+            async with self._slots:
+                conn = await self._checkout()
+                try:
+                    logger.info("email: sending")
+                    await conn.sendmail(msg)
+                except (smtplib.SMTPServerDisconnected, smtplib.SMTPResponseException) as e:
+                    conn.close()
+                    if attempt == 2 or getattr(e, "smtp_code", 421) != 421:
+                        raise
+                    logger.warning("email: session dropped (%s), retrying on a fresh connection", e)
+                    continue
+                except BaseException:
+                    conn.close()
+                    raise
+                self._idle.append((conn, time.monotonic()))
+                return
+
+    async def close(self) -> None:
+        idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            await conn.quit()
+
+
+ASYNC_SMTP_POOL = AsyncSMTPPool(SMTP_POOL_SIZE, SMTP_POOL_IDLE_SECONDS)
+
+
+ATTACHMENT_CHUNK_BYTES = 57 * 1024  # whole 76-char base64 lines per read
+MESSAGE_TEXT_ALLOWANCE_BYTES = 4096  # To, Subject and body text of a one-book message, for fit_for_delivery
+
+
+def _dot_stuff(data: bytes) -> bytes:
+    return re.sub(rb"(?m)^\.", b"..", data)
+
+
+def encoded_size(nbytes: int) -> int:
+    """Wire size of nbytes as base64 in 76-character CRLF lines."""
+    full, rest = divmod(nbytes, 57)
+    return full * 78 + ((rest + 2) // 3 * 4 + 2 if rest else 0)
+
+
+class StreamingMessage:
+    """A text/plain mail with optional file attachments, rendered onto the wire in chunks.
+
+    Headers and MIME part headers come from EmailMessage; attachment bodies are
+    base64-encoded straight from disk ATTACHMENT_CHUNK_BYTES at a time, so a
+    delivery holds one chunk in memory rather than several copies of each file.
+    chunks() starts from the top on every call, so sends can retry.
+    """
+
+    def __init__(self, from_addr: str, to_addr: str, subject: str, body: str, attachments: list[Path] = ()):
+        self.from_addr = from_addr
+        self.to_addr = to_addr
+        self.attachments = list(attachments)
+
+        msg = EmailMessage(policy=SMTP_POLICY)
+        msg["From"] = from_addr
+        msg["To"] = to_addr
+        msg["Subject"] = subject
+        msg.set_content(body)
+        if not self.attachments:
+            self._head, self._part_heads, self._tail = _dot_stuff(msg.as_bytes()), [], b""
+            return
+
+        for path in self.attachments:
+            # empty payload: chunks() streams the body in after the part headers
+            msg.add_attachment(b"", maintype="application", subtype="epub+zip", filename=path.name)
+        msg.set_boundary(f"=_{uuid.uuid4().hex}")
+        # each part's content ends in CRLF, which doubles as the CRLF that opens the next delimiter
+        delimiter = f"--{msg.get_boundary()}\r\n".encode()
+        text, *parts = msg.iter_parts()
+        headers = b"".join(SMTP_POLICY.fold_binary(name, value) for name, value in msg.items())
+        self._head = _dot_stuff(headers + b"\r\n" + delimiter + text.as_bytes(policy=SMTP_POLICY))
+        self._part_heads = [_dot_stuff(delimiter + part.as_bytes(policy=SMTP_POLICY)) for part in parts]
+        self._tail = f"--{msg.get_boundary()}--\r\n".encode()
+
+    def wire_size(self) -> int:
+        """Exact DATA size in bytes, without reading the attachments."""
+        return (len(self._head) + len(self._tail)
+                + sum(len(head) + encoded_size(path.stat().st_size) for head, path in zip(self._part_heads, self.attachments)))
+
+    def chunks(self):
+        """Yield the message as dot-stuffed DATA, line-aligned chunks."""
+        yield self._head
+        for part_head, path in zip(self._part_heads, self.attachments):
+            yield part_head
+            with open(path, "rb") as f:
+                while block := f.read(ATTACHMENT_CHUNK_BYTES):
+                    # base64 output never starts a line with "." so needs no stuffing
+                    yield base64.encodebytes(block).replace(b"\n", b"\r\n")
+        if self._tail:
+            yield self._tail
+
+
+def build_email_message(subject: str, body: str, to_addr: str, attachments: list[Path]) -> StreamingMessage:
+    logger.info("email: preparing message to=%s from=%s", to_addr, SMTP_FROM)
+
+    if not SMTP_HOST:
+        logger.error("email: SMTP_HOST is not set")
+        raise RuntimeError("SMTP_HOST is not set")
+
+    for path in attachments:
+        if not path.exists():
+            logger.error("email: attachment missing at %s", path)
+            raise RuntimeError("Attachment not found")
+        logger.info("email: attachment=%s bytes=%d", path.name, path.stat().st_size)
+
+    return StreamingMessage(SMTP_FROM, to_addr, subject, body, attachments)
+
+
+def send_email_with_attachment(
+    subject: str,
+    body: str,
+    to_addr: str,
+    attachments: list[Path],
+) -> None:
+    with STAGE_SECONDS.labels("mime_build").time():
+        msg = build_email_message(subject, body, to_addr, attachments)
+
+    try:
+        with STAGE_SECONDS.labels("smtp_send").time():
+            SMTP_POOL.send(msg)
+    except smtplib.SMTPAuthenticationError:
+        logger.exception("email: authentication failed")
+        raise RuntimeError("Email failed: SMTP authentication failed (check SMTP_USER/SMTP_PASS)") from None
+    except Exception as e:
+        logger.exception("email: send failed")
+        raise RuntimeError(f"Email failed: {e}") from e
+
+    BYTES_OUT.inc(sum(path.stat().st_size for path in attachments))
+    logger.info("email: sent ok")
+
+
+async def send_email_with_attachment_async(
+    subject: str,
+    body: str,
+    to_addr: str,
+    attachments: list[Path],
+) -> None:
+    def build() -> StreamingMessage:
+        with STAGE_SECONDS.labels("mime_build").time():
+            return build_email_message(subject, body, to_addr, attachments)
+
+    msg = await asyncio.to_thread(build)
+
+    try:
+        t0 = time.monotonic()
+        await ASYNC_SMTP_POOL.send(msg)
+        STAGE_SECONDS.labels("smtp_send").observe(time.monotonic() - t0)
+    except smtplib.SMTPAuthenticationError:
+        logger.exception("email: authentication failed")
+        raise RuntimeError("Email failed: SMTP authentication failed (check SMTP_USER/SMTP_PASS)") from None
+    except Exception as e:
+        logger.exception("email: send failed")
+        raise RuntimeError(f"Email failed: {e}") from e
+
+    BYTES_OUT.inc(sum(path.stat().st_size for path in attachments))
+    logger.info("email: sent ok")
+
+
+async def deliver_email(subject: str, body: str, to_addr: str, attachments: list[Path]) -> None:
+    """Send on the event loop, or fall back to smtplib in a worker thread when SMTP_ASYNC is off."""
+    if SMTP_ASYNC:
+        await send_email_with_attachment_async(subject, body, to_addr, attachments)
+    else:
+        await asyncio.to_thread(send_email_with_attachment, subject, body, to_addr, attachments)
+
+
+@dataclass(eq=False)
+class Job:
+    id: str
+    client_id: str
+    filename: Optional[str]
+    recipients: tuple[str, ...]
+    sha256: str
+    size: int
+    profile: str = OUTPUT_PROFILE
+    stage: str = "queued"  # queued -> converting -> planning -> emailing -> done | failed
+    error: Optional[str] = None
+    error_class: Optional[str] = None
+    failed_stage: Optional[str] = None
+    cache_hit: Optional[bool] = None
+    shared_conversion: bool = False
+    image_stats: Optional[dict] = None
+    delivery: Optional[str] = None  # as_is | recompressed | volumes:N, see fit_for_delivery
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+    timings: dict = field(default_factory=dict)
+    ticket: Optional["Ticket"] = field(default=None, repr=False)
+
+    def set_stage(self, stage: str) -> None:
+        logger.info("job %s: stage %s -> %s", self.id, self.stage, stage)
+        self.stage = stage
+        self.updated_at = time.time()
+
+    def to_dict(self) -> dict:
+        position = wait = None
+        if self.ticket is not None:
+            position = CONVERT_SCHEDULER.position(self.ticket)
+            wait = CONVERT_SCHEDULER.estimated_wait(self.ticket)
+        return {
+            "id": self.id,
+            "filename": self.filename,
+            "size": self.size,
+            "profile": self.profile,
+            "stage": self.stage,
+            "queue_position": position,
+            "estimated_wait_seconds": None if wait is None else round(wait, 1),
+            "sent_to": ", ".join(self.recipients),
+            "recipients": list(self.recipients),
+            "sha256": self.sha256,
+            "cache_hit": self.cache_hit,
+            "shared_conversion": self.shared_conversion,
+            "image_stats": self.image_stats,
+            "delivery": self.delivery,
+            "error": self.error,
+            "error_class": self.error_class,
+            "failed_stage": self.failed_stage,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+            "timings": {k: round(v, 3) for k, v in self.timings.items()},
+        }
+
+
+JOBS: dict[str, Job] = {}
+# asyncio only keeps weak references to tasks; hold on to background pipelines until they finish
+BACKGROUND_TASKS: set[asyncio.Task] = set()
+
+
+def new_job(client_id: str, filename: Optional[str], recipients: tuple[str, ...], sha256: str, size: int, profile: str) -> Job:
+    now = time.time()
+    for job_id, job in list(JOBS.items()):
+        if job.stage in ("done", "failed") and now - job.updated_at > JOB_TTL_SECONDS:
+            del JOBS[job_id]
+
+    job = Job(id=uuid.uuid4().hex, client_id=client_id, filename=filename, recipients=recipients, sha256=sha256,
+              size=size, profile=profile)
+    JOBS[job.id] = job
+    return job
+
+
+@dataclass(eq=False)
+class Ticket:
+    client_id: str
+    size: int
+    finish_tag: float = 0.0
+    seq: int = 0
+    started: Optional[asyncio.Future] = None
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+class ConversionScheduler:
+    """Fair-share, size-aware admission in front of the conversion workers.
+
+    Self-clocked fair queuing: each ticket's finish tag is
+    max(virtual time, the client's previous finish tag) + its size, and the
+    lowest tag runs next. A client with twenty queued textbooks stacks up tags
+    far in the future, while a small PDF from anyone else lands just past the
+    current virtual time and goes ahead of them.
+
+    Wait estimates model a conversion as seconds_per_job (calibre's startup and
+    fixed work) plus seconds_per_byte, fitted by least squares over recent runs
+    with older runs decaying away. Without that split, a run of small PDFs would
+    charge their startup cost to their few bytes and inflate every estimate.
+    """
+
+    MIN_COST = 64 * 1024  # so tiny PDFs still pay something for their slot
+    FIT_DECAY = 0.8  # weight kept by older runs at each new one
+
+    def __init__(self, workers: int):
+        self.workers = max(1, workers)
+        self.running = 0
+        self.seconds_per_byte = CONVERT_SECONDS_PER_MB / (1024 * 1024)
+        self.seconds_per_job = CONVERT_SECONDS_PER_JOB
+        # decayed sums over (size, seconds) of finished runs: weight, x, y, xx, xy
+        self._fit = (0.0, 0.0, 0.0, 0.0, 0.0)
+        self._queue: list[tuple[float, int, Ticket]] = []
+        self._last_finish: dict[str, float] = {}
+        self._vtime = 0.0
+        self._seq = 0
+
+    def submit(self, client_id: str, size: int) -> Ticket:
+        self._seq += 1
+        start = max(self._vtime, self._last_finish.get(client_id, 0.0))
+        ticket = Ticket(client_id=client_id, size=size, seq=self._seq,
+                        finish_tag=start + max(size, self.MIN_COST),
+                        started=asyncio.get_running_loop().create_future())
+        self._last_finish[client_id] = ticket.finish_tag
+        heapq.heappush(self._queue, (ticket.finish_tag, ticket.seq, ticket))
+        CONVERSIONS_QUEUED.inc()
+        self._dispatch()
+        return ticket
+
+    def _dispatch(self) -> None:
+        while self.running < self.workers and self._queue:
+            _, _, ticket = heapq.heappop(self._queue)
+            CONVERSIONS_QUEUED.dec()
+            if ticket.started.done():  # cancelled while queued
+                continue
+            self._vtime = ticket.finish_tag
+            self.running += 1
+            ticket.started.set_result(None)
+
+        # clients whose tags are behind virtual time are back to a clean slate
+        for client_id, tag in list(self._last_finish.items()):
+            if tag <= self._vtime:
+                del self._last_finish[client_id]
+
+    async def run(self, ticket: Ticket, fn, *args):
+        """Wait for ticket's turn, then run fn(*args) on the conversion executor."""
+        try:
+            await ticket.started
+        except asyncio.CancelledError:
+            # cancelling the wait cancels ticket.started, which _dispatch then skips
+            self.cancel(ticket)
+            raise
+
+        logger.info("scheduler: starting client=%s bytes=%d waited=%.1fs",
+                    ticket.client_id, ticket.size, time.monotonic() - ticket.enqueued_at)
+        t0 = time.monotonic()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(CONVERT_EXECUTOR, fn, *args)
+        finally:
+            self._observe(ticket.size, time.monotonic() - t0)
+            self.running -= 1
+            self._dispatch()
+
+    def _observe(self, size: int, seconds: float) -> None:
+        w, sx, sy, sxx, sxy = (v * self.FIT_DECAY for v in self._fit)
+        w, sx, sy, sxx, sxy = w + 1, sx + size, sy + seconds, sxx + size * size, sxy + size * seconds
+        self._fit = (w, sx, sy, sxx, sxy)
+        mean_x, mean_y = sx / w, sy / w
+        var_x = sxx / w - mean_x * mean_x
+        # only refit the slope once recent sizes differ by more than MIN_COST or so;
+        # until then the time is put down to the fixed cost
+        if var_x > self.MIN_COST * self.MIN_COST:
+            self.seconds_per_byte = max(0.0, (sxy / w - mean_x * mean_y) / var_x)
+        self.seconds_per_job = max(0.0, mean_y - self.seconds_per_byte * mean_x)
+
+    def cancel(self, ticket: Ticket) -> None:
+        """Withdraw a ticket that will never be run, handing back its slot if it was granted."""
+        if not ticket.started.done():
+            ticket.started.cancel()
+        elif not ticket.started.cancelled():
+            self.running -= 1
+            self._dispatch()
+
+    def position(self, ticket: Ticket) -> Optional[int]:
+        """1-based place in the queue, or None once the ticket has started."""
+        if ticket.started is None or ticket.started.done():
+            return None
+        key = (ticket.finish_tag, ticket.seq)
+        return 1 + sum(1 for tag, seq, t in self._queue if (tag, seq) < key and not t.started.done())
+
+    def estimated_wait(self, ticket: Ticket) -> Optional[float]:
+        if ticket.started is None or ticket.started.done():
+            return None
+        key = (ticket.finish_tag, ticket.seq)
+        ahead = [t.size for tag, seq, t in self._queue if (tag, seq) < key and not t.started.done()]
+        return (len(ahead) * self.seconds_per_job + sum(ahead) * self.seconds_per_byte) / self.workers
+
+    def stats(self) -> dict:
+        queued = [t for _, _, t in self._queue if not t.started.done()]
+        per_client: dict[str, int] = {}
+        for t in queued:
+            per_client[t.client_id] = per_client.get(t.client_id, 0) + 1
+        return {
+            "workers": self.workers,
+            "running": self.running,
+            "queued": len(queued),
+            "queued_by_client": per_client,
+            "seconds_per_job": round(self.seconds_per_job, 2),
+            "seconds_per_mb": round(self.seconds_per_byte * 1024 * 1024, 2),
+        }
+
+
+CONVERT_SCHEDULER = ConversionScheduler(CONVERT_WORKERS)
+
+
+@dataclass
+class _Flight:
+    ticket: Ticket
+    task: Optional[asyncio.Task] = None
+    workdir: Optional[Path] = None  # set by the task once its workspace exists
+    waiters: int = 0
+
+
+# cache key -> the one conversion currently running for it
+INFLIGHT: dict[str, _Flight] = {}
+
+
+def _link_or_copy(src: Path, dst: Path) -> None:
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def image_max_size(profile: OutputProfile) -> tuple[int, int]:
+    return (IMAGE_MAX_WIDTH or profile.screen[0], IMAGE_MAX_HEIGHT or profile.screen[1])
+
+
+IMAGE_EXECUTOR = ThreadPoolExecutor(max_workers=max(1, IMAGE_WORKERS), thread_name_prefix="image")
+
+
+def _optimize_image(data: bytes, max_size: tuple[int, int], grayscale: bool, jpeg_quality: int, png_colors: int) -> bytes:
+    """Resample/recompress one image, keeping its format so EPUB references stay valid.
+    Returns the original bytes if the result isn't smaller.
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            fmt = img.format
+            if fmt not in ("JPEG", "PNG"):
+                return data
+            img.load()
+            img.thumbnail(max_size, Image.Resampling.LANCZOS)
+
+            out = io.BytesIO()
+            if fmt == "JPEG":
+                img = img.convert("L" if grayscale else "RGB")
+                img.save(out, "JPEG", quality=jpeg_quality, optimize=True)
+            else:
+                has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+                if grayscale and not has_alpha:
+                    img = img.convert("L")
+                if png_colors and not has_alpha:
+                    img = img.quantize(colors=png_colors)
+                img.save(out, "PNG", optimize=True)
+    except Exception:
+        logger.warning("images: could not process an image, keeping original", exc_info=True)
+        return data
+
+    result = out.getvalue()
+    return result if len(result) < len(data) else data
+
+
+@STAGE_SECONDS.labels("image_optimize").time()
+def optimize_epub_images(
+    epub_path: Path,
+    max_size: tuple[int, int],
+    grayscale: bool = IMAGE_GRAYSCALE,
+    jpeg_quality: int = IMAGE_JPEG_QUALITY,
+    png_colors: int = IMAGE_PNG_COLORS,
+) -> dict:
+    """Rewrite epub_path in place with its JPEG/PNG images downsampled and recompressed
+    in parallel. Returns before/after sizes for the images and the whole file.
+
+    Images stream through: each is read, optimised on IMAGE_EXECUTOR and written to
+    the new zip with at most two per image worker in flight, so memory stays bounded
+    however many images a scanned book has. The original file is kept if the images
+    didn't shrink overall.
+    """
+    size_before = epub_path.stat().st_size
+    image_suffixes = (".jpg", ".jpeg", ".png")
+    if not zipfile.is_zipfile(epub_path):
+        has_images = False
+    else:
+        with zipfile.ZipFile(epub_path) as zf:
+            has_images = any(name.lower().endswith(image_suffixes) for name in zf.namelist())
+    if not has_images:
+        return {"images": 0, "image_bytes_before": 0, "image_bytes_after": 0,
+                "bytes_before": size_before, "bytes_after": size_before}
+
+    images = images_before = images_after = 0
+    max_in_flight = 2 * max(1, IMAGE_WORKERS)
+    pending: collections.deque = collections.deque()  # (name, future), in zip order
+
+    tmp_path = epub_path.with_name(epub_path.name + ".tmp")
+    try:
+        with zipfile.ZipFile(epub_path) as src, zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_DEFLATED) as dst:
+            def write_oldest() -> None:
+                nonlocal images_after
+                name, future = pending.popleft()
+                data = future.result()
+                images_after += len(data)
+                # already compressed image data gains nothing from deflate
+                dst.writestr(name, data, compress_type=zipfile.ZIP_STORED)
+
+            for info in src.infolist():
+                if info.filename == "mimetype":
+                    dst.writestr(info, src.read(info), compress_type=zipfile.ZIP_STORED)
+                elif info.filename.lower().endswith(image_suffixes):
+                    data = src.read(info)
+                    images += 1
+                    images_before += len(data)
+                    pending.append((info.filename, IMAGE_EXECUTOR.submit(
+                        _optimize_image, data, max_size, grayscale, jpeg_quality, png_colors)))
+                    while len(pending) >= max_in_flight:
+                        write_oldest()
+                else:
+                    with src.open(info) as fin, dst.open(info, "w") as fout:
+                        shutil.copyfileobj(fin, fout)
+            while pending:
+                write_oldest()
+
+        if images_after < images_before:
+            os.replace(tmp_path, epub_path)
+    finally:
+        for _, future in pending:
+            future.cancel()
+        tmp_path.unlink(missing_ok=True)
+
+    stats = {
+        "images": images,
+        "image_bytes_before": images_before,
+        "image_bytes_after": min(images_after, images_before),
+        "bytes_before": size_before,
+        "bytes_after": epub_path.stat().st_size,
+    }
+    logger.info("images: %d images %d -> %d bytes, epub %d -> %d bytes", stats["images"],
+                stats["image_bytes_before"], stats["image_bytes_after"], stats["bytes_before"], stats["bytes_after"])
+    return stats
+
+
+def convert_and_optimize(pdf_path: Path, epub_path: Path, profile: OutputProfile) -> Optional[dict]:
+    pdf_to_epub(pdf_path, epub_path, profile)
+    if IMAGE_OPTIMIZE:
+        return optimize_epub_images(epub_path, image_max_size(profile))
+    return None
+
+
+async def _convert_for_flight(
+    cache_key: str, flight: _Flight, pdf_path: Path, pdf_sha256: str, size: int, profile: OutputProfile
+) -> Optional[dict]:
+    try:
+        flight.workdir = await asyncio.to_thread(make_workspace, "pdf2epub-flight-", size)
+        await asyncio.to_thread(_link_or_copy, pdf_path, flight.workdir / "input.pdf")
+    except BaseException:
+        CONVERT_SCHEDULER.cancel(flight.ticket)
+        raise
+
+    epub_path = flight.workdir / "output.epub"
+    try:
+        image_stats = await CONVERT_SCHEDULER.run(flight.ticket, convert_and_optimize, flight.workdir / "input.pdf",
+                                                  epub_path, profile)
+    except ConversionTimeout:
+        await asyncio.to_thread(QUARANTINE.add, pdf_sha256)
+        raise
+    await asyncio.to_thread(CACHE.put, cache_key, epub_path)
+    return image_stats
+
+
+async def convert_single_flight(cache_key: str, job: "Job", pdf_path: Path, epub_path: Path) -> bool:
+    """Convert pdf_path into epub_path, sharing one pdf_to_epub run between
+    concurrent callers with the same cache key.
+
+    The conversion runs in its own task and workspace so a caller going away
+    (or finishing first) never pulls the input out from under the others.
+    The run is queued on CONVERT_SCHEDULER under the first caller's client id,
+    and every caller's job points at that ticket for queue position reporting.
+    Returns True if this caller joined a conversion someone else started.
+    """
+    flight = INFLIGHT.get(cache_key)
+    joined = flight is not None
+
+    if flight is None:
+        # registered before the first await, so a concurrent identical upload always
+        # finds it; the task sets up its own workspace
+        flight = _Flight(ticket=CONVERT_SCHEDULER.submit(job.client_id, job.size))
+        INFLIGHT[cache_key] = flight
+        flight.task = asyncio.create_task(_convert_for_flight(
+            cache_key, flight, pdf_path, job.sha256, job.size, OUTPUT_PROFILES[job.profile]))
+
+        def _finished(task: asyncio.Task, flight: _Flight = flight) -> None:
+            if INFLIGHT.get(cache_key) is flight:
+                del INFLIGHT[cache_key]
+            if not task.cancelled():
+                task.exception()
+            if flight.waiters == 0 and flight.workdir is not None:
+                shutil.rmtree(flight.workdir, ignore_errors=True)
+
+        flight.task.add_done_callback(_finished)
+    else:
+        logger.info("convert: joining in-flight conversion key=%s waiters=%d", cache_key[:12], flight.waiters)
+
+    job.ticket = flight.ticket
+    flight.waiters += 1
+    try:
+        job.image_stats = await asyncio.shield(flight.task)
+        await asyncio.to_thread(shutil.copyfile, flight.workdir / "output.epub", epub_path)
+    finally:
+        flight.waiters -= 1
+        if flight.waiters == 0 and flight.task.done() and flight.workdir is not None:
+            await asyncio.to_thread(shutil.rmtree, flight.workdir, True)
+
+    return joined
+
+
+class Outbox:
+    """Durable queue of outgoing deliveries: a SQLite table plus a spool directory
+    holding the converted files, so a failed send never costs another conversion.
+
+    A row's spooled files are deleted once it is sent or given up on ("dead"),
+    and prune() deletes such rows OUTBOX_RETENTION_SECONDS after they finished;
+    for finished rows next_attempt_at records when that was.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.spool = root / "spool"
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self.wakeup: Optional[asyncio.Event] = None
+
+    def open(self) -> None:
+        self.spool.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(self.root / "outbox.sqlite3", check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_id TEXT,
+                to_addr TEXT NOT NULL,
+                subject TEXT NOT NULL,
+                body TEXT NOT NULL,
+                attachments TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                last_error TEXT,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        pending = self.depth()
+        logger.info("outbox: opened %s pending=%d", self.root, pending)
+        self.prune()
+
+    def enqueue(self, job_ids: list[str], to_addr: str, subject: str, body: str, attachments: list[Path]) -> int:
+        """Spool attachments and queue them as one message; job_ids are the jobs it completes."""
+        spool_dir = self.spool / uuid.uuid4().hex
+        spool_dir.mkdir()
+        spooled = []
+        for path in attachments:
+            _link_or_copy(path, spool_dir / path.name)
+            spooled.append(str(spool_dir / path.name))
+
+        now = time.time()
+        with self._lock:
+            cur = self._db.execute(
+                "INSERT INTO outbox (job_id, to_addr, subject, body, attachments, next_attempt_at, created_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (",".join(job_ids), to_addr, subject, body, json.dumps(spooled), now, now),
+            )
+        logger.info("outbox: queued id=%d jobs=%s to=%s", cur.lastrowid, ",".join(job_ids), to_addr)
+        return cur.lastrowid
+
+    def due(self, limit: int = 10, exclude: tuple[int, ...] = ()) -> list[sqlite3.Row]:
+        """Pending rows whose next attempt is due, skipping the ids in exclude (already being sent)."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT * FROM outbox WHERE status = 'pending' AND next_attempt_at <= ?"
+                f" AND id NOT IN ({','.join('?' * len(exclude))}) ORDER BY next_attempt_at LIMIT ?",
+                (time.time(), *exclude, limit),
+            ).fetchall()
+
+    def next_due_in(self, exclude: tuple[int, ...] = ()) -> Optional[float]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT MIN(next_attempt_at) FROM outbox WHERE status = 'pending'"
+                f" AND id NOT IN ({','.join('?' * len(exclude))})",
+                exclude,
+            ).fetchone()
+        return None if row[0] is None else max(0.0, row[0] - time.time())
+
+    @staticmethod
+    def _unspool(attachments: str) -> None:
+        for path in json.loads(attachments):
+            shutil.rmtree(Path(path).parent, ignore_errors=True)
+
+    def mark_sent(self, row: sqlite3.Row) -> None:
+        with self._lock:
+            self._db.execute("UPDATE outbox SET status = 'sent', attempts = attempts + 1, next_attempt_at = ?"
+                             " WHERE id = ?", (time.time(), row["id"]))
+        self._unspool(row["attachments"])
+
+    def mark_failed(self, row: sqlite3.Row, error: str) -> Optional[float]:
+        """Record a failed attempt. Returns the retry delay, or None if the delivery was given up on."""
+        attempts = row["attempts"] + 1
+        if attempts >= OUTBOX_MAX_ATTEMPTS:
+            delay = None
+            status, next_attempt_at = "dead", time.time()
+        else:
+            delay = min(OUTBOX_RETRY_MAX_SECONDS, OUTBOX_RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+            delay *= random.uniform(0.8, 1.2)
+            status, next_attempt_at = "pending", time.time() + delay
+
+        with self._lock:
+            self._db.execute(
+                "UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                (status, attempts, next_attempt_at, error, row["id"]),
+            )
+        if delay is None:
+            self._unspool(row["attachments"])
+        return delay
+
+    def prune(self) -> int:
+        """Delete sent and dead rows that finished more than OUTBOX_RETENTION_SECONDS ago."""
+        cutoff = time.time() - OUTBOX_RETENTION_SECONDS
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, attachments FROM outbox WHERE status IN ('sent', 'dead') AND next_attempt_at < ?",
+                (cutoff,),
+            ).fetchall()
+            self._db.executemany("DELETE FROM outbox WHERE id = ?", [(row["id"],) for row in rows])
+        for row in rows:
+            self._unspool(row["attachments"])  # dead rows from before spools were dropped on giving up
+        if rows:
+            logger.info("outbox: pruned %d finished row(s)", len(rows))
+        return len(rows)
+
+    def has_pending(self, job_id: str) -> bool:
+        """Whether any message for job_id (a book split across messages) is still waiting."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT 1 FROM outbox WHERE status = 'pending' AND ',' || job_id || ',' LIKE ? LIMIT 1",
+                (f"%,{job_id},%",),
+            ).fetchone() is not None
+
+    def depth(self) -> int:
+        if self._db is None:
+            return 0
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM outbox WHERE status = 'pending'").fetchone()[0]
+
+    def stats(self) -> dict:
+        if self._db is None:
+            return {"enabled": False}
+        with self._lock:
+            counts = {row[0]: row[1] for row in self._db.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status")}
+        return {"enabled": True, **counts}
+
+
+OUTBOX = Outbox(Path(OUTBOX_DIR))
+
+
+async def _deliver_outbox_row(row: sqlite3.Row) -> None:
+    jobs = [JOBS[job_id] for job_id in (row["job_id"] or "").split(",") if job_id in JOBS]
+    t0 = time.monotonic()
+    try:
+        logger.info("outbox: delivering id=%d attempt=%d to=%s", row["id"], row["attempts"] + 1, row["to_addr"])
+        await deliver_email(
+            subject=row["subject"],
+            body=row["body"],
+            to_addr=row["to_addr"],
+            attachments=[Path(path) for path in json.loads(row["attachments"])],
+        )
+    except Exception as e:
+        delay = await asyncio.to_thread(OUTBOX.mark_failed, row, str(e))
+        if delay is None:
+            logger.error("outbox: giving up on id=%d after %d attempts: %s", row["id"], row["attempts"] + 1, e)
+            JOB_FAILURES.labels("emailing").inc()
+            for job in jobs:
+                job.failed_stage = "emailing"
+                job.error = str(e)
+                job.set_stage("failed")
+        else:
+            logger.warning("outbox: id=%d failed (%s), retrying in %.0fs", row["id"], e, delay)
+            for job in jobs:
+                job.error = str(e)
+        return
+
+    await asyncio.to_thread(OUTBOX.mark_sent, row)
+    logger.info("outbox: delivered id=%d", row["id"])
+    for job in jobs:
+        job.timings["email"] = job.timings.get("email", 0.0) + time.monotonic() - t0
+        if job.stage == "emailing" and not await asyncio.to_thread(OUTBOX.has_pending, job.id):
+            job.error = None
+            job.set_stage("done")
+
+
+async def outbox_sender() -> None:
+    """Drain the outbox, retrying failed deliveries with exponential backoff.
+
+    Up to ASYNC_SMTP_POOL.size deliveries run at once, each as its own task, so a
+    slow or retried send holds up only its own slot.
+    """
+    sending: dict[int, asyncio.Task] = {}
+    pruned_at = time.monotonic()
+
+    def _sent(task: asyncio.Task, row_id: int) -> None:
+        sending.pop(row_id, None)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("outbox: delivery id=%d crashed", row_id, exc_info=task.exception())
+        OUTBOX.wakeup.set()
+
+    try:
+        while True:
+            try:
+                # cleared before looking, so a delivery finishing meanwhile still wakes us
+                OUTBOX.wakeup.clear()
+                if time.monotonic() - pruned_at > 3600:
+                    pruned_at = time.monotonic()
+                    await asyncio.to_thread(OUTBOX.prune)
+                free = ASYNC_SMTP_POOL.size - len(sending)
+                if free > 0:
+                    rows = await asyncio.to_thread(OUTBOX.due, free, tuple(sending))
+                    for row in rows:
+                        task = asyncio.create_task(_deliver_outbox_row(row))
+                        sending[row["id"]] = task
+                        task.add_done_callback(lambda task, row_id=row["id"]: _sent(task, row_id))
+                    if rows:
+                        continue
+                    wait = await asyncio.to_thread(OUTBOX.next_due_in, tuple(sending))
+                else:
+                    wait = None  # woken when a slot frees up
+
+                try:
+                    await asyncio.wait_for(OUTBOX.wakeup.wait(), timeout=60 if wait is None else min(wait, 60))
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("outbox: sender loop error")
+                await asyncio.sleep(5)
+    finally:
+        for task in list(sending.values()):
+            task.cancel()
+
+
+async def convert_for_job(job: Job, pdf_path: Path, epub_path: Path) -> None:
+    """Fill epub_path from the cache or a (possibly shared) conversion, recording which on job."""
+    profile = OUTPUT_PROFILES[job.profile]
+    t0 = time.monotonic()
+    cache_key = CACHE.key(job.sha256, await asyncio.to_thread(conversion_options_key, profile))
+    job.cache_hit = await asyncio.to_thread(CACHE.get, cache_key, epub_path)
+    if not job.cache_hit:
+        job.shared_conversion = await convert_single_flight(cache_key, job, pdf_path, epub_path)
+    job.timings["convert"] = time.monotonic() - t0
+
+
+def fail_job(job: Job, e: BaseException) -> None:
+    logger.error("job %s: failed during %s", job.id, job.stage, exc_info=e)
+    JOB_FAILURES.labels(job.stage).inc()
+    job.failed_stage = job.stage
+    if isinstance(e, asyncio.CancelledError):
+        job.error, job.error_class = "Cancelled before it finished", "cancelled"
+    else:
+        job.error, job.error_class = str(e), getattr(e, "error_class", "error")
+    job.set_stage("failed")
+
+
+def fail_cancelled_jobs(jobs: list[Job], e: asyncio.CancelledError) -> None:
+    """Fail the jobs a cancelled request left unfinished, so none stays in progress
+    (and in JOBS) forever; jobs whose messages are already in the outbox carry on."""
+    for job in jobs:
+        if job.stage in ("done", "failed"):
+            continue
+        if job.stage == "emailing" and OUTBOX_ENABLED and OUTBOX.has_pending(job.id):
+            continue
+        fail_job(job, e)
+
+
+OVERSIZE_RECOMPRESS_LEVELS = (  # (fraction of the profile's image size, JPEG quality, PNG colours), mildest first
+    (0.75, 50, 8),
+    (0.5, 35, 4),
+)
+
+
+def message_size(attachments: list[Path], subject: str = "", body: str = "", to_addr: str = "") -> int:
+    """Wire size of one delivery carrying attachments with this text."""
+    return StreamingMessage(SMTP_FROM, to_addr, subject, body, attachments).wire_size()
+
+
+def plan_messages(paths: list[Path], max_message_bytes: int, text=None) -> list[list[Path]]:
+    """Bin-pack attachments, first-fit decreasing, into messages no larger than
+    max_message_bytes on the wire. Messages and their attachments keep upload order.
+
+    text(group) gives the (subject, body, to_addr) a message carrying group would be
+    sent with, or an upper bound on them, so the packing counts the real text.
+
+    A file too large for a message of its own still gets one; fit_for_delivery is
+    what keeps those out of the plan.
+    """
+    order = {path: i for i, path in enumerate(paths)}
+    groups: list[list[Path]] = []
+    for path in sorted(paths, key=lambda p: p.stat().st_size, reverse=True):
+        for group in groups:
+            if message_size(group + [path], *(text(group + [path]) if text else ())) <= max_message_bytes:
+                group.append(path)
+                break
+        else:
+            groups.append([path])
+    for group in groups:
+        group.sort(key=order.__getitem__)
+    groups.sort(key=lambda group: order[group[0]])
+    return groups
+
+
+def _opf_path(zf: zipfile.ZipFile) -> str:
+    container = ElementTree.fromstring(zf.read("META-INF/container.xml"))
+    return container.find(".//container:rootfile", EPUB_NS).get("full-path")
+
+
+def epub_title(epub_path: Path) -> str:
+    with zipfile.ZipFile(epub_path) as zf:
+        opf = ElementTree.fromstring(zf.read(_opf_path(zf)))
+    return (opf.findtext("opf:metadata/dc:title", default="", namespaces=EPUB_NS) or "").strip()
+
+
+def retitle_epub(epub_path: Path, title: str) -> None:
+    """Replace the book's dc:title, so volumes show up as separate books."""
+    tmp_path = epub_path.with_name(epub_path.name + ".tmp")
+    with zipfile.ZipFile(epub_path) as src:
+        opf_path = _opf_path(src)
+        opf = re.sub(r"(<dc:title\b[^>]*>)(.*?)(</dc:title>)", lambda m: m[1] + escape(title) + m[3],
+                     src.read(opf_path).decode("utf-8"), count=1, flags=re.S)
+        with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_DEFLATED) as dst:
+            for info in src.infolist():
+                if info.filename == "mimetype":
+                    dst.writestr(info, src.read(info), compress_type=zipfile.ZIP_STORED)
+                elif info.filename == opf_path:
+                    dst.writestr(info, opf)
+                else:
+                    dst.writestr(info, src.read(info))
+    os.replace(tmp_path, epub_path)
+
+
+async def convert_volumes(job: Job, pdf_path: Path, epub_path: Path, volumes: int) -> list[Path]:
+    """Convert pdf_path as up to `volumes` page-range books next to epub_path, each
+    titled after the whole book (epub_path) plus "(i/n)".
+
+    Volumes go through CACHE under the PDF's hash plus their place in the split, so
+    a retry doesn't convert them again, and are queued on CONVERT_SCHEDULER like any
+    other conversion. A volume that times out quarantines the PDF.
+    """
+    profile = OUTPUT_PROFILES[job.profile]
+    out_dir = epub_path.parent / f"volumes-{volumes}"
+    out_dir.mkdir(exist_ok=True)
+    pages = await asyncio.to_thread(_page_count, pdf_path)
+    pages_per_volume = -(-pages // volumes)
+    count = -(-pages // pages_per_volume)
+    title = await asyncio.to_thread(epub_title, epub_path) or Path(job.filename or "").stem or "Document"
+    options = await asyncio.to_thread(conversion_options_key, profile)
+    keys = [CACHE.key(job.sha256, f"{options};volume={i}/{count}") for i in range(1, count + 1)]
+    outputs = [out_dir / f"{epub_path.stem} (part {i} of {count}){epub_path.suffix}" for i in range(1, count + 1)]
+
+    missing = [i for i, (key, out) in enumerate(zip(keys, outputs)) if not await asyncio.to_thread(CACHE.get, key, out)]
+    if not missing:
+        return outputs
+    parts = await asyncio.to_thread(split_pdf, pdf_path, out_dir, pages_per_volume)
+
+    async def convert(i: int) -> None:
+        ticket = CONVERT_SCHEDULER.submit(job.client_id, parts[i].stat().st_size)
+        try:
+            await CONVERT_SCHEDULER.run(ticket, convert_and_optimize, parts[i], outputs[i], profile)
+        except ConversionTimeout:
+            await asyncio.to_thread(QUARANTINE.add, job.sha256)
+            raise
+        await asyncio.to_thread(retitle_epub, outputs[i], f"{title} ({i + 1}/{count})")
+        await asyncio.to_thread(CACHE.put, keys[i], outputs[i])
+
+    await asyncio.gather(*(convert(i) for i in missing))
+    return outputs
+
+
+async def fit_for_delivery(job: Job, pdf_path: Path, epub_path: Path) -> list[Path]:
+    """The files to mail for job's book, each small enough for a message of its own.
+
+    A book over SMTP_MAX_MESSAGE_BYTES once base64-encoded first has its images
+    recompressed harder (OVERSIZE_RECOMPRESS_LEVELS); if that isn't enough, the PDF
+    is split into page-range volumes (at most OVERSIZE_MAX_VOLUMES) converted
+    separately. Raises DeliveryTooLarge if nothing fits. Records the outcome on job.
+    """
+    # one file's address, subject and body stay within MESSAGE_TEXT_ALLOWANCE_BYTES
+    limit = SMTP_MAX_MESSAGE_BYTES - MESSAGE_TEXT_ALLOWANCE_BYTES
+    size = await asyncio.to_thread(message_size, [epub_path])
+    if size <= limit:
+        job.delivery = "as_is"
+        return [epub_path]
+
+    profile = OUTPUT_PROFILES[job.profile]
+    width, height = image_max_size(profile)
+    for scale, jpeg_quality, png_colors in OVERSIZE_RECOMPRESS_LEVELS:
+        logger.info("job %s: %d bytes as email (max=%d), recompressing images at %.0f%% q=%d",
+                    job.id, size, limit, scale * 100, jpeg_quality)
+        await asyncio.to_thread(optimize_epub_images, epub_path, (int(width * scale), int(height * scale)),
+                                IMAGE_GRAYSCALE, jpeg_quality, png_colors)
+        size = await asyncio.to_thread(message_size, [epub_path])
+        if size <= limit:
+            job.delivery = "recompressed"
+            return [epub_path]
+
+    cap = min(OVERSIZE_MAX_VOLUMES, await asyncio.to_thread(_page_count, pdf_path))
+    volumes = min(cap, max(2, -(-size * 5 // (limit * 4))))  # 25% headroom: volumes are rarely even
+    while volumes >= 2:
+        logger.info("job %s: %d bytes as email (max=%d), splitting into %d volumes", job.id, size, limit, volumes)
+        parts = await convert_volumes(job, pdf_path, epub_path, volumes)
+        largest = max([await asyncio.to_thread(message_size, [part]) for part in parts])
+        if largest <= limit:
+            job.delivery = f"volumes:{len(parts)}"
+            return parts
+        if volumes == cap:
+            break
+        volumes = min(cap, volumes * 2)
+
+    raise DeliveryTooLarge(f"Converted book is {size} bytes as email, over the {limit}-byte limit, "
+                           f"and could not be split into {OVERSIZE_MAX_VOLUMES} or fewer volumes that fit")
+
+
+async def send_or_queue(jobs: list[Job], subject: str, body: str, attachments: list[Path]) -> None:
+    """Send one planned message to each of the jobs' recipients: through the outbox,
+    or right away when the outbox is off. All jobs in a message share recipients.
+
+    Every recipient gets a message of their own so Kindle addresses aren't shown
+    to each other; the converted files are shared, never converted again.
+    """
+    recipients = jobs[0].recipients
+    if OUTBOX_ENABLED:
+        for to_addr in recipients:
+            await asyncio.to_thread(OUTBOX.enqueue, [job.id for job in jobs], to_addr, subject, body, attachments)
+        OUTBOX.wakeup.set()
+        return
+
+    t0 = time.monotonic()
+    for to_addr in recipients:
+        logger.info("email: sending %d attachment(s) to %s", len(attachments), to_addr)
+        await deliver_email(subject=subject, body=body, to_addr=to_addr, attachments=attachments)
+    for job in jobs:
+        job.timings["email"] = job.timings.get("email", 0.0) + time.monotonic() - t0
+
+
+async def run_conversion_job(job: Job, workdir: Path) -> None:
+    """Convert workdir/input.pdf and email the result, recording progress on job.
+
+    A book too large to mail is recompressed or split into volumes first (see
+    fit_for_delivery). With the outbox enabled, the messages are handed to the outbox
+    and the job stays in "emailing" until the background sender delivers them.
+
+    Owns workdir and removes it when finished. Re-raises the failure after recording it.
+    """
+    pdf_path = workdir / "input.pdf"
+    epub_path = workdir / "output.epub"
+    started = time.monotonic()
+
+    try:
+        job.set_stage("converting")
+        await convert_for_job(job, pdf_path, epub_path)
+
+        job.set_stage("planning")
+        files = await fit_for_delivery(job, pdf_path, epub_path)
+
+        def text(n: int, total: int) -> tuple[str, str]:
+            part = f" ({n}/{total})" if total > 1 else ""
+            return f"Your converted EPUB{part}", f"Attached is the EPUB converted from your PDF{part}."
+
+        # planned with the widest "(n/N)" and longest address, so no message outgrows its plan
+        longest_to = max(job.recipients, key=len)
+        groups = await asyncio.to_thread(plan_messages, files, SMTP_MAX_MESSAGE_BYTES,
+                                         lambda group: (*text(len(files), len(files)), longest_to))
+
+        job.set_stage("emailing")
+        for n, group in enumerate(groups, 1):
+            await send_or_queue([job], *text(n, len(groups)), group)
+
+        if not OUTBOX_ENABLED:
+            job.set_stage("done")
+    except Exception as e:
+        fail_job(job, e)
+        raise
+    except asyncio.CancelledError as e:
+        fail_cancelled_jobs([job], e)
+        raise
+    finally:
+        job.timings["total"] = time.monotonic() - started
+        await asyncio.to_thread(shutil.rmtree, workdir, True)
+
+
+def attachment_name(filename: Optional[str], taken: set[str]) -> str:
+    """A mail-safe, unique-within-taken EPUB file name for an uploaded PDF."""
+    stem = re.sub(r"[^\w.\- ]+", "_", Path(filename or "").stem).strip(" .") or "document"
+    name, n = f"{stem}.epub", 1
+    while name.lower() in taken:
+        n += 1
+        name = f"{stem} ({n}).epub"
+    taken.add(name.lower())
+    return name
+
+
+async def run_batch_job(jobs: list[Job], workdir: Path) -> int:
+    """Convert workdir/<job id>/input.pdf for every job in parallel, then email the
+    results packed into as few messages as SMTP_MAX_MESSAGE_BYTES allows.
+
+    Conversions go through the same scheduler, cache and single-flight path as
+    /convert, so a batch shares workers fairly with everyone else, and books too
+    large to mail are recompressed or split by fit_for_delivery. Failures are
+    recorded per job and never fail the rest of the batch. Owns workdir and
+    removes it when finished. Returns the number of messages sent or queued.
+    """
+    started = time.monotonic()
+    taken: set[str] = set()
+    epub_paths = {job.id: workdir / job.id / attachment_name(job.filename, taken) for job in jobs}
+
+    async def convert(job: Job) -> list[Path]:
+        pdf_path = workdir / job.id / "input.pdf"
+        try:
+            job.set_stage("converting")
+            await convert_for_job(job, pdf_path, epub_paths[job.id])
+            job.set_stage("planning")
+            files = await fit_for_delivery(job, pdf_path, epub_paths[job.id])
+            job.set_stage("emailing")
+            return files
+        except Exception as e:
+            fail_job(job, e)
+            return []
+
+    try:
+        results = await asyncio.gather(*(convert(job) for job in jobs))
+        by_path = {path: job for job, files in zip(jobs, results) for path in files}
+
+        def text(group: list[Path], n: int, total: int) -> tuple[str, str]:
+            subject = "Your converted EPUBs" + (f" ({n}/{total})" if total > 1 else "")
+            body = "Attached are the EPUBs converted from:\n" + "\n".join(
+                f"  {path.name if path.parent.name.startswith('volumes-') else by_path[path].filename or path.name}"
+                for path in group)
+            return subject, body
+
+        # planned with the widest "(n/N)" and longest address, so no message outgrows its plan
+        longest_to = max(jobs[0].recipients, key=len)
+        groups = await asyncio.to_thread(plan_messages, list(by_path), SMTP_MAX_MESSAGE_BYTES,
+                                         lambda group: (*text(group, len(by_path), len(by_path)), longest_to))
+        logger.info("batch: %d of %d converted, sending in %d message(s)",
+                    sum(1 for files in results if files), len(jobs), len(groups))
+
+        for n, group in enumerate(groups, 1):
+            group_jobs = list(dict.fromkeys(by_path[path] for path in group))
+            subject, body = text(group, n, len(groups))
+            try:
+                await send_or_queue(group_jobs, subject, body, group)
+            except Exception as e:
+                for job in group_jobs:
+                    if job.stage != "failed":
+                        fail_job(job, e)
+
+        if not OUTBOX_ENABLED:
+            for job in jobs:
+                if job.stage == "emailing":
+                    job.set_stage("done")
+        return len(groups)
+    except asyncio.CancelledError as e:
+        fail_cancelled_jobs(jobs, e)
+        raise
+    finally:
+        for job in jobs:
+            job.timings["total"] = time.monotonic() - started
+        await asyncio.to_thread(shutil.rmtree, workdir, True)
+
+
+def _run_in_background(coro) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    BACKGROUND_TASKS.add(task)
+    task.add_done_callback(BACKGROUND_TASKS.discard)
+    # failures are recorded on the job; retrieve them so asyncio doesn't log "never retrieved"
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    return task
+
+
+PDF_CONTENT_TYPES = ("application/pdf", "application/octet-stream")
+MAX_FORM_FIELD_BYTES = 64 * 1024
+MAX_FORM_FIELDS = 16
+# allowance for multipart boundaries, part headers and small form fields on top of the file itself
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+
+@dataclass
+class UploadedFile:
+    field_name: str
+    filename: Optional[str]
+    content_type: Optional[str]
+    path: Path
+    size: int = 0
+    sha256: str = ""
+    _fh: Optional[object] = field(default=None, repr=False)
+    _hash: Optional[object] = field(default=None, repr=False)
+
+
+class StreamingUploadParser:
+    """Streams multipart/form-data file parts straight into a workspace directory.
+
+    Only one network chunk is held in memory at a time; each file is hashed as it
+    is written, and the upload is aborted with 413 as soon as a file part grows
+    past max_bytes (or its content type's entry in type_max_bytes), or as soon
+    as the part after max_files begins. With file_fields set, a file part under
+    any other field name is rejected before any of it touches the disk.
+    """
+
+    def __init__(self, workdir: Path, max_bytes: int, allowed_types: tuple = PDF_CONTENT_TYPES,
+                 max_total_bytes: Optional[int] = None, file_fields: Optional[tuple[str, ...]] = None,
+                 type_max_bytes: Optional[dict[str, int]] = None, max_files: Optional[int] = None):
+        self.workdir = workdir
+        self.max_bytes = max_bytes
+        self.type_max_bytes = type_max_bytes or {}
+        self.max_files = max_files
+        self.max_total_bytes = max_total_bytes
+        self.file_fields = file_fields
+        self.total_bytes = 0
+        self.allowed_types = allowed_types
+        self.files: list[UploadedFile] = []
+        self.fields: dict[str, str] = {}
+
+        self._header_name = b""
+        self._header_value = b""
+        self._headers: dict[bytes, bytes] = {}
+        self.read_seconds = 0.0
+        self.write_seconds = 0.0
+        self._current: Optional[UploadedFile] = None
+        self._current_max = max_bytes
+        self._field_name: Optional[str] = None
+        self._field_data = b""
+        self._field_count = 0
+        # (file, chunk) writes queued by the parser callbacks; chunk None closes the file
+        self._pending: list[tuple[UploadedFile, Optional[bytes]]] = []
+
+    def on_part_begin(self) -> None:
+        self._headers = {}
+        self._current = None
+        self._field_name = None
+        self._field_data = b""
+
+    def on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def on_header_end(self) -> None:
+        self._headers[self._header_name.lower()] = self._header_value
+        self._header_name = b""
+        self._header_value = b""
+
+    def on_headers_finished(self) -> None:
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        name = options.get(b"name", b"").decode(errors="replace")
+
+        if b"filename" not in options:
+            self._field_count += 1
+            if self._field_count > MAX_FORM_FIELDS:
+                raise HTTPException(status_code=413, detail="Too many form fields")
+            self._field_name = name
+            return
+
+        if self.file_fields is not None and name not in self.file_fields:
+            logger.warning("upload: unexpected file field=%s", name)
+            raise HTTPException(status_code=400, detail=f"Unexpected file field {name!r}")
+
+        content_type = self._headers.get(b"content-type", b"").decode(errors="replace").split(";")[0].strip() or None
+        if content_type not in self.allowed_types:
+            logger.warning("upload: invalid content_type=%s", content_type)
+            raise HTTPException(status_code=400, detail=f"Expected PDF, got {content_type}")
+
+        if self.max_files is not None and len(self.files) >= self.max_files:
+            logger.warning("upload: more than %d file parts, aborting", self.max_files)
+            raise HTTPException(status_code=413, detail=f"Too many files in upload (max {self.max_files})")
+
+        self._current_max = self.type_max_bytes.get(content_type, self.max_bytes)
+        declared = self._headers.get(b"content-length", b"").strip()
+        if declared.isdigit() and int(declared) > self._current_max:
+            logger.warning("upload: part declares bytes=%s (max=%d)", declared.decode(), self._current_max)
+            raise HTTPException(status_code=413, detail=self._too_large(content_type))
+
+        self._current = UploadedFile(
+            field_name=name,
+            filename=options[b"filename"].decode(errors="replace"),
+            content_type=content_type,
+            path=self.workdir / f"upload-{len(self.files)}",
+        )
+        self.files.append(self._current)
+
+    def on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._current is None:
+            self._field_data += data[start:end]
+            if len(self._field_data) > MAX_FORM_FIELD_BYTES:
+                raise HTTPException(status_code=413, detail="Form field too large")
+            return
+
+        self._current.size += end - start
+        self.total_bytes += end - start
+        if self._current.size > self._current_max:
+            logger.warning("upload: too large, aborting after bytes=%d (max=%d)", self._current.size, self._current_max)
+            raise HTTPException(status_code=413, detail=self._too_large(self._current.content_type))
+        if self.max_total_bytes is not None and self.total_bytes > self.max_total_bytes:
+            logger.warning("upload: files total bytes=%d (max=%d), aborting", self.total_bytes, self.max_total_bytes)
+            raise HTTPException(status_code=413, detail="Upload too large")
+        self._pending.append((self._current, bytes(data[start:end])))
+
+    @staticmethod
+    def _too_large(content_type: Optional[str]) -> str:
+        return "PDF too large" if content_type in PDF_CONTENT_TYPES else "File too large"
+
+    def on_part_end(self) -> None:
+        if self._current is not None:
+            self._pending.append((self._current, None))
+        elif self._field_name is not None:
+            self.fields[self._field_name] = self._field_data.decode(errors="replace")
+
+    def _flush(self) -> None:
+        """Apply queued writes (runs in a worker thread)."""
+        pending, self._pending = self._pending, []
+        for f, chunk in pending:
+            if f._fh is None:
+                f._fh = open(f.path, "wb")
+                f._hash = hashlib.sha256()
+            if chunk is None:
+                f._fh.close()
+                f._fh = None
+                f.sha256 = f._hash.hexdigest()
+            else:
+                f._hash.update(chunk)
+                f._fh.write(chunk)
+
+    async def parse(self, request: Request) -> "StreamingUploadParser":
+        content_type, params = parse_options_header(request.headers.get("content-type", ""))
+        if content_type != b"multipart/form-data" or b"boundary" not in params:
+            raise HTTPException(status_code=400, detail="Expected multipart/form-data upload")
+
+        callbacks = {
+            "on_part_begin": self.on_part_begin,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+        }
+        parser = MultipartParser(params[b"boundary"], callbacks)
+
+        try:
+            t0 = time.monotonic()
+            async for chunk in request.stream():
+                BYTES_IN.inc(len(chunk))
+                parser.write(chunk)
+                t1 = time.monotonic()
+                self.read_seconds += t1 - t0
+                if self._pending:
+                    await asyncio.to_thread(self._flush)
+                t0 = time.monotonic()
+                self.write_seconds += t0 - t1
+            parser.finalize()
+        except MultipartParseError as e:
+            logger.warning("upload: malformed multipart body: %s", e)
+            raise HTTPException(status_code=400, detail="Malformed multipart upload")
+        finally:
+            for f in self.files:
+                if f._fh is not None:
+                    f._fh.close()
+                    f._fh = None
+
+        if any(not f.sha256 for f in self.files):
+            raise HTTPException(status_code=400, detail="Incomplete multipart upload")
+
+        return self
+
+
+def reject_oversize_request(request: Request, max_body_bytes: int) -> None:
+    """413 based on the declared Content-Length, before any of the body is read."""
+    declared = request.headers.get("content-length", "").strip()
+    if declared.isdigit() and int(declared) > max_body_bytes:
+        logger.warning("request: Content-Length=%s exceeds max=%d, rejecting before upload", declared, max_body_bytes)
+        raise HTTPException(status_code=413, detail="PDF too large")
+
+
+@app.post("/convert")
+async def convert_pdf_to_epub_endpoint(
+    request: Request,
+    authorization: Optional[str] = Header(default=None),
+    async_: bool = Query(default=False, alias="async"),
+):
+    logger.info("request: /convert received async=%s", async_)
+
+    caller = require_bearer(authorization)
+    reject_oversize_request(request, MAX_PDF_BYTES + MULTIPART_OVERHEAD_BYTES)
+    lease = QUOTAS.admit(caller)
+
+    t0 = time.monotonic()
+    logger.info("request: starting temp workspace")
+    declared = request.headers.get("content-length", "").strip()
+    size_hint = int(declared) if declared.isdigit() else MAX_PDF_BYTES
+    try:
+        workdir = await asyncio.to_thread(make_workspace, "pdf2epub-", size_hint)
+    except BaseException:
+        lease.release()
+        raise
+    pdf_path = workdir / "input.pdf"
+
+    logger.info("request: streaming upload to %s", workdir)
+    try:
+        upload = await StreamingUploadParser(workdir, MAX_PDF_BYTES, max_total_bytes=MAX_PDF_BYTES,
+                                             file_fields=("file",)).parse(request)
+        STAGE_SECONDS.labels("upload_read").observe(upload.read_seconds)
+        STAGE_SECONDS.labels("temp_write").observe(upload.write_seconds)
+        file = next((f for f in upload.files if f.field_name == "file"), None)
+        if file is None:
+            raise HTTPException(status_code=422, detail="Missing file upload")
+        os.replace(file.path, pdf_path)
+        profile = upload.fields.get("profile") or OUTPUT_PROFILE
+        if profile not in OUTPUT_PROFILES:
+            raise HTTPException(status_code=422, detail=f"Unknown profile; choose one of {', '.join(OUTPUT_PROFILES)}")
+        recipients = choose_recipients(caller, upload.fields.get("to"))
+    except BaseException:
+        lease.release()
+        shutil.rmtree(workdir, ignore_errors=True)
+        raise
+
+    logger.info("request: received filename=%s content_type=%s bytes=%d (max=%d) profile=%s",
+                file.filename, file.content_type, file.size, MAX_PDF_BYTES, profile)
+
+    if file.sha256 in QUARANTINE:
+        lease.release()
+        shutil.rmtree(workdir, ignore_errors=True)
+        logger.warning("request: refusing quarantined pdf sha256=%s", file.sha256)
+        raise HTTPException(status_code=422, detail="This PDF previously timed out during conversion and is quarantined")
+
+    job = new_job(caller.client_id, file.filename, recipients, file.sha256, file.size, profile)
+    job.timings["upload"] = time.monotonic() - t0
+
+    if async_:
+        _run_in_background(run_conversion_job(job, workdir)).add_done_callback(lambda _: lease.release())
+        logger.info("request: /convert accepted job=%s", job.id)
+        return JSONResponse(
+            {"ok": True, "job_id": job.id, "stage": job.stage, "status_url": f"/jobs/{job.id}"},
+            status_code=202,
+            headers={"Location": f"/jobs/{job.id}"},
+        )
+
+    try:
+        await run_conversion_job(job, workdir)
+    except Exception as e:
+        if job.failed_stage == "emailing":
+            status_code = 502
+        elif job.error_class == "timeout":
+            status_code = 504
+        elif job.error_class in ("resource_exceeded", "too_large"):
+            status_code = 422
+        else:
+            status_code = 500
+        raise HTTPException(status_code=status_code, detail=str(e))
+    finally:
+        lease.release()
+
+    logger.info("request: /convert done ok stage=%s", job.stage)
+    return JSONResponse({"ok": True, "sent_to": ", ".join(job.recipients), "recipients": list(job.recipients),
+                         "job_id": job.id, "delivered": job.stage == "done"})
+
+
+BATCH_ARCHIVE_TYPES = ("application/zip", "application/x-zip-compressed")
+
+
+def _is_archive(f: UploadedFile) -> bool:
+    return f.content_type in BATCH_ARCHIVE_TYPES or (f.filename or "").lower().endswith(".zip")
+
+
+def expand_batch_uploads(files: list[UploadedFile], workdir: Path) -> tuple[list[UploadedFile], list[dict]]:
+    """Flatten uploaded PDFs and zips of PDFs into one list of PDF files on disk.
+
+    Zip members are extracted with a hard cap at MAX_PDF_BYTES whatever size they
+    declare, and hashed as they are written. Returns the PDFs plus rejection
+    entries for anything that can't be converted.
+    """
+    pdfs: list[UploadedFile] = []
+    rejected: list[dict] = []
+    for f in files:
+        if not _is_archive(f):
+            pdfs.append(f)
+            continue
+
+        try:
+            zf = zipfile.ZipFile(f.path)
+        except zipfile.BadZipFile:
+            rejected.append({"filename": f.filename, "ok": False, "stage": "rejected", "error": "Not a valid zip file"})
+            continue
+        with zf:
+            for info in zf.infolist():
+                name = info.filename
+                if info.is_dir() or name.startswith("__MACOSX/") or posixpath.basename(name).startswith("."):
+                    continue
+                if not name.lower().endswith(".pdf"):
+                    rejected.append({"filename": name, "ok": False, "stage": "rejected", "error": "Not a PDF"})
+                    continue
+                if len(pdfs) >= MAX_BATCH_FILES:
+                    raise HTTPException(status_code=413, detail=f"Too many files in batch (max {MAX_BATCH_FILES})")
+
+                member = UploadedFile(field_name=f.field_name, filename=posixpath.basename(name),
+                                      content_type="application/pdf", path=workdir / f"member-{len(pdfs)}")
+                digest = hashlib.sha256()
+                with zf.open(info) as src, open(member.path, "wb") as dst:
+                    while chunk := src.read(1024 * 1024):
+                        member.size += len(chunk)
+                        if member.size > MAX_PDF_BYTES:
+                            break
+                        digest.update(chunk)
+                        dst.write(chunk)
+                member.sha256 = digest.hexdigest()
+                pdfs.append(member)
+        f.path.unlink(missing_ok=True)
+
+    if len(pdfs) > MAX_BATCH_FILES:
+        raise HTTPException(status_code=413, detail=f"Too many files in batch (max {MAX_BATCH_FILES})")
+    return pdfs, rejected
+
+
+@app.post("/convert/batch")
+async def convert_batch_endpoint(
+    request: Request,
+    authorization: Optional[str] = Header(default=None),
+    async_: bool = Query(default=False, alias="async"),
+):
+    """Convert several PDFs (as repeated file fields and/or zip archives of PDFs)
+    and deliver them together, as few emails as the SMTP size cap allows.
+    """
+    logger.info("request: /convert/batch received async=%s", async_)
+
+    caller = require_bearer(authorization)
+    reject_oversize_request(request, MAX_BATCH_BYTES + MULTIPART_OVERHEAD_BYTES)
+    lease = QUOTAS.admit(caller)
+
+    t0 = time.monotonic()
+    declared = request.headers.get("content-length", "").strip()
+    size_hint = int(declared) if declared.isdigit() else MAX_BATCH_BYTES
+    try:
+        workdir = await asyncio.to_thread(make_workspace, "pdf2epub-batch-", size_hint)
+    except BaseException:
+        lease.release()
+        raise
+
+    logger.info("request: streaming batch upload to %s", workdir)
+    try:
+        # a PDF part can't be bigger than a single /convert upload; only archives get the batch's budget
+        parser = StreamingUploadParser(workdir, MAX_PDF_BYTES, PDF_CONTENT_TYPES + BATCH_ARCHIVE_TYPES,
+                                       max_total_bytes=MAX_BATCH_BYTES, max_files=MAX_BATCH_FILES,
+                                       type_max_bytes=dict.fromkeys(BATCH_ARCHIVE_TYPES, MAX_BATCH_BYTES))
+        upload = await parser.parse(request)
+        STAGE_SECONDS.labels("upload_read").observe(upload.read_seconds)
+        STAGE_SECONDS.labels("temp_write").observe(upload.write_seconds)
+        if not upload.files:
+            raise HTTPException(status_code=422, detail="Missing file upload")
+        profile = upload.fields.get("profile") or OUTPUT_PROFILE
+        if profile not in OUTPUT_PROFILES:
+            raise HTTPException(status_code=422, detail=f"Unknown profile; choose one of {', '.join(OUTPUT_PROFILES)}")
+        recipients = choose_recipients(caller, upload.fields.get("to"))
+        pdfs, rejected = await asyncio.to_thread(expand_batch_uploads, upload.files, workdir)
+
+        accepted = []
+        for pdf in pdfs:
+            if pdf.size > MAX_PDF_BYTES:
+                rejected.append({"filename": pdf.filename, "ok": False, "stage": "rejected", "error": "PDF too large"})
+            elif pdf.sha256 in QUARANTINE:
+                logger.warning("request: refusing quarantined pdf sha256=%s", pdf.sha256)
+                rejected.append({"filename": pdf.filename, "ok": False, "stage": "rejected",
+                                 "error": "This PDF previously timed out during conversion and is quarantined"})
+            else:
+                accepted.append(pdf)
+        QUOTAS.take(caller, lease, len(accepted) - 1)  # admit() took the first PDF's slot
+
+        jobs = []
+        for pdf in accepted:
+            job = new_job(caller.client_id, pdf.filename, recipients, pdf.sha256, pdf.size, profile)
+            job.timings["upload"] = time.monotonic() - t0
+            (workdir / job.id).mkdir()
+            os.replace(pdf.path, workdir / job.id / "input.pdf")
+            jobs.append(job)
+    except BaseException:
+        lease.release()
+        shutil.rmtree(workdir, ignore_errors=True)
+        raise
+
+    logger.info("request: batch of %d pdf(s), %d rejected, profile=%s", len(jobs), len(rejected), profile)
+    QUOTAS.charge(caller, len(jobs) - 1)  # admit() took the first PDF's token
+    if not jobs:
+        lease.release()
+        shutil.rmtree(workdir, ignore_errors=True)
+        return JSONResponse({"ok": False, "sent_to": ", ".join(recipients), "messages": 0, "files": rejected}, status_code=422)
+
+    if async_:
+        _run_in_background(run_batch_job(jobs, workdir)).add_done_callback(lambda _: lease.release())
+        logger.info("request: /convert/batch accepted jobs=%d", len(jobs))
+        files = [{"filename": job.filename, "ok": True, "job_id": job.id, "stage": job.stage,
+                  "status_url": f"/jobs/{job.id}"} for job in jobs]
+        return JSONResponse({"ok": not rejected, "sent_to": ", ".join(recipients), "files": files + rejected}, status_code=202)
+
+    try:
+        messages = await run_batch_job(jobs, workdir)
+    finally:
+        lease.release()
+    files = [{"ok": job.stage != "failed", "delivered": job.stage == "done", **job.to_dict()} for job in jobs]
+    ok = not rejected and all(f["ok"] for f in files)
+    logger.info("request: /convert/batch done ok=%s messages=%d", ok, messages)
+    return JSONResponse({"ok": ok, "sent_to": ", ".join(recipients), "messages": messages, "files": files + rejected})
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, authorization: Optional[str] = Header(default=None)):
+    caller = require_bearer(authorization)
+
+    job = JOBS.get(job_id)
+    # someone else's job looks exactly like a missing one
+    if job is None or job.client_id != caller.client_id:
+        raise HTTPException(status_code=404, detail="Unknown job")
+
+    return JSONResponse(job.to_dict())
+
+@app.get("/stats")
+async def stats(authorization: Optional[str] = Header(default=None)):
+    caller = require_bearer(authorization)
+    scheduler = CONVERT_SCHEDULER.stats()
+    quotas = QUOTAS.stats()
+    if not caller.admin:
+        # per-client figures are limited to the caller's own
+        scheduler["queued_by_client"] = {k: v for k, v in scheduler["queued_by_client"].items() if k == caller.client_id}
+        quotas["active"] = {k: v for k, v in quotas["active"].items() if k == caller.client_id}
+        del quotas["rate_limited_clients"]
+    return JSONResponse({
+        "cache": CACHE.stats(),
+        "outbox": await asyncio.to_thread(OUTBOX.stats),
+        "scheduler": scheduler,
+        "quotas": quotas,
+    })
+
+
+@app.post("/test-email")
+def test_email(authorization: Optional[str] = Header(default=None)):
+    logger.info("request: /test-email received")
+    caller = require_bearer(authorization)
+
+    sent, failed = [], {}
+    for to_addr in caller.recipients:
+        logger.info("test-email: sending to %s", to_addr)
+        try:
+            send_email_with_attachment(
+                subject="SMTP test (no attachment)",
+                body="If you received this, SMTP is working.",
+                to_addr=to_addr,
+                attachments=[],
+            )
+        except Exception as e:
+            logger.warning("test-email: sending to %s failed: %s", to_addr, e)
+            failed[to_addr] = str(e)
+        else:
+            sent.append(to_addr)
+
+    # only ever the caller's own addresses, and 502 unless every one of them worked
+    return JSONResponse({"ok": not failed, "sent_to": ", ".join(sent), "failed": failed},
+                        status_code=502 if failed else 200)
+
+
+@app.get("/metrics")
+async def metrics():
+    OUTBOX_DEPTH.set(await asyncio.to_thread(OUTBOX.depth))
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/")
+def root():
+    return "ok"
+
+def bench(pdf_paths: list[str]) -> None:
+    """Compare the native engine with calibre: `./main.py bench a.pdf b.pdf ...`"""
+    print(f"{'file':<40} {'pages':>5} {'native s':>9} {'native KB':>10} {'calibre s':>10} {'calibre KB':>11}")
+    for name in pdf_paths:
+        pdf_path = Path(name)
+        with tempfile.TemporaryDirectory() as td:
+            native_s = native_kb = "-"
+            t0 = time.perf_counter()
+            text_pdf = probe_text_pdf(pdf_path)
+            if text_pdf is not None:
+                write_text_epub(*text_pdf, Path(td) / "native.epub")
+                native_s = f"{time.perf_counter() - t0:.2f}"
+                native_kb = f"{(Path(td) / 'native.epub').stat().st_size / 1024:.0f}"
+
+            t0 = time.perf_counter()
+            try:
+                _convert_one(pdf_path, Path(td) / "calibre.epub")
+                calibre_s = f"{time.perf_counter() - t0:.2f}"
+                calibre_kb = f"{(Path(td) / 'calibre.epub').stat().st_size / 1024:.0f}"
+            except RuntimeError as e:
+                calibre_s, calibre_kb = "failed", str(e)[:30]
+
+        pages = _page_count(pdf_path)
+        print(f"{pdf_path.name[:40]:<40} {pages:>5} {native_s:>9} {native_kb:>10} {calibre_s:>10} {calibre_kb:>11}")
+
+
+def mint_token(owner: str, recipients: list[str]) -> None:
+    """Print a new token and its registry entry: `./main.py token OWNER KINDLE_ADDRESS ...`"""
+    token, key_id, entry = new_token(owner, recipients)
+    print(f"token (give to the client, not stored anywhere): {token}")
+    print(f"TOKENS_FILE entry: {json.dumps({key_id: entry})}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        bench(sys.argv[2:])
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == "native":
+        # child side of _convert_native: `main.py native IN.pdf OUT.epub`
+        text_pdf = probe_text_pdf(Path(sys.argv[2]))
+        if text_pdf is None:
+            sys.exit(NATIVE_NOT_TEXT_EXIT)
+        write_text_epub(*text_pdf, Path(sys.argv[3]))
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == "token":
+        if len(sys.argv) < 4:
+            sys.exit("usage: main.py token OWNER KINDLE_ADDRESS [KINDLE_ADDRESS ...]")
+        mint_token(sys.argv[2], sys.argv[3:])
+        sys.exit(0)
 
-if __name__ == "__main__":
     import uvicorn
 
     uvicorn.run(app, host="0.0.0.0", port=int(os.environ.get("PORT", "8000")))
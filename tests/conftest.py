@@ -0,0 +1,93 @@
+import io
+import os
+import socket
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+_STATE = Path(tempfile.mkdtemp(prefix="pdf2epub-tests-"))
+os.environ.update({
+    "BEARER_TOKEN": "test-token",
+    "KINDLE_EMAIL": "reader@kindle.example",
+    "EBOOK_CONVERT_BIN": str(ROOT / "tests" / "fake-ebook-convert"),
+    "CONVERT_ENGINE": "calibre",
+    "DATA_DIR": str(_STATE),
+    "SMTP_HOST": "127.0.0.1",
+    "SMTP_TLS": "false",
+    "SMTP_USER": "",
+})
+sys.path.insert(0, str(ROOT))
+
+import main  # noqa: E402
+
+
+class _Collector:
+    def __init__(self):
+        self.messages = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        return "250 OK"
+
+
+@pytest.fixture
+def smtp_server(monkeypatch):
+    """An aiosmtpd server on a free port that main's SMTP settings point at."""
+    from aiosmtpd.controller import Controller
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    handler = _Collector()
+    controller = Controller(handler, hostname="127.0.0.1", port=port)
+    controller.start()
+    monkeypatch.setattr(main, "SMTP_HOST", "127.0.0.1")
+    monkeypatch.setattr(main, "SMTP_PORT", port)
+    monkeypatch.setattr(main, "SMTP_TLS", False)
+    monkeypatch.setattr(main, "SMTP_USER", "")
+    yield handler
+    controller.stop()
+
+
+def make_pdf(pages: int = 1, marker: str = "") -> bytes:
+    """A blank PDF; marker changes its bytes (and so its hash) without changing the page count."""
+    from pypdf import PdfWriter
+
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(width=200, height=200)
+    if marker:
+        writer.add_metadata({"/Title": marker})
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+def make_text_pdf(pages: list[list[str]], title: str = "") -> bytes:
+    """A PDF with one line of Helvetica text per string, for the native engine."""
+    from pypdf import PdfWriter
+    from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+    writer = PdfWriter()
+    font = writer._add_object(DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject("/Helvetica"),
+    }))
+    for lines in pages:
+        page = writer.add_blank_page(width=612, height=792)
+        page[NameObject("/Resources")] = DictionaryObject({
+            NameObject("/Font"): DictionaryObject({NameObject("/F1"): font})})
+        shown = b" T* ".join(b"(" + line.encode("latin-1").replace(b"(", b"\\(").replace(b")", b"\\)") + b") Tj"
+                             for line in lines)
+        stream = DecodedStreamObject()
+        stream.set_data(b"BT /F1 10 Tf 14 TL 72 740 Td " + shown + b" ET")
+        page[NameObject("/Contents")] = writer._add_object(stream)
+    if title:
+        writer.add_metadata({"/Title": title})
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
@@ -0,0 +1,97 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+
+@pytest.fixture
+def tokens(tmp_path, monkeypatch):
+    """Two registry clients, alice and bob, plus an admin; returns their tokens."""
+    entries, minted = {}, {}
+    for owner, extra in (("alice", {}), ("bob", {}), ("ops", {"admin": True})):
+        token, key_id, entry = main.new_token(owner, [f"{owner}@kindle.example"])
+        entries[key_id] = {**entry, **extra}
+        minted[owner] = (token, key_id)
+    path = tmp_path / "tokens.json"
+    path.write_text(json.dumps(entries))
+    monkeypatch.setattr(main, "TOKENS", main.TokenRegistry(path))
+    return minted
+
+
+def _auth(token):
+    return {"Authorization": f"Bearer {token}"}
+
+
+def test_jobs_are_only_visible_to_their_client(tokens):
+    bob_token, bob_id = tokens["bob"]
+    job = main.new_job(bob_id, "secret-report.pdf", ("bob@kindle.example",), "0" * 64, 1, main.OUTPUT_PROFILE)
+
+    with TestClient(main.app) as client:
+        assert client.get(f"/jobs/{job.id}", headers=_auth(bob_token)).status_code == 200
+        r = client.get(f"/jobs/{job.id}", headers=_auth(tokens["alice"][0]))
+
+    assert r.status_code == 404
+    assert "secret-report" not in r.text
+
+
+def test_stats_limit_per_client_figures_to_the_caller(tokens, monkeypatch):
+    alice_token, alice_id = tokens["alice"]
+    _, bob_id = tokens["bob"]
+    monkeypatch.setattr(main.QUOTAS, "_active", {alice_id: 1, bob_id: 2})
+
+    with TestClient(main.app) as client:
+        mine = client.get("/stats", headers=_auth(alice_token)).json()
+        everyone = client.get("/stats", headers=_auth(tokens["ops"][0])).json()
+
+    assert mine["quotas"]["active"] == {alice_id: 1}
+    assert "rate_limited_clients" not in mine["quotas"]
+    assert everyone["quotas"]["active"] == {alice_id: 1, bob_id: 2}
+
+
+def test_plain_token_id_reveals_nothing_of_the_token(monkeypatch):
+    token = "prefix-part.of-the-secret"
+    monkeypatch.setattr(main, "BEARER_TOKEN", token)
+    registry = main.TokenRegistry(None)
+
+    caller = registry.verify(token)
+
+    assert caller is not None
+    assert "prefix" not in caller.client_id
+    assert caller.client_id != main.hashlib.sha256(token.encode()).hexdigest()[:len(caller.client_id)]
+    assert registry.verify("prefix-part.wrong") is None
+
+
+def test_minted_tokens_are_keyed_by_their_id(tokens):
+    token, key_id = tokens["alice"]
+
+    assert main.TOKENS.verify(token).client_id == key_id
+    assert main.TOKENS.verify(f"{key_id}.not-the-secret") is None
+
+
+def test_test_email_reports_each_recipient_and_never_falls_back(tokens, monkeypatch):
+    token, _ = tokens["alice"]
+    attempts = []
+
+    def send(subject, body, to_addr, attachments):
+        attempts.append(to_addr)
+        raise RuntimeError("Email failed: 550 mailbox unavailable")
+
+    monkeypatch.setattr(main, "send_email_with_attachment", send)
+    with TestClient(main.app) as client:
+        r = client.post("/test-email", headers=_auth(token))
+
+    assert r.status_code == 502
+    assert attempts == ["alice@kindle.example"]
+    assert r.json() == {"ok": False, "sent_to": "",
+                        "failed": {"alice@kindle.example": "Email failed: 550 mailbox unavailable"}}
+
+
+def test_test_email_sends_to_the_callers_addresses(smtp_server):
+    with TestClient(main.app) as client:
+        r = client.post("/test-email", headers=_auth("test-token"))
+
+    assert r.status_code == 200
+    assert r.json()["sent_to"] == "reader@kindle.example"
+    assert [m.rcpt_tos for m in smtp_server.messages] == [["reader@kindle.example"]]
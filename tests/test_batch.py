@@ -0,0 +1,122 @@
+import email
+import io
+import zipfile
+from email import policy
+
+from fastapi.testclient import TestClient
+
+import main
+from conftest import make_pdf
+
+AUTH = {"Authorization": "Bearer test-token"}
+
+
+def _attachments(envelope):
+    msg = email.message_from_bytes(envelope.content, policy=policy.default)
+    return {part.get_filename(): part.get_content() for part in msg.iter_attachments()}
+
+
+def test_batch_converts_and_sends_one_message(smtp_server, monkeypatch):
+    monkeypatch.setattr(main, "OUTBOX_ENABLED", False)
+    monkeypatch.setattr(main, "SMTP_ASYNC", True)
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr("week/third.pdf", make_pdf(marker="batch-3"))
+        zf.writestr("notes.txt", "not a pdf")
+
+    with TestClient(main.app) as client:
+        r = client.post("/convert/batch", headers=AUTH, files=[
+            ("files", ("first.pdf", make_pdf(marker="batch-1"), "application/pdf")),
+            ("files", ("second.pdf", make_pdf(marker="batch-2"), "application/pdf")),
+            ("files", ("more.zip", archive.getvalue(), "application/zip")),
+        ])
+
+    assert r.status_code == 200, r.text
+    body = r.json()
+    converted = [f for f in body["files"] if f.get("id")]
+    assert [f["filename"] for f in converted] == ["first.pdf", "second.pdf", "third.pdf"]
+    assert all(f["stage"] == "done" and f["delivered"] for f in converted)
+    assert [f["filename"] for f in body["files"] if f["stage"] == "rejected"] == ["notes.txt"]
+    assert body["messages"] == 1
+
+    assert len(smtp_server.messages) == 1
+    envelope = smtp_server.messages[0]
+    assert envelope.rcpt_tos == ["reader@kindle.example"]
+    attachments = _attachments(envelope)
+    assert sorted(attachments) == ["first.epub", "second.epub", "third.epub"]
+    assert all(zipfile.is_zipfile(io.BytesIO(data)) for data in attachments.values())
+
+
+def test_batch_splits_messages_at_the_size_limit(smtp_server, monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "OUTBOX_ENABLED", False)
+    monkeypatch.setattr(main, "SMTP_ASYNC", False)
+    # room for one of the stand-in EPUBs per message, not two
+    probe_pdf, probe_epub = tmp_path / "a.pdf", tmp_path / "a.epub"
+    probe_pdf.write_bytes(make_pdf(marker="split-a"))
+    main._convert_one(probe_pdf, probe_epub)
+    # the stand-in EPUBs are tiny, so shrink the text allowance to match
+    monkeypatch.setattr(main, "MESSAGE_TEXT_ALLOWANCE_BYTES", 500)
+    one = main.message_size([probe_epub]) + main.MESSAGE_TEXT_ALLOWANCE_BYTES
+    monkeypatch.setattr(main, "SMTP_MAX_MESSAGE_BYTES", one + 200)
+
+    with TestClient(main.app) as client:
+        r = client.post("/convert/batch", headers=AUTH, files=[
+            ("files", ("a.pdf", make_pdf(marker="split-a"), "application/pdf")),
+            ("files", ("b.pdf", make_pdf(marker="split-b"), "application/pdf")),
+        ])
+
+    assert r.status_code == 200, r.text
+    assert r.json()["messages"] == 2
+    assert sorted(name for env in smtp_server.messages for name in _attachments(env)) == ["a.epub", "b.epub"]
+
+
+def test_batch_caps_each_pdf_part_at_the_single_pdf_limit(monkeypatch):
+    pdf = make_pdf(marker="too-big")
+    monkeypatch.setattr(main, "MAX_PDF_BYTES", len(pdf) - 1)
+    written = []
+    monkeypatch.setattr(main.StreamingUploadParser, "_flush",
+                        lambda self: written.extend(self._pending) or self._pending.clear())
+
+    with TestClient(main.app) as client:
+        r = client.post("/convert/batch", headers=AUTH, files=[("files", ("big.pdf", pdf, "application/pdf"))])
+
+    assert r.status_code == 413
+    assert r.json()["detail"] == "PDF too large"
+    assert sum(len(chunk) for _, chunk in written if chunk) <= len(pdf) - 1
+
+
+def test_batch_archives_may_exceed_the_single_pdf_limit(smtp_server, monkeypatch):
+    monkeypatch.setattr(main, "OUTBOX_ENABLED", False)
+    first, second = make_pdf(marker="zip-1"), make_pdf(marker="zip-2")
+    monkeypatch.setattr(main, "MAX_PDF_BYTES", max(len(first), len(second)))
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_STORED) as zf:
+        zf.writestr("first.pdf", first)
+        zf.writestr("second.pdf", second)
+    assert len(archive.getvalue()) > main.MAX_PDF_BYTES
+
+    with TestClient(main.app) as client:
+        r = client.post("/convert/batch", headers=AUTH, files=[("files", ("both.zip", archive.getvalue(), "application/zip"))])
+
+    assert r.status_code == 200, r.text
+    assert [f["filename"] for f in r.json()["files"]] == ["first.pdf", "second.pdf"]
+
+
+def test_batch_refuses_extra_file_parts_before_writing_them(monkeypatch):
+    monkeypatch.setattr(main, "MAX_BATCH_FILES", 2)
+    opened = []
+    real_headers_finished = main.StreamingUploadParser.on_headers_finished
+
+    def on_headers_finished(self):
+        real_headers_finished(self)
+        opened.append(self._current)
+    monkeypatch.setattr(main.StreamingUploadParser, "on_headers_finished", on_headers_finished)
+
+    with TestClient(main.app) as client:
+        r = client.post("/convert/batch", headers=AUTH, files=[
+            ("files", (f"{i}.pdf", make_pdf(marker=f"many-{i}"), "application/pdf")) for i in range(3)
+        ])
+
+    assert r.status_code == 413
+    assert "max 2" in r.json()["detail"]
+    assert len(opened) == 2
@@ -0,0 +1,70 @@
+import asyncio
+import hashlib
+
+import pytest
+
+import main
+from conftest import make_pdf
+
+
+def _whole_book(tmp_path, title, pages=4):
+    pdf = tmp_path / "input.pdf"
+    pdf.write_bytes(make_pdf(pages=pages, marker=title))
+    epub = tmp_path / "output.epub"
+    main._convert_one(pdf, epub)
+    job = main.new_job("client", "report.pdf", ("r@kindle.example",), hashlib.sha256(pdf.read_bytes()).hexdigest(),
+                       pdf.stat().st_size, main.OUTPUT_PROFILE)
+    return job, pdf, epub
+
+
+def test_volumes_are_titled_after_the_book_and_cached(tmp_path, monkeypatch):
+    job, pdf, epub = _whole_book(tmp_path, "Volume Test Book")
+
+    volumes = asyncio.run(main.convert_volumes(job, pdf, epub, 2))
+    assert [main.epub_title(v) for v in volumes] == ["Volume Test Book (1/2)", "Volume Test Book (2/2)"]
+
+    def no_conversion(*args):
+        raise AssertionError("volume converted again despite the cache")
+
+    monkeypatch.setattr(main, "convert_and_optimize", no_conversion)
+    for v in volumes:
+        v.unlink()
+    again = asyncio.run(main.convert_volumes(job, pdf, epub, 2))
+    assert [main.epub_title(v) for v in again] == ["Volume Test Book (1/2)", "Volume Test Book (2/2)"]
+
+
+def test_volume_timeout_quarantines_the_pdf(tmp_path, monkeypatch):
+    job, pdf, epub = _whole_book(tmp_path, "Volume Timeout Book")
+
+    def timeout(*args):
+        raise main.ConversionTimeout("Conversion timed out after 1s")
+
+    monkeypatch.setattr(main, "convert_and_optimize", timeout)
+    with pytest.raises(main.ConversionTimeout):
+        asyncio.run(main.convert_volumes(job, pdf, epub, 2))
+    assert job.sha256 in main.QUARANTINE
+
+
+def test_oversize_recompression_follows_image_grayscale(tmp_path, monkeypatch):
+    job, pdf, epub = _whole_book(tmp_path, "Colour Book", pages=1)
+    calls = []
+    monkeypatch.setattr(main, "IMAGE_GRAYSCALE", False)
+    monkeypatch.setattr(main, "SMTP_MAX_MESSAGE_BYTES", main.MESSAGE_TEXT_ALLOWANCE_BYTES + 10)
+    monkeypatch.setattr(main, "optimize_epub_images", lambda path, size, grayscale, *rest: calls.append(grayscale))
+
+    with pytest.raises(main.DeliveryTooLarge):
+        asyncio.run(main.fit_for_delivery(job, pdf, epub))
+    assert calls and not any(calls)
+
+
+def test_plan_counts_the_real_message_text(tmp_path):
+    files = []
+    for name in ("a.epub", "b.epub"):
+        path = tmp_path / name
+        path.write_bytes(b"x" * 1000)
+        files.append(path)
+    limit = main.message_size(files) + 100
+    long_body = "\n".join(f"  a rather long file name number {i}.pdf" for i in range(30))
+
+    assert len(main.plan_messages(files, limit)) == 1
+    assert len(main.plan_messages(files, limit, lambda group: ("Books", long_body, "r@kindle.example"))) == 2
@@ -0,0 +1,80 @@
+import io
+import zipfile
+from concurrent.futures import Future
+
+from PIL import Image
+
+import main
+
+
+def _jpeg(n):
+    out = io.BytesIO()
+    # noise, like a scanned page, so deflating the source zip can't hide the saving
+    Image.effect_noise((1200, 1600), 40 + n).convert("RGB").save(out, "JPEG", quality=95)
+    return out.getvalue()
+
+
+def _epub(path, images):
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("mimetype", "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+        zf.writestr("OEBPS/content.xhtml", "<html><body>text</body></html>")
+        for name, data in images.items():
+            zf.writestr(name, data)
+
+
+class _CountingExecutor:
+    """Runs each image inline, tracking how many results are held before being written."""
+
+    def __init__(self):
+        self.outstanding = self.peak = 0
+
+    def submit(self, fn, *args):
+        executor = self
+        executor.outstanding += 1
+        executor.peak = max(executor.peak, executor.outstanding)
+
+        class Tracked(Future):
+            def result(self, timeout=None):
+                executor.outstanding -= 1
+                return super().result(timeout)
+
+        future = Tracked()
+        future.set_result(fn(*args))
+        return future
+
+
+def test_images_stream_through_with_bounded_in_flight(tmp_path, monkeypatch):
+    executor = _CountingExecutor()
+    monkeypatch.setattr(main, "IMAGE_EXECUTOR", executor)
+    monkeypatch.setattr(main, "IMAGE_WORKERS", 1)
+    images = {f"OEBPS/img{i}.jpg": _jpeg(i) for i in range(6)}
+    epub = tmp_path / "book.epub"
+    _epub(epub, images)
+
+    stats = main.optimize_epub_images(epub, (300, 400))
+
+    assert executor.peak == 2
+    assert stats["images"] == 6
+    assert stats["image_bytes_after"] < stats["image_bytes_before"] == sum(map(len, images.values()))
+    assert stats["bytes_after"] == epub.stat().st_size < stats["bytes_before"]
+    with zipfile.ZipFile(epub) as zf:
+        assert zf.namelist()[0] == "mimetype"
+        assert zf.getinfo("mimetype").compress_type == zipfile.ZIP_STORED
+        assert zf.read("OEBPS/content.xhtml") == b"<html><body>text</body></html>"
+        assert sorted(n for n in zf.namelist() if n.endswith(".jpg")) == sorted(images)
+        with Image.open(io.BytesIO(zf.read("OEBPS/img0.jpg"))) as img:
+            assert img.size == (300, 400)
+
+
+def test_epub_is_left_alone_when_images_do_not_shrink(tmp_path):
+    out = io.BytesIO()
+    Image.new("L", (4, 4)).save(out, "PNG")
+    epub = tmp_path / "book.epub"
+    _epub(epub, {"OEBPS/dot.png": out.getvalue()})
+    before = epub.read_bytes()
+
+    stats = main.optimize_epub_images(epub, (600, 800))
+
+    assert epub.read_bytes() == before
+    assert stats["image_bytes_after"] == stats["image_bytes_before"]
+    assert not (tmp_path / "book.epub.tmp").exists()
@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def stuck_conversion(monkeypatch):
+    """convert_for_job never finishes; the event is set once it has started."""
+    started = asyncio.Event()
+
+    async def convert_for_job(job, pdf_path, epub_path):
+        started.set()
+        await asyncio.sleep(3600)
+    monkeypatch.setattr(main, "convert_for_job", convert_for_job)
+    return started
+
+
+def _job(workdir):
+    workdir.mkdir(parents=True)
+    (workdir / "input.pdf").write_bytes(b"%PDF-1.4")
+    return main.new_job("client", "in.pdf", ("r@kindle.example",), "0" * 64, 8, main.OUTPUT_PROFILE)
+
+
+def test_cancelled_conversion_fails_the_job(tmp_path, stuck_conversion):
+    workdir = tmp_path / "work"
+    job = _job(workdir)
+
+    async def cancel_midway():
+        task = asyncio.create_task(main.run_conversion_job(job, workdir))
+        await stuck_conversion.wait()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_midway())
+
+    assert job.stage == "failed"
+    assert job.failed_stage == "converting"
+    assert job.error_class == "cancelled"
+    assert not workdir.exists()
+
+
+def test_cancelled_batch_fails_its_jobs(tmp_path, stuck_conversion):
+    workdir = tmp_path / "batch"
+    jobs = [_job(workdir / str(i)) for i in range(2)]
+    for i, job in enumerate(jobs):
+        (workdir / str(i)).rename(workdir / job.id)
+
+    async def cancel_midway():
+        task = asyncio.create_task(main.run_batch_job(jobs, workdir))
+        await stuck_conversion.wait()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_midway())
+
+    assert [job.stage for job in jobs] == ["failed", "failed"]
+    assert all(job.error_class == "cancelled" for job in jobs)
+    assert not workdir.exists()
@@ -0,0 +1,40 @@
+import resource
+import subprocess
+import sys
+
+import main
+
+REPORT = ("import resource; print(*resource.getrlimit(resource.RLIMIT_AS), *resource.getrlimit(resource.RLIMIT_CPU),"
+          " *resource.getrlimit(resource.RLIMIT_NOFILE))")
+
+
+def _limits_in_child(cmd):
+    return [int(v) for v in subprocess.run(cmd, capture_output=True, text=True, check=True).stdout.split()]
+
+
+def test_no_limits_leaves_the_command_alone(monkeypatch):
+    for name in ("CONVERT_MAX_MEMORY_BYTES", "CONVERT_MAX_CPU_SECONDS", "CONVERT_MAX_OPEN_FILES"):
+        monkeypatch.setattr(main, name, 0)
+
+    assert main._limited_command(["ebook-convert", "a.pdf", "a.epub"], None) == ["ebook-convert", "a.pdf", "a.epub"]
+
+
+def test_limits_are_in_place_when_the_command_starts(monkeypatch):
+    monkeypatch.setattr(main, "CONVERT_MAX_MEMORY_BYTES", 4 * 1024 ** 3)
+    monkeypatch.setattr(main, "CONVERT_MAX_CPU_SECONDS", 120)
+    monkeypatch.setattr(main, "CONVERT_MAX_OPEN_FILES", 200)
+
+    limits = _limits_in_child(main._limited_command([sys.executable, "-c", REPORT], None))
+
+    assert limits == [4 * 1024 ** 3, 4 * 1024 ** 3, 120, 125, 200, 200]
+
+
+def test_warm_workers_skip_the_cpu_limit(monkeypatch):
+    monkeypatch.setattr(main, "CONVERT_MAX_MEMORY_BYTES", 0)
+    monkeypatch.setattr(main, "CONVERT_MAX_CPU_SECONDS", 120)
+    monkeypatch.setattr(main, "CONVERT_MAX_OPEN_FILES", 200)
+
+    limits = _limits_in_child(main._limited_command([sys.executable, "-c", REPORT], None, cpu_limit=False))
+
+    assert limits[2:4] == list(resource.getrlimit(resource.RLIMIT_CPU))
+    assert limits[4:] == [200, 200]
@@ -0,0 +1,73 @@
+import re
+import zipfile
+
+import pytest
+
+import main
+from conftest import make_pdf, make_text_pdf
+
+PAGES = [
+    ["1 Introduction", "", "This sentence starts at the bottom of the first page of the",
+     "document and the reader should not see a break in the"],
+    ["middle of it just because the PDF started a new page here.", "",
+     "2 Methods", "", "Everything else in the methods section fits on this page."],
+]
+
+
+def _documents(epub_path):
+    with zipfile.ZipFile(epub_path) as zf:
+        opf = zf.read("content.opf").decode()
+        spine = re.findall(r'<itemref idref="(\w+)"/>', opf)
+        hrefs = dict(re.findall(r'<item id="(\w+)" href="([^"]+)"', opf))
+        return [zf.read(hrefs[idref]).decode() for idref in spine]
+
+
+def test_paragraphs_flow_across_page_breaks(tmp_path):
+    epub = tmp_path / "book.epub"
+    main.write_text_epub("Book", ["\n".join(lines) for lines in PAGES], epub)
+
+    docs = _documents(epub)
+
+    assert len(docs) == 2  # one per heading, not one per PDF page
+    assert "<h2" in docs[0] and "1 Introduction" in docs[0]
+    assert ("<p>This sentence starts at the bottom of the first page of the document and the reader "
+            "should not see a break in the middle of it just because the PDF started a new page here.</p>") in docs[0]
+    assert "2 Methods" in docs[1]
+
+
+def test_long_text_without_headings_is_split_at_paragraphs(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "NATIVE_DOC_MAX_CHARS", 100)
+    pages = ["\n\n".join(f"Paragraph {i} is long enough to count towards the limit of the document." for i in range(6))]
+    epub = tmp_path / "book.epub"
+    main.write_text_epub("Book", pages, epub)
+
+    docs = _documents(epub)
+
+    assert len(docs) == 3
+    assert all(doc.count("<p>") == 2 for doc in docs)
+
+
+def test_native_engine_runs_in_a_child_process(tmp_path):
+    pdf = tmp_path / "in.pdf"
+    pdf.write_bytes(make_text_pdf(PAGES, title="Native Title"))
+    epub = tmp_path / "out.epub"
+
+    assert main._convert_native(pdf, epub) is True
+    with zipfile.ZipFile(epub) as zf:
+        assert "<dc:title>Native Title</dc:title>" in zf.read("content.opf").decode()
+
+
+def test_native_engine_leaves_non_text_pdfs_to_calibre(tmp_path):
+    pdf = tmp_path / "in.pdf"
+    pdf.write_bytes(make_pdf())
+
+    assert main._convert_native(pdf, tmp_path / "out.epub") is False
+
+
+def test_native_engine_is_held_to_the_conversion_deadline(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "CONVERT_TIMEOUT_SECONDS", 0.01)
+    pdf = tmp_path / "in.pdf"
+    pdf.write_bytes(make_text_pdf(PAGES))
+
+    with pytest.raises(main.ConversionTimeout):
+        main._convert_native(pdf, tmp_path / "out.epub")
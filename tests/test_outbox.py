@@ -0,0 +1,51 @@
+import pytest
+
+import main
+
+
+@pytest.fixture
+def outbox(tmp_path):
+    box = main.Outbox(tmp_path / "outbox")
+    box.open()
+    return box
+
+
+def _enqueue(outbox, tmp_path, name="book.epub"):
+    epub = tmp_path / name
+    epub.write_bytes(b"epub")
+    row_id = outbox.enqueue(["job"], "reader@kindle.example", "Book", "Enjoy.", [epub])
+    return next(row for row in outbox.due() if row["id"] == row_id)
+
+
+def test_dead_rows_drop_their_spool(outbox, tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "OUTBOX_MAX_ATTEMPTS", 1)
+    row = _enqueue(outbox, tmp_path)
+
+    assert outbox.mark_failed(row, "550 rejected") is None
+
+    assert outbox.stats()["dead"] == 1
+    assert list(outbox.spool.iterdir()) == []
+
+
+def test_prune_deletes_finished_rows_after_retention(outbox, tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "OUTBOX_MAX_ATTEMPTS", 1)
+    sent, dead, pending = (_enqueue(outbox, tmp_path, f"{n}.epub") for n in ("sent", "dead", "pending"))
+    outbox.mark_sent(sent)
+    outbox.mark_failed(dead, "550 rejected")
+
+    assert outbox.prune() == 0
+    monkeypatch.setattr(main, "OUTBOX_RETENTION_SECONDS", -1)
+    assert outbox.prune() == 2
+
+    assert outbox.stats() == {"enabled": True, "pending": 1}
+    assert [row["id"] for row in outbox.due()] == [pending["id"]]
+    assert len(list(outbox.spool.iterdir())) == 1
+
+
+def test_prune_clears_spools_left_by_old_dead_rows(outbox, tmp_path, monkeypatch):
+    row = _enqueue(outbox, tmp_path)
+    with outbox._lock:  # given up on before dead rows dropped their spool
+        outbox._db.execute("UPDATE outbox SET status = 'dead', next_attempt_at = 0 WHERE id = ?", (row["id"],))
+
+    assert outbox.prune() == 1
+    assert list(outbox.spool.iterdir()) == []
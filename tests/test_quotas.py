@@ -0,0 +1,114 @@
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import main
+from conftest import make_pdf
+
+AUTH = {"Authorization": "Bearer test-token"}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(main.time, "monotonic", lambda: now[0])
+    return now
+
+
+def _caller(**limits):
+    return main.Caller("client", "owner", ("reader@kindle.example",), **limits)
+
+
+def _refused(fn, *args):
+    with pytest.raises(HTTPException) as info:
+        fn(*args)
+    return info.value
+
+
+def test_bucket_refuses_when_empty_and_refills(clock):
+    quotas = main.ClientQuotas()
+    caller = _caller(rate_per_minute=6, burst=2, max_concurrent=0)
+
+    quotas.admit(caller)
+    quotas.admit(caller)
+    refused = _refused(quotas.admit, caller)
+
+    assert refused.status_code == 429
+    assert refused.headers["Retry-After"] == "10"  # one token at 0.1/s
+
+    clock[0] += 4
+    assert _refused(quotas.admit, caller).headers["Retry-After"] == "6"
+    clock[0] += 6
+    quotas.admit(caller)
+
+
+def test_charge_puts_the_bucket_in_debt(clock):
+    quotas = main.ClientQuotas()
+    caller = _caller(rate_per_minute=60, burst=3, max_concurrent=0)
+
+    quotas.admit(caller)
+    quotas.charge(caller, 4)  # the rest of a five-PDF batch: 3 - 5 = -2
+
+    assert _refused(quotas.admit, caller).headers["Retry-After"] == "3"
+    clock[0] += 3
+    quotas.admit(caller)
+
+
+def test_concurrency_cap_and_lease_release(clock):
+    quotas = main.ClientQuotas()
+    caller = _caller(rate_per_minute=0, max_concurrent=2)
+
+    first = quotas.admit(caller)
+    second = quotas.admit(caller)
+    refused = _refused(quotas.admit, caller)
+    assert refused.status_code == 429
+    assert refused.headers["Retry-After"] == str(main.CONCURRENCY_RETRY_AFTER_SECONDS)
+
+    first.release()
+    first.release()  # a second release must not free someone else's slot
+    assert quotas.stats()["active"] == {"client": 1}
+    quotas.admit(caller)
+    second.release()
+
+
+def test_batch_takes_a_slot_per_pdf(clock):
+    quotas = main.ClientQuotas()
+    caller = _caller(rate_per_minute=0, max_concurrent=3)
+
+    lease = quotas.admit(caller)
+    quotas.take(caller, lease, 2)
+    assert quotas.stats()["active"] == {"client": 3}
+    assert _refused(quotas.admit, caller).status_code == 429
+
+    lease.release()
+    assert quotas.stats()["active"] == {}
+
+
+def test_batch_waits_for_slots_held_by_other_requests(clock):
+    quotas = main.ClientQuotas()
+    caller = _caller(rate_per_minute=0, max_concurrent=3)
+    running = quotas.admit(caller)
+    lease = quotas.admit(caller)
+
+    assert _refused(quotas.take, caller, lease, 2).status_code == 429
+    assert lease.slots == 1
+    assert quotas.stats()["active"] == {"client": 2}
+
+    running.release()
+    quotas.take(caller, lease, 2)
+    assert lease.slots == 3
+
+
+def test_batch_larger_than_the_cap_is_refused(monkeypatch):
+    monkeypatch.setattr(main, "MAX_CONCURRENT_PER_CLIENT", 1)
+    monkeypatch.setattr(main, "QUOTAS", main.ClientQuotas())
+
+    with TestClient(main.app) as client:
+        r = client.post("/convert/batch", headers=AUTH, files=[
+            ("files", ("first.pdf", make_pdf(marker="cap-1"), "application/pdf")),
+            ("files", ("second.pdf", make_pdf(marker="cap-2"), "application/pdf")),
+        ])
+
+    assert r.status_code == 422
+    assert "at most 1" in r.json()["detail"]
+    assert main.QUOTAS.stats()["active"] == {}
@@ -0,0 +1,21 @@
+import main
+
+MB = 1024 * 1024
+
+
+def test_small_runs_are_charged_to_the_fixed_cost():
+    scheduler = main.ConversionScheduler(1)
+    for _ in range(5):
+        scheduler._observe(100 * 1024, 4.0)
+
+    assert abs(scheduler.seconds_per_job - 4.0) < 0.5
+    assert scheduler.seconds_per_byte * MB == main.CONVERT_SECONDS_PER_MB
+
+
+def test_fit_separates_startup_from_per_byte_cost():
+    scheduler = main.ConversionScheduler(1)
+    for size in (1, 5, 2, 20, 3, 10) * 3:
+        scheduler._observe(size * MB, 3.0 + 2.0 * size)
+
+    assert abs(scheduler.seconds_per_job - 3.0) < 0.01
+    assert abs(scheduler.seconds_per_byte * MB - 2.0) < 0.01
@@ -0,0 +1,71 @@
+import re
+import zipfile
+
+import main
+from conftest import make_pdf
+
+NCX = ('<ncx xmlns="http://www.daisy.org/z3986/2005/ncx/" version="2005-1"><navMap>{points}</navMap></ncx>')
+
+
+def _shard_epub(path, title, chapters):
+    """A calibre-like EPUB 2 shard under OEBPS/ with an NCX entry per chapter."""
+    items = "".join(f'<item id="c{i}" href="c{i}.xhtml" media-type="application/xhtml+xml"/>' for i in range(len(chapters)))
+    spine = "".join(f'<itemref idref="c{i}"/>' for i in range(len(chapters)))
+    points = "".join(f'<navPoint id="n{i}"><navLabel><text>{label}</text></navLabel><content src="c{i}.xhtml"/></navPoint>'
+                     for i, label in enumerate(chapters))
+    with zipfile.ZipFile(path, "w") as zf:
+        zf.writestr("mimetype", "application/epub+zip")
+        zf.writestr("META-INF/container.xml",
+                    '<container xmlns="urn:oasis:names:tc:opendocument:xmlns:container" version="1.0"><rootfiles>'
+                    '<rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/></rootfiles></container>')
+        zf.writestr("OEBPS/content.opf",
+                    '<package xmlns="http://www.idpf.org/2007/opf" version="2.0"><metadata '
+                    f'xmlns:dc="http://purl.org/dc/elements/1.1/"><dc:title>{title}</dc:title></metadata>'
+                    f'<manifest><item id="ncx" href="toc.ncx" media-type="application/x-dtbncx+xml"/>{items}</manifest>'
+                    f'<spine toc="ncx">{spine}</spine></package>')
+        zf.writestr("OEBPS/toc.ncx", NCX.format(points=points))
+        for i, label in enumerate(chapters):
+            zf.writestr(f"OEBPS/c{i}.xhtml", f"<html><body><h1>{label}</h1></body></html>")
+
+
+def _read(epub_path):
+    with zipfile.ZipFile(epub_path) as zf:
+        opf, ncx = zf.read("content.opf").decode(), zf.read("toc.ncx").decode()
+        hrefs = dict(re.findall(r'<item id="([^"]+)" href="([^"]+)"', opf))
+        spine = [hrefs[idref] for idref in re.findall(r'<itemref idref="([^"]+)"/>', opf)]
+        assert all(href in zf.namelist() for href in spine)
+    title = re.search(r"<dc:title>(.*?)</dc:title>", opf).group(1)
+    toc = re.findall(r'<navLabel><text>([^<]*)</text></navLabel><content src="([^"]+)"', ncx)
+    return title, spine, toc
+
+
+def test_merge_keeps_title_spine_and_toc_in_order(tmp_path):
+    parts = [tmp_path / "shard-000.epub", tmp_path / "shard-001.epub"]
+    _shard_epub(parts[0], "My Real Title", ["One", "Two"])
+    _shard_epub(parts[1], "My Real Title", ["Three"])
+    out = tmp_path / "book.epub"
+
+    main.merge_epubs(parts, out)
+    title, spine, toc = _read(out)
+
+    assert title == "My Real Title"
+    assert spine == ["s000/OEBPS/c0.xhtml", "s000/OEBPS/c1.xhtml", "s001/OEBPS/c0.xhtml"]
+    assert toc == [("One", "s000/OEBPS/c0.xhtml"), ("Two", "s000/OEBPS/c1.xhtml"), ("Three", "s001/OEBPS/c0.xhtml")]
+
+
+def test_sharded_conversion_keeps_the_pdf_title(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "SHARD_PAGES", 2)
+    pdf = tmp_path / "in.pdf"
+    pdf.write_bytes(make_pdf(pages=5, marker="My Real Title"))
+
+    shards = main.split_pdf(pdf, tmp_path, 2)
+    assert len(shards) == 3
+    assert all(main.PdfReader(shard).metadata.title == "My Real Title" for shard in shards)
+
+    out = tmp_path / "book.epub"
+    main._convert_sharded(pdf, out, 5)
+    title, spine, toc = _read(out)
+
+    assert title == "My Real Title"
+    assert len(spine) == 3
+    assert [label for label, _ in toc] == ["Part 1", "Part 2", "Part 3"]
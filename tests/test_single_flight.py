@@ -0,0 +1,33 @@
+import asyncio
+import hashlib
+
+import main
+from conftest import make_pdf
+
+
+def test_concurrent_identical_uploads_share_one_conversion(tmp_path, monkeypatch):
+    runs = []
+    real_pdf_to_epub = main.pdf_to_epub
+
+    def counting_pdf_to_epub(*args, **kwargs):
+        runs.append(args[0])
+        return real_pdf_to_epub(*args, **kwargs)
+
+    monkeypatch.setattr(main, "pdf_to_epub", counting_pdf_to_epub)
+    pdf = tmp_path / "in.pdf"
+    pdf.write_bytes(make_pdf(marker="single-flight"))
+    sha256 = hashlib.sha256(pdf.read_bytes()).hexdigest()
+    cache_key = f"single-flight-{sha256}"
+
+    async def convert_all():
+        jobs = [main.new_job("client", "in.pdf", ("r@kindle.example",), sha256, pdf.stat().st_size, main.OUTPUT_PROFILE)
+                for _ in range(3)]
+        return await asyncio.gather(*(
+            main.convert_single_flight(cache_key, job, pdf, tmp_path / f"out-{i}.epub") for i, job in enumerate(jobs)))
+
+    joined = asyncio.run(convert_all())
+
+    assert len(runs) == 1
+    assert joined == [False, True, True]
+    assert all((tmp_path / f"out-{i}.epub").stat().st_size > 0 for i in range(3))
+    assert cache_key not in main.INFLIGHT
@@ -0,0 +1,112 @@
+import asyncio
+import email
+import os
+from email import policy
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def attachments(tmp_path):
+    """Attachments around the chunk and base64 line boundaries, one empty."""
+    paths = []
+    for name, size in (("empty.epub", 0), ("small.epub", 1), ("line.epub", 57), ("chunks.epub", 2 * main.ATTACHMENT_CHUNK_BYTES + 5)):
+        path = tmp_path / name
+        path.write_bytes(os.urandom(size))
+        paths.append(path)
+    return paths
+
+
+def _message(to_addr, attachments):
+    # a body line starting with "." has to be dot-stuffed on the wire
+    return main.StreamingMessage("from@example.com", to_addr, "Books", "Enjoy.\n.hidden line\n", attachments)
+
+
+def _assert_received(envelope, to_addr, attachments):
+    assert envelope.rcpt_tos == [to_addr]
+    msg = email.message_from_bytes(envelope.content, policy=policy.default)
+    assert ".hidden line" in msg.get_body().get_content()
+    assert {part.get_filename(): part.get_content() for part in msg.iter_attachments()} == {
+        path.name: path.read_bytes() for path in attachments}
+
+
+@pytest.mark.parametrize("count", [0, 1, 4])
+def test_wire_size_matches_the_streamed_message(attachments, count):
+    msg = _message("reader@kindle.example", attachments[:count])
+
+    assert msg.wire_size() == len(b"".join(msg.chunks()))
+
+
+def test_async_connection_sends_a_streamed_message(smtp_server, attachments):
+    async def send():
+        conn = main.AsyncSMTPConnection("127.0.0.1", main.SMTP_PORT, timeout=5)
+        await conn.connect()
+        await conn.sendmail(_message("reader@kindle.example", attachments))
+        await conn.quit()
+
+    asyncio.run(send())
+
+    assert len(smtp_server.messages) == 1
+    _assert_received(smtp_server.messages[0], "reader@kindle.example", attachments)
+
+
+def test_smtp_pool_reuses_its_session(smtp_server, attachments):
+    pool = main.SMTPPool(1, idle_timeout=60)
+    try:
+        pool.send(_message("a@kindle.example", attachments))
+        session = pool._idle[0][0]
+        pool.send(_message("b@kindle.example", attachments[:1]))
+        assert pool._idle[0][0] is session
+    finally:
+        pool.close()
+
+    assert [m.rcpt_tos for m in smtp_server.messages] == [["a@kindle.example"], ["b@kindle.example"]]
+    _assert_received(smtp_server.messages[0], "a@kindle.example", attachments)
+
+
+def test_async_pool_retries_a_dropped_session(smtp_server, attachments):
+    async def send_twice():
+        pool = main.AsyncSMTPPool(1, idle_timeout=60)
+        await pool.send(_message("a@kindle.example", attachments[:1]))
+        # the idle session dies; NOOP notices and a fresh one is used
+        pool._idle[0][0]._writer.transport.abort()
+        await pool.send(_message("b@kindle.example", attachments[:1]))
+        await pool.close()
+
+    asyncio.run(send_twice())
+
+    assert [m.rcpt_tos for m in smtp_server.messages] == [["a@kindle.example"], ["b@kindle.example"]]
+
+
+def test_outbox_sends_due_rows_concurrently(tmp_path, monkeypatch, attachments):
+    outbox = main.Outbox(tmp_path / "outbox")
+    outbox.open()
+    monkeypatch.setattr(main, "OUTBOX", outbox)
+    monkeypatch.setattr(main.ASYNC_SMTP_POOL, "size", 3)
+    active, peak, sent = 0, 0, []
+
+    async def slow_delivery(subject, body, to_addr, attachments):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.2)
+        active -= 1
+        sent.append(to_addr)
+
+    monkeypatch.setattr(main, "deliver_email", slow_delivery)
+    for i in range(5):
+        outbox.enqueue([], f"r{i}@kindle.example", "Books", "", attachments[1:2])
+
+    async def drain():
+        outbox.wakeup = asyncio.Event()
+        sender = asyncio.create_task(main.outbox_sender())
+        while len(sent) < 5:
+            await asyncio.sleep(0.05)
+        sender.cancel()
+
+    asyncio.run(asyncio.wait_for(drain(), 5))
+
+    assert peak == 3
+    assert sorted(sent) == [f"r{i}@kindle.example" for i in range(5)]
@@ -0,0 +1,59 @@
+import main
+
+
+def _headings(text):
+    return [content for kind, content in main._text_blocks(text) if kind == "h2"]
+
+
+def test_numbered_and_labelled_headings_are_found():
+    text = "\n".join([
+        "1 Introduction",
+        "",
+        "This report looks at the survey results in some detail and explains the method.",
+        "",
+        "Chapter 3",
+        "",
+        "2.1 Methods",
+        "We asked everyone the same questions in the same order over the whole of the year.",
+        "",
+        "Part Two: Home",
+    ])
+
+    assert _headings(text) == ["1 Introduction", "Chapter 3", "2.1 Methods", "Part Two: Home"]
+
+
+def test_body_lines_starting_like_headings_stay_in_the_paragraph():
+    text = "\n".join([
+        "The survey went to every household in the district, and the response was that",
+        "25 percent of respondents had never used the service before this year. Why",
+        "Part of the reason is that the service was only launched in the spring and",
+        "Section 230 of the Act was cited by several people who declined to answer.",
+    ])
+
+    blocks = main._text_blocks(text)
+
+    assert _headings(text) == []
+    assert len(blocks) == 1
+    assert "Section 230 of the Act" in blocks[0][1]
+
+
+def test_heading_pattern_mid_paragraph_is_not_split_out():
+    text = "\n".join([
+        "Results improved steadily over the course of the programme as more staff joined the",
+        "3 Regional teams",
+        "and the number of visits per week rose from around a dozen to more than forty.",
+    ])
+
+    assert _headings(text) == []
+    assert len(main._text_blocks(text)) == 1
+
+
+def test_paragraphs_split_at_blank_and_short_sentence_end_lines():
+    text = "\n".join([
+        "The first paragraph runs across two lines of text that are both of a full width",
+        "and ends here.",
+        "A second paragraph starts on the next line without any blank line in between it",
+        "and the previous one, and carries on to the end of the page without a full stop",
+    ])
+
+    assert [kind for kind, _ in main._text_blocks(text)] == ["p", "p"]
@@ -0,0 +1,83 @@
+import hashlib
+import os
+import signal
+import time
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from conftest import make_pdf
+
+AUTH = {"Authorization": "Bearer test-token"}
+
+
+def _alive(pid):
+    try:
+        state = Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()[0]
+    except FileNotFoundError:
+        return False
+    return state != "Z"
+
+
+@pytest.fixture
+def quarantine(tmp_path, monkeypatch):
+    q = main.Quarantine(tmp_path / "data" / "quarantine.txt")
+    monkeypatch.setattr(main, "QUARANTINE", q)
+    return q
+
+
+def test_deadline_kills_the_whole_process_group(tmp_path, monkeypatch):
+    pids = tmp_path / "pids"
+    monkeypatch.setenv("FAKE_CONVERT_HANG", str(pids))
+    monkeypatch.setattr(main, "CONVERT_TIMEOUT_SECONDS", 1)
+    pdf = tmp_path / "in.pdf"
+    pdf.write_bytes(make_pdf(marker="hang"))
+
+    t0 = time.monotonic()
+    with pytest.raises(main.ConversionTimeout):
+        main._convert_cold(pdf, tmp_path / "out.epub")
+
+    assert time.monotonic() - t0 < 10
+    converter, helper = (int(pid) for pid in pids.read_text().split())
+    deadline = time.monotonic() + 5  # SIGKILL reaches the orphaned helper asynchronously
+    while (survivors := [pid for pid in (converter, helper) if _alive(pid)]) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    for pid in survivors:
+        os.kill(pid, signal.SIGKILL)
+    assert survivors == []
+
+
+def test_timeout_is_504_and_quarantines_the_pdf(tmp_path, monkeypatch, quarantine):
+    monkeypatch.setenv("FAKE_CONVERT_HANG", str(tmp_path / "pids"))
+    monkeypatch.setattr(main, "CONVERT_TIMEOUT_SECONDS", 1)
+    pdf = make_pdf(marker="quarantine-me")
+
+    with TestClient(main.app) as client:
+        r = client.post("/convert", headers=AUTH, files={"file": ("slow.pdf", pdf, "application/pdf")})
+        assert r.status_code == 504, r.text
+        assert quarantine.path.read_text().split() == [hashlib.sha256(pdf).hexdigest()]
+
+        monkeypatch.delenv("FAKE_CONVERT_HANG")
+        again = client.post("/convert", headers=AUTH, files={"file": ("slow.pdf", pdf, "application/pdf")})
+
+    assert again.status_code == 422
+    assert "quarantined" in again.json()["detail"]
+
+    reloaded = main.Quarantine(quarantine.path)
+    reloaded.load()
+    assert hashlib.sha256(pdf).hexdigest() in reloaded
+
+
+def test_cpu_limit_is_422(monkeypatch, quarantine):
+    monkeypatch.setenv("FAKE_CONVERT_SPIN", "1")
+    monkeypatch.setattr(main, "CONVERT_MAX_CPU_SECONDS", 1)
+
+    with TestClient(main.app) as client:
+        r = client.post("/convert", headers=AUTH,
+                        files={"file": ("spin.pdf", make_pdf(marker="spin"), "application/pdf")})
+
+    assert r.status_code == 422, r.text
+    assert "CPU time" in r.json()["detail"]
+    assert not quarantine.path.exists()
@@ -0,0 +1,57 @@
+from fastapi.testclient import TestClient
+
+import main
+from conftest import make_pdf
+
+AUTH = {"Authorization": "Bearer test-token"}
+
+
+def _chunked(parts):
+    """A multipart body sent without Content-Length, so only the parser can enforce limits."""
+    boundary = "upload-test-boundary"
+    body = b""
+    for name, filename, data in parts:
+        disposition = f'form-data; name="{name}"' + (f'; filename="{filename}"' if filename else "")
+        headers = f"--{boundary}\r\nContent-Disposition: {disposition}\r\n"
+        if filename:
+            headers += "Content-Type: application/pdf\r\n"
+        body += headers.encode() + b"\r\n" + data + b"\r\n"
+    body += f"--{boundary}--\r\n".encode()
+
+    def stream():
+        for i in range(0, len(body), 64 * 1024):
+            yield body[i:i + 64 * 1024]
+
+    return {**AUTH, "Content-Type": f"multipart/form-data; boundary={boundary}"}, stream()
+
+
+def test_convert_rejects_file_parts_other_than_file(monkeypatch):
+    written = []
+    monkeypatch.setattr(main.StreamingUploadParser, "_flush",
+                        lambda self: written.extend(self._pending) or self._pending.clear())
+    headers, body = _chunked([("junk", "junk.pdf", b"x" * 1024 * 1024), ("file", "book.pdf", make_pdf())])
+
+    with TestClient(main.app) as client:
+        r = client.post("/convert", headers=headers, content=body)
+
+    assert r.status_code == 400
+    assert written == []
+
+
+def test_convert_limits_form_field_count():
+    fields = [(f"f{i}", None, b"v") for i in range(main.MAX_FORM_FIELDS + 1)]
+    headers, body = _chunked(fields + [("file", "book.pdf", make_pdf())])
+
+    with TestClient(main.app) as client:
+        r = client.post("/convert", headers=headers, content=body)
+
+    assert r.status_code == 413
+
+
+def test_convert_refuses_unknown_profiles():
+    with TestClient(main.app) as client:
+        r = client.post("/convert", headers=AUTH, data={"profile": "kindle-dx"},
+                        files={"file": ("book.pdf", make_pdf(marker="unknown-profile"), "application/pdf")})
+
+    assert r.status_code == 422
+    assert r.json()["detail"] == "Unknown profile; choose one of paperwhite, scribe, epub3"
@@ -0,0 +1,86 @@
+import time
+import zipfile
+
+import pytest
+
+import main
+from conftest import ROOT, make_pdf
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    """A one-worker warm pool running CALIBRE_WORKER_SCRIPT under a fake calibre-debug."""
+    monkeypatch.setattr(main, "CALIBRE_DEBUG_BIN", str(ROOT / "tests" / "fake-calibre-debug"))
+    pool = main.WarmCalibrePool(1)
+    monkeypatch.setattr(main, "WARM_CALIBRE", pool)
+    pool.start()
+    yield pool
+    pool.close()
+
+
+def _idle_worker(pool):
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if not pool._idle.empty():
+            return pool._idle.queue[0]
+        time.sleep(0.05)
+    raise AssertionError("warm worker never became ready")
+
+
+def _restart(pool):
+    """Replace the idle worker with one started under the current environment."""
+    _idle_worker(pool)
+    pool.checkout().kill()
+    pool._spawn()
+    return _idle_worker(pool)
+
+
+def _pdf(tmp_path, marker):
+    path = tmp_path / f"{marker}.pdf"
+    path.write_bytes(make_pdf(marker=marker))
+    return path
+
+
+def test_worker_converts_and_goes_back_to_the_pool(pool, tmp_path):
+    worker = _idle_worker(pool)
+
+    for name in ("first", "second"):
+        main._convert_one(_pdf(tmp_path, name), tmp_path / f"{name}.epub")
+        with zipfile.ZipFile(tmp_path / f"{name}.epub") as zf:
+            assert f"<dc:title>{name}</dc:title>" in zf.read("content.opf").decode()
+
+    assert worker.jobs == 2
+    assert list(pool._idle.queue) == [worker]
+
+
+def test_failed_conversion_keeps_the_worker(pool, tmp_path):
+    worker = _idle_worker(pool)
+
+    with pytest.raises(RuntimeError, match="Conversion failed"):
+        main._convert_one(tmp_path / "missing.pdf", tmp_path / "missing.epub")
+
+    assert worker.alive
+    assert list(pool._idle.queue) == [worker]
+
+
+def test_malformed_reply_kills_the_worker(pool, tmp_path, monkeypatch):
+    monkeypatch.setenv("FAKE_WORKER_GARBAGE", "1")
+    worker = _restart(pool)
+
+    with pytest.raises(RuntimeError, match="malformed reply"):
+        main._convert_one(_pdf(tmp_path, "garbled"), tmp_path / "garbled.epub")
+
+    assert not worker.alive
+    assert worker not in pool._idle.queue
+
+
+def test_deadline_kills_the_worker(pool, tmp_path, monkeypatch):
+    monkeypatch.setenv("FAKE_CONVERT_HANG", str(tmp_path / "pids"))
+    monkeypatch.setattr(main, "CONVERT_TIMEOUT_SECONDS", 1)
+    worker = _restart(pool)
+
+    with pytest.raises(main.ConversionTimeout):
+        main._convert_one(_pdf(tmp_path, "hang"), tmp_path / "hang.epub")
+
+    assert not worker.alive
+    assert worker not in pool._idle.queue